@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+'''
+Micro-benchmark for the per-image CPU path of dcm2png.py (border cropping
+and resizing), using synthetic 16-bit radiographs so no DICOM data is needed.
+
+Usage: python benchmark.py [--size 3000] [--repeats 10]
+'''
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from dcm2png import crop_border, normalize, resize_to_uint8
+
+
+def make_image(size, border, rng):
+    # 16-bit noise with a black frame around it, like a scanned film
+    img = np.zeros((size, size), dtype=np.uint16)
+    img[border:-border, border:-border] = rng.integers(1000, 4096, (size - 2 * border, size - 2 * border))
+    return img
+
+
+def time_it(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='dcm2png micro-benchmark')
+    parser.add_argument('--size', type=int, default=3000, help="edge length of the synthetic images")
+    parser.add_argument('--border', type=int, default=150, help="width of the black frame to crop")
+    parser.add_argument('--repeats', type=int, default=10, help="number of timed runs per step")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    raw = make_image(args.size, args.border, rng)
+    img = normalize(raw, 0, 4095)
+    cropped = img[args.border:-args.border, args.border:-args.border]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert crop_border(img, crop_black=True, th=0.1).shape == cropped.shape
+        results = {
+            'normalize': time_it(lambda: normalize(raw, 0, 4095), args.repeats),
+            'crop_border': time_it(lambda: crop_border(img, crop_black=True, th=0.1), args.repeats),
+            'resize_to_uint8 (gray)': time_it(lambda: resize_to_uint8(cropped, [512, 512], rgb=False), args.repeats),
+            'resize_to_uint8 (rgb)': time_it(lambda: resize_to_uint8(cropped, [512, 512], rgb=True), args.repeats),
+        }
+
+    print(f'{args.size}x{args.size} uint16, median of {args.repeats} runs')
+    for name, ms in results.items():
+        print(f'{name:<24} {ms:8.1f} ms')
@@ -1,17 +1,32 @@
 #!/usr/bin/env python
 # coding: utf-8
 import argparse
+import csv
 import os
 import random
-from multiprocessing import Pool
 import sys
+import threading
+import time
+from functools import partial
+from multiprocessing import Pool
 
 import imageio
 import numpy as np
-import pandas as pd
 import pydicom
 import scipy.ndimage
 
+from dicom_header_cache import DicomHeaderCache, read_dicom_header
+
+
+def normalize(img, vmin, vmax):
+    '''
+    Scale img so that [vmin, vmax] maps to [0, 1], computed in float32
+    '''
+    img = img.astype(np.float32)
+    img -= vmin
+    img /= vmax - vmin
+    return img
+
 
 def read_general(dcm):
     img = dcm.pixel_array
@@ -33,7 +48,7 @@ def read_general(dcm):
         vmin = img.min()
         vmax = img.max()
     
-    return (img - vmin) / (vmax - vmin)
+    return normalize(img, vmin, vmax)
 
 
 def read_fuji_iray(dcm):
@@ -49,7 +64,7 @@ def read_fuji_iray(dcm):
         vmin = img.min()
         vmax = img.max()
     
-    return 1 - (img - vmin) / (vmax - vmin)
+    return 1 - normalize(img, vmin, vmax)
 
 
 def read_swissray(dcm):
@@ -65,7 +80,7 @@ def read_swissray(dcm):
         vmin = img.min()
         vmax = img.max()
     
-    return (img - vmin) / (vmax - vmin)
+    return normalize(img, vmin, vmax)
 
 
 def read_ge(dcm):
@@ -82,21 +97,25 @@ def read_ge(dcm):
         else:
             vmin = dcm.WindowCenter[2] - dcm.WindowWidth[2] / 2
             vmax = dcm.WindowCenter[2] + dcm.WindowWidth[2] / 2
-        img = (img - vmin) / (vmax - vmin)
+        img = normalize(img, vmin, vmax)
     else:
         img = pydicom.pixel_data_handlers.util.apply_voi_lut(img, dcm)
-        img = (img - img.min()) / (img.max() - img.min())
+        img = normalize(img, img.min(), img.max())
     
     return img
 
 
+def is_text_manufacturer(manufacturer):
+    # these are texts
+    return 'altamont' in manufacturer or 'lexmark' in manufacturer or 'pacsgear' in manufacturer
+
+
 def read_by_manufacturer(dcm):
     if not hasattr(dcm, 'PixelData'):
         return None
     
     manufacturer = dcm.Manufacturer.lower()
-    if 'altamont' in manufacturer or 'lexmark' in manufacturer or 'pacsgear' in manufacturer:
-        # these are texts
+    if is_text_manufacturer(manufacturer):
         return None;
     elif 'ge health' in manufacturer or 'ge medical' in manufacturer:
         return read_ge(dcm)
@@ -111,36 +130,14 @@ def read_by_manufacturer(dcm):
             return None
 
 
-# parameters
-parser = argparse.ArgumentParser(description = 'CXR Preprocess')
-
-parser.add_argument('--input_dir', type=str, required=True, help="input CXR dicom directory")
-parser.add_argument('--output_dir', type=str, required=True, help="output directory")
-parser.add_argument('--output_folder', type=str, required=True, help="folder of output CXR png files")
-parser.add_argument('--crop_black', action='store_true', help="try to crop black borders")
-parser.add_argument('--crop_white', action='store_true', help="try to crop black borders")
-parser.add_argument('--crop_th', type=float, default=0.5, help="threshold for cropping borders")
-
-
-args = parser.parse_args()
-input_dir = args.input_dir
-img_shape = [512, 512] # output image shape
-output_dir = args.output_dir
-output_folder = args.output_folder
-npy_dir = os.path.join(output_dir, 'npys')
-output_folder = args.output_folder
-png_dir = os.path.join(output_dir,output_folder)
-if not os.path.exists(npy_dir):
-    os.makedirs(npy_dir)
-if not os.path.exists(png_dir):
-    os.makedirs(png_dir)
-
-file_list = [
-    os.path.join(dirpath, filename)
-    for dirpath, dirnames, filenames in os.walk(input_dir)
-    for filename in filenames
-    if filename.lower().endswith('.dcm')
-]
+def iter_dicom_files(input_dir):
+    '''
+    Lazily yield the paths of all .dcm files under input_dir
+    '''
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        for filename in filenames:
+            if filename.lower().endswith('.dcm'):
+                yield os.path.join(dirpath, filename)
 
 
 # data analysis
@@ -157,10 +154,25 @@ fields_to_record = [
     'AcquisitionDeviceProcessingDescription']
 
 
-def read_single_file(filename, fields_to_record, exclusion):
-    dcm = pydicom.dcmread(filename)
+def read_header(filename, fields_to_record, exclusion, header_cache=None):
+    '''
+    Phase 1: parse the header only (stopping before PixelData, or from
+    header_cache), apply the exclusion rules and return the recorded fields,
+    or None if excluded
+    '''
+    dcm = read_dicom_header(filename, header_cache)
     if not hasattr(dcm, 'ImageType'):
-        return None, None
+        return None
+    
+    for field_name in exclusion:
+        if hasattr(dcm, field_name):
+            attr = str(getattr(dcm, field_name)).lower()
+            for k in exclusion[field_name]:
+                if k in attr:
+                    return None
+    
+    if is_text_manufacturer(str(getattr(dcm, 'Manufacturer', '')).lower()):
+        return None
     
     # extract fields
     infos = {}
@@ -170,14 +182,24 @@ def read_single_file(filename, fields_to_record, exclusion):
         else:
             infos[field_name] = ''
     
-    for field_name in exclusion:
-        if hasattr(dcm, field_name):
-            attr = str(getattr(dcm, field_name)).lower()
-            for k in exclusion[field_name]:
-                if k in attr:
-                    return None, None
+    return infos
+
+
+def read_pixels(filename):
+    '''
+    Phase 2: read the full file and decode the pixels, only for files that
+    survived read_header
+    '''
+    dcm = pydicom.dcmread(filename)
+    return read_by_manufacturer(dcm)
+
+
+def read_single_file(filename, fields_to_record, exclusion, header_cache=None):
+    infos = read_header(filename, fields_to_record, exclusion, header_cache)
+    if infos is None:
+        return None, None
     
-    img = read_by_manufacturer(dcm)
+    img = read_pixels(filename)
     if img is None:
         return None, None
     
@@ -186,36 +208,46 @@ def read_single_file(filename, fields_to_record, exclusion):
 
 def crop_border(img, crop_black, th):
     print(f'crop image: shape={img.shape}, min={np.min(img)}, max={np.max(img)}, th={th}', )
-    invalid_index = []
-    for x in range(img.shape[0]):
-        if crop_black:
-            arr = img[x, :] < th
-        else:
-            arr = img[x, :] > th
-        if np.sum(arr) == img.shape[1]:
-            invalid_index.append(x)
-    assert len(invalid_index) < img.shape[1], f'all pixels in x axis would be removed with th={th}!'
-    img = np.delete(img, invalid_index, axis=0)
-    print(f'crop x: removing {len(invalid_index)} pixels')
-
-    invalid_index = []
-    for y in range(img.shape[1]):
-        if crop_black:
-            arr = img[:, y] < th
-        else:
-            arr = img[:, y] > th
-        if np.sum(arr) == img.shape[0]:
-            invalid_index.append(y)
-    assert len(invalid_index) < img.shape[0], f'all pixels in y axis would be removed with th={th}!'
-    img = np.delete(img, invalid_index, axis=1)
-    print(f'crop y: removing {len(invalid_index)} pixels')
+    if crop_black:
+        mask = img < th
+    else:
+        mask = img > th
+
+    rows = np.flatnonzero(~mask.all(axis=1))
+    assert len(rows) > 0, f'all pixels in x axis would be removed with th={th}!'
+    x0, x1 = rows[0], rows[-1] + 1
+    print(f'crop x: removing {img.shape[0] - (x1 - x0)} pixels')
+
+    cols = np.flatnonzero(~mask[x0:x1].all(axis=0))
+    assert len(cols) > 0, f'all pixels in y axis would be removed with th={th}!'
+    y0, y1 = cols[0], cols[-1] + 1
+    print(f'crop y: removing {img.shape[1] - (y1 - y0)} pixels')
+
+    return img[x0:x1, y0:y1]
+
 
+def resize_to_uint8(img, img_shape, rgb=True):
+    '''
+    Anti-aliased resize of a [0, 1] image to img_shape, returned as uint8
+    (H x W x 3 if rgb, otherwise H x W). Works in float32 throughout.
+    '''
+    # apply a prefilter to the image when downsampling
+    zoom = np.array(img_shape) / np.array(img.shape)
+    stds = 1 / zoom / 4
+    img = scipy.ndimage.gaussian_filter(img, stds, output=np.float32)
+    # the gaussian already band-limits the image, so linear interpolation is enough
+    img = scipy.ndimage.zoom(img, zoom, output=np.float32, order=1, prefilter=False)
+    np.clip(img, 0, 1, out=img)
+    img *= 255
+    img = img.astype(np.uint8)
+    if rgb:
+        img = np.repeat(img[..., np.newaxis], 3, axis=2)
     return img
 
 
 def process_file(file_path, fields_to_record, exclusion, npy_dir, png_dir, img_shape,
-                   crop_black=False, crop_white=False, crop_th=0.5):
-    img, info = read_single_file(file_path, fields_to_record, exclusion)
+                   crop_black=False, crop_white=False, crop_th=0.5, rgb=True, header_cache=None):
+    img, info = read_single_file(file_path, fields_to_record, exclusion, header_cache)
     if img is None or info is None:
         return None
 
@@ -241,48 +273,94 @@ def process_file(file_path, fields_to_record, exclusion, npy_dir, png_dir, img_s
     if crop_white:
         img = crop_border(img, crop_black=False, th=crop_th)
 
-    # save image
-    # apply a prefilter to the image when downsampling
-    zoom = np.array(img_shape) / np.array(img.shape)
-    stds = 1 / zoom / 4
-    img = scipy.ndimage.filters.gaussian_filter1d(img, stds[0], axis=0)
-    img = scipy.ndimage.filters.gaussian_filter1d(img, stds[1], axis=1)
-    img = scipy.ndimage.interpolation.zoom(img, zoom)
-    # convert to rgb
-    img[img < 0] = 0
-    img[img > 1] = 1
-    img = np.tile(img[..., np.newaxis], (1,1,3)) * 255
-    imageio.imwrite(os.path.join(png_dir, output_filename+'.png'), img.astype(np.uint8))
+    img = resize_to_uint8(img, img_shape, rgb=rgb)
+    imageio.imwrite(os.path.join(png_dir, output_filename+'.png'), img)
 
     return info
 
 
-def process_file_wrapper(file_path, crop_black=False, crop_white=False, crop_th=130):
-    return process_file(file_path, fields_to_record, exclusion, npy_dir, png_dir, img_shape,
-                        crop_black=args.crop_black, crop_white=args.crop_white, crop_th=args.crop_th)
+def process_file_with_size(file_path, **kwargs):
+    return os.path.getsize(file_path), process_file(file_path, **kwargs)
 
 
-if __name__ == '__main__':
+def bounded(iterable, semaphore):
+    '''
+    Yield from iterable, blocking while too many items are in flight.
+    The consumer releases the semaphore once per finished item.
+    '''
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = 'CXR Preprocess')
+
+    parser.add_argument('--input_dir', type=str, required=True, help="input CXR dicom directory")
+    parser.add_argument('--output_dir', type=str, required=True, help="output directory")
+    parser.add_argument('--output_folder', type=str, required=True, help="folder of output CXR png files")
+    parser.add_argument('--crop_black', action='store_true', help="try to crop black borders")
+    parser.add_argument('--crop_white', action='store_true', help="try to crop black borders")
+    parser.add_argument('--crop_th', type=float, default=0.5, help="threshold for cropping borders")
+    parser.add_argument('--grayscale', action='store_true', help="write single-channel png files instead of RGB")
+    parser.add_argument('--header_cache', type=str, default=None, help="sqlite file caching DICOM headers across runs")
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--chunksize', type=int, default=4, help="number of files handed to a worker at a time")
+    parser.add_argument('--report_every', type=int, default=100, help="print progress every N files")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
     if args.crop_black and args.crop_white:
         print("Either use --crop_black or --crop_white but not both together.", file=sys.stderr)
         sys.exit(1)
-    if not file_list:
-        print("No input files found at .", file=sys.stderr)
-        sys.exit(1)
-
-    p = Pool(20)
-    # folder_list = folder_list[-20:]
-    print(len(file_list))
-    infos = []
-    batch_size = 100
-    for i in range(0, len(file_list), batch_size):
-        print(i, end=',', flush=True)
-        infos += p.map(process_file_wrapper, file_list[i:i+batch_size])
-    print(len(file_list))
 
-    df = pd.DataFrame()
-    for info in infos:
-        df = df.append(info, ignore_index=True)
-    df.to_csv(os.path.join(png_dir, "manifest.csv"), index=False)
+    img_shape = [512, 512] # output image shape
+    npy_dir = os.path.join(args.output_dir, 'npys')
+    png_dir = os.path.join(args.output_dir, args.output_folder)
+    if not os.path.exists(npy_dir):
+        os.makedirs(npy_dir)
+    if not os.path.exists(png_dir):
+        os.makedirs(png_dir)
+
+    worker = partial(process_file_with_size, fields_to_record=fields_to_record, exclusion=exclusion,
+                     npy_dir=npy_dir, png_dir=png_dir, img_shape=img_shape,
+                     crop_black=args.crop_black, crop_white=args.crop_white, crop_th=args.crop_th,
+                     rgb=not args.grayscale,
+                     header_cache=DicomHeaderCache(args.header_cache) if args.header_cache else None)
+    # cap the number of paths queued ahead of the workers so memory stays flat on huge corpora
+    in_flight = threading.BoundedSemaphore(args.num_workers * args.chunksize * 4)
+
+    num_files = 0
+    num_written = 0
+    num_bytes = 0
+    start_time = time.time()
+    with open(os.path.join(png_dir, "manifest.csv"), 'w', newline='') as manifest, \
+            Pool(args.num_workers) as p:
+        writer = csv.DictWriter(manifest, fieldnames=fields_to_record + ['label', 'filename'])
+        writer.writeheader()
+        files = bounded(iter_dicom_files(args.input_dir), in_flight)
+        for file_size, info in p.imap_unordered(worker, files, chunksize=args.chunksize):
+            in_flight.release()
+            num_files += 1
+            num_bytes += file_size
+            if info is not None:
+                writer.writerow(info)
+                num_written += 1
+            if num_files % args.report_every == 0:
+                elapsed = max(time.time() - start_time, 1e-9)
+                print(f'processed {num_files} files ({num_written} written): '
+                      f'{num_files / elapsed:.1f} files/s, {num_bytes / elapsed / 2**20:.1f} MB/s', flush=True)
+
+    if not num_files:
+        print("No input files found at %s." % args.input_dir, file=sys.stderr)
+        sys.exit(1)
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f'done: {num_files} files ({num_written} written) in {elapsed:.1f}s, '
+          f'{num_files / elapsed:.1f} files/s, {num_bytes / elapsed / 2**20:.1f} MB/s')
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+'''
+Persistent on-disk cache of DICOM headers.
+
+Headers are stored in a SQLite database in the DICOM JSON model, keyed by
+(absolute path, size, mtime), so repeated runs over an unchanged input
+directory skip parsing entirely and only new or modified files are read.
+Since the whole header is cached, any tag selection can be served from it.
+'''
+import json
+import os
+import sqlite3
+
+import pydicom
+
+
+def _number_string_entries(dataset, json_dict):
+    '''
+    Yield the (element, JSON entry) pairs of the DS and IS elements of dataset,
+    including those nested in sequences
+    '''
+    for elem in dataset:
+        entry = json_dict.get(f'{elem.tag:08X}')
+        if entry is None or 'Value' not in entry:
+            continue
+        if elem.VR == 'SQ':
+            for item, item_json in zip(elem.value, entry['Value']):
+                yield from _number_string_entries(item, item_json)
+        elif elem.VR in ('DS', 'IS'):
+            yield elem, entry
+
+
+def header_to_json(dcm):
+    '''
+    The JSON model stores DS and IS values as numbers, which would read back
+    formatted differently ("5.0" instead of "5.000000"), so they are stored as
+    the strings written in the file, for cached headers to read the same as
+    freshly parsed ones
+    '''
+    json_dict = dcm.to_json_dict()
+    for elem, entry in _number_string_entries(dcm, json_dict):
+        values = elem.value if elem.VM > 1 else [elem.value]
+        entry['Value'] = [
+            None if value is None else getattr(value, 'original_string', str(value)) for value in values
+        ]
+    return json.dumps(json_dict)
+
+
+def header_from_json(header):
+    json_dict = json.loads(header)
+    dcm = pydicom.Dataset.from_json(json_dict)
+    # from_json converts the DS and IS strings back to numbers, so set them again
+    for elem, entry in _number_string_entries(dcm, json_dict):
+        elem.value = entry['Value'] if len(entry['Value']) > 1 else entry['Value'][0]
+    return dcm
+
+
+class DicomHeaderCache:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        # sqlite connections cannot be pickled or shared with worker processes
+        return {'db_path': self.db_path, '_conn': None, '_pid': None}
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            # WAL lets the worker processes read concurrently while one of them writes
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS headers '
+                '(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, header TEXT)'
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def read_header(self, filename):
+        '''
+        Return the header of filename (without PixelData) as a pydicom Dataset,
+        parsing the file only if it is not cached or has changed since
+        '''
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            'SELECT header FROM headers WHERE path = ? AND size = ? AND mtime_ns = ?',
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None:
+            return header_from_json(row[0])
+
+        dcm = pydicom.dcmread(path, stop_before_pixels=True)
+        try:
+            header = header_to_json(dcm)
+        except Exception:
+            # headers that pydicom cannot serialize are simply not cached
+            return dcm
+        self.conn.execute(
+            'INSERT OR REPLACE INTO headers (path, size, mtime_ns, header) VALUES (?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, header),
+        )
+        return dcm
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_dicom_header(filename, header_cache=None):
+    '''
+    Read the header of filename, through header_cache if one is given
+    '''
+    if header_cache is None:
+        return pydicom.dcmread(filename, stop_before_pixels=True)
+    return header_cache.read_header(filename)
@@ -1,17 +1,35 @@
 import csv
 import json
+import os
 from dataclasses import dataclass
+from functools import partial
+from multiprocessing import Pool
 from pathlib import Path
 
 import funcy
 import pydicom
 
+from dicom_header_cache import DicomHeaderCache
+
 
 @dataclass(frozen=True)
 class RunParams:
     dicom_id_field: str
     dicom_id_attribute: str
     tags_to_extract: list[str]
+    header_cache_path: str | None = None
+
+
+def read_tags(file_path, dicom_id_attribute, tags_to_extract, header_cache=None):
+    """Read only the needed header tags of a DICOM file, returning (id, {tag_name: value})."""
+    if header_cache is not None:
+        # The cache keeps whole headers, so changing tags_to_extract doesn't invalidate it.
+        dcm = header_cache.read_header(file_path)
+    else:
+        dcm = pydicom.dcmread(
+            file_path, stop_before_pixels=True, specific_tags=[dicom_id_attribute, *tags_to_extract]
+        )
+    return dcm[dicom_id_attribute].value, {tag_name: dcm.get(tag_name) for tag_name in tags_to_extract}
 
 
 def main():
@@ -33,38 +51,40 @@ def main():
     print("Extracting DICOM tags: " + ", ".join(run_params.tags_to_extract))
 
     dicom_input_dir_path = Path("/input/dicom_data")
-    dicom_file_paths = list(dicom_input_dir_path.rglob("*.[dD][cC][mM]"))
-    dicoms = [pydicom.dcmread(file_path) for file_path in dicom_file_paths]
-
-    print(f"Read {len(dicoms)} DICOM files from {str(dicom_input_dir_path)}.")
-
-    id2dicom = {dcm[run_params.dicom_id_attribute].value: dcm for dcm in dicoms}
-
-    def add_fields(row):
-        dicom = id2dicom.get(row[run_params.dicom_id_field])
-        if dicom is None:
-            extracted = {tag_name: None for tag_name in run_params.tags_to_extract}
-        else:
-            extracted = {tag_name: dicom.get(tag_name) for tag_name in run_params.tags_to_extract}
-        new_row = {**row, **extracted}
-        return new_row
-
-    with Path("/input/dataset.csv").open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        input_field_names = reader.fieldnames
-        input_data = list(reader)
-
-    output_field_names = funcy.ldistinct([*input_field_names, *run_params.tags_to_extract])
-    output_data = [add_fields(row) for row in input_data]
-
+    dicom_file_paths = dicom_input_dir_path.rglob("*.[dD][cC][mM]")
+    read_file_tags = partial(
+        read_tags,
+        dicom_id_attribute=run_params.dicom_id_attribute,
+        tags_to_extract=run_params.tags_to_extract,
+        header_cache=DicomHeaderCache(run_params.header_cache_path) if run_params.header_cache_path else None,
+    )
+    # Only the extracted tag values are kept, so memory scales with the number of IDs rather than DICOM bytes.
+    # imap (rather than imap_unordered) keeps "last file wins" for duplicate IDs deterministic.
+    with Pool(os.cpu_count()) as pool:
+        id2tags = {}
+        num_dicoms = 0
+        for dicom_id, extracted in pool.imap(read_file_tags, dicom_file_paths, chunksize=16):
+            id2tags[dicom_id] = extracted
+            num_dicoms += 1
+
+    print(f"Read {num_dicoms} DICOM files from {str(dicom_input_dir_path)}.")
+
+    missing = {tag_name: None for tag_name in run_params.tags_to_extract}
     output_csv_path = Path("/output/dataset.csv")
-    with output_csv_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=output_field_names)
+    num_rows = 0
+    with Path("/input/dataset.csv").open("r", newline="", encoding="utf-8") as in_f, output_csv_path.open(
+        "w", newline="", encoding="utf-8"
+    ) as out_f:
+        reader = csv.DictReader(in_f)
+        output_field_names = funcy.ldistinct([*reader.fieldnames, *run_params.tags_to_extract])
+        writer = csv.DictWriter(out_f, fieldnames=output_field_names)
         writer.writeheader()
-        for row in output_data:
-            writer.writerow(row)
+        for row in reader:
+            extracted = id2tags.get(row[run_params.dicom_id_field], missing)
+            writer.writerow({**row, **extracted})
+            num_rows += 1
 
-    print(f"Done. Wrote CSV file to {str(output_csv_path)} with {len(output_data)} rows.")
+    print(f"Done. Wrote CSV file to {str(output_csv_path)} with {num_rows} rows.")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,29 @@
+import json
+
 import pandas as pd
 
+from streaming_merge import merge_csv_files
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def read_run_params():
+    """Run-time parameters: "streaming" to merge chunk by chunk instead of loading both inputs, and "chunksize" (rows per chunk)"""
+    try:
+        with open("/input/run_params.json") as params_file:
+            return json.load(params_file)
+    except FileNotFoundError:
+        return {}
+
+
 if __name__ == "__main__":
-    first = pd.read_csv("/input/0/dataset.csv")
-    second = pd.read_csv("/input/1/dataset.csv")
-    merged = pd.concat([first, second], ignore_index=True, axis=0)
-    merged.to_csv("/output/0/dataset.csv", index=False)
+    run_params = read_run_params()
+    chunksize = int(run_params.get("chunksize", DEFAULT_CHUNKSIZE))
+    input_paths = ["/input/0/dataset.csv", "/input/1/dataset.csv"]
+    if run_params.get("streaming", False):
+        merge_csv_files(input_paths, "/output/0/dataset.csv", chunksize=chunksize)
+    else:
+        first = pd.read_csv(input_paths[0])
+        second = pd.read_csv(input_paths[1])
+        merged = pd.concat([first, second], ignore_index=True, axis=0)
+        merged.to_csv("/output/0/dataset.csv", index=False)
@@ -1,19 +1,37 @@
+import json
 import os
+
 import pandas as pd
 
+from streaming_merge import merge_csv_files
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def read_run_params():
+    """Run-time parameters: "streaming" to merge chunk by chunk instead of loading all inputs, and "chunksize" (rows per chunk)"""
+    try:
+        with open("/input/run_params.json") as params_file:
+            return json.load(params_file)
+    except FileNotFoundError:
+        return {}
+
+
 if __name__ == "__main__":
+    run_params = read_run_params()
+    chunksize = int(run_params.get("chunksize", DEFAULT_CHUNKSIZE))
     # Assume that all datasets are under /input/0 as multiple inputs, meaning that each of these datasets is
     # represented by a subdirectory under /input/0 (e.g. /input/0/abcdef-123456/dataset.csv)
     input_dirs = [f.path for f in os.scandir("/input/0") if f.is_dir() and os.path.isfile(f.path + "/dataset.csv")]
     print(f"Found {len(input_dirs)} directories under /input/0: {input_dirs}")
 
-    input_dfs = []
-    for input_dir in input_dirs:
-        input_df = pd.read_csv(input_dir + "/dataset.csv")
-        input_dfs.append(input_df)
-    print(f"Going to merge {len(input_dfs)} datasets")
+    print(f"Going to merge {len(input_dirs)} datasets")
 
-    if input_dirs:
+    if input_dirs and run_params.get("streaming", False):
+        input_paths = [input_dir + "/dataset.csv" for input_dir in input_dirs]
+        merge_csv_files(input_paths, "/output/0/dataset.csv", chunksize=chunksize)
+    elif input_dirs:
+        input_dfs = [pd.read_csv(input_dir + "/dataset.csv") for input_dir in input_dirs]
         merged = pd.concat(input_dfs, ignore_index=True, axis=0)
         merged.to_csv("/output/0/dataset.csv", index=False)
     else:
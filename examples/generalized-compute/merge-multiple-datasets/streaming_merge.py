@@ -0,0 +1,27 @@
+"""
+Out-of-core merge of CSV datasets.
+
+The union of the input headers is collected first from a header-only pass, then rows are copied to the output
+chunk by chunk, aligned to the union of columns and with missing columns left empty. Memory use is bounded by the
+chunk size rather than by the size of the inputs. Values are copied as text, so they are not re-formatted.
+"""
+import pandas as pd
+
+
+def read_header_union(input_paths):
+    columns = []
+    for path in input_paths:
+        for column in pd.read_csv(path, nrows=0).columns:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def merge_csv_files(input_paths, output_path, chunksize=100_000):
+    """Concatenate the CSV files in input_paths into output_path, streaming chunksize rows at a time."""
+    columns = read_header_union(input_paths)
+    with open(output_path, "w", newline="", encoding="utf-8") as out:
+        pd.DataFrame(columns=columns).to_csv(out, index=False)
+        for path in input_paths:
+            for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize):
+                chunk.reindex(columns=columns).to_csv(out, header=False, index=False)
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 import argparse
-from cryptography.fernet import Fernet
 import logging
 import json
+import os
 import sys
 
+from chunked_fernet import decrypt_file
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 if __name__ == "__main__":
@@ -34,19 +36,9 @@ if __name__ == "__main__":
 
     key = run_params[key_identifier]
 
-    fernet = Fernet(key)
-
-    logging.info(f"Decrypting input file '{args.input_filename}'")
-    with open(args.input_filename, 'rb') as input_file:
-        encrypted = input_file.read()
-        logging.info(f"Read {len(encrypted)} bytes of encrypted content")
-
-    decrypted = fernet.decrypt(encrypted)
-    logging.info(f"Decrypted contents resulted in {len(decrypted)} bytes")
-
-    logging.info(f"Writing decrypted contents to output file '{args.output_filename}'")
-    with open(args.output_filename, 'wb') as output_file:
-        output_file.write(decrypted)
+    logging.info(f"Decrypting input file '{args.input_filename}' ({os.path.getsize(args.input_filename)} bytes)")
+    decrypt_file(key, args.input_filename, args.output_filename)
+    logging.info(f"Wrote {os.path.getsize(args.output_filename)} bytes of decrypted contents to output file '{args.output_filename}'")
 
     logging.info("Done")
     sys.exit(0)
@@ -1,21 +1,196 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
 
 DEFAULT_NUM_PARTS = 3
+DEFAULT_CHUNKSIZE = 100_000
+SPLIT_MODES = ('range', 'hash', 'stratified')
+OUTPUT_FORMATS = ('csv', 'parquet')
+INPUT_PATH = '/input/0/dataset.csv'
+
+
+ARROW_TYPES = {'int64': 'int64', 'float64': 'float64', 'bool': 'bool_', 'str': 'string'}
+
+
+class PartWriter:
+    """
+    Appends chunks of one output part to its file, creating it (with the header / schema of
+    the input) up front so that parts which receive no rows are still written.
+    """
+
+    def __init__(self, dirpath, output_format, columns, dtypes=None):
+        os.mkdir(dirpath)
+        self.output_format = output_format
+        if output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._pa = pa
+            self.schema = pa.schema([(column, getattr(pa, ARROW_TYPES[dtypes[column]])()) for column in columns])
+            self._writer = pq.ParquetWriter(os.path.join(dirpath, 'dataset.parquet'), self.schema)
+        else:
+            self._file = open(os.path.join(dirpath, 'dataset.csv'), 'w', newline='')
+            pd.DataFrame(columns=columns).to_csv(self._file, index=False)
+
+    def write(self, df):
+        if self.output_format == 'parquet':
+            table = self._pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self._file, header=False, index=False)
+
+    def close(self):
+        if self.output_format == 'parquet':
+            self._writer.close()
+        else:
+            self._file.close()
+
+
+def count_rows(path, chunksize):
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], chunksize=chunksize))
+
+
+def infer_dtypes(path, chunksize, text_columns):
+    """
+    First pass over the input, resolving a single dtype for each column, since pandas infers them separately for
+    each chunk (e.g. integers become floats in the chunks with a missing value). Returns the dtypes and row count.
+    """
+    kinds = {}
+    has_nulls = set()
+    num_rows = 0
+    for chunk in pd.read_csv(path, dtype={column: str for column in text_columns}, chunksize=chunksize):
+        num_rows += len(chunk)
+        for column, values in chunk.items():
+            nulls = values.isna()
+            if nulls.any():
+                has_nulls.add(column)
+            if not nulls.all():
+                kinds.setdefault(column, set()).add(values.dtype.kind)
+
+    dtypes = {}
+    for column in pd.read_csv(path, nrows=0).columns:
+        # Columns without any value are read as floats, as pandas does
+        column_kinds = kinds.get(column, {'f'})
+        if column in text_columns:
+            dtypes[column] = 'str'
+        elif column_kinds == {'i'} and column not in has_nulls:
+            dtypes[column] = 'int64'
+        elif column_kinds <= {'i', 'u', 'f'}:
+            dtypes[column] = 'float64'
+        elif column_kinds == {'b'} and column not in has_nulls:
+            dtypes[column] = 'bool'
+        else:
+            dtypes[column] = 'str'
+    return dtypes, num_rows
+
+
+class RangeRouter:
+    """Contiguous ranges of rows, with the same part sizes as np.array_split."""
+
+    def __init__(self, num_rows, num_parts):
+        sizes = np.full(num_parts, num_rows // num_parts)
+        sizes[:num_rows % num_parts] += 1
+        self.part_ends = np.cumsum(sizes)
+        self.row_offset = 0
+
+    def __call__(self, chunk):
+        row_index = np.arange(self.row_offset, self.row_offset + len(chunk))
+        self.row_offset += len(chunk)
+        return np.searchsorted(self.part_ends, row_index, side='right')
+
+
+class HashRouter:
+    """Stable hash of a key column, so rows with the same key (e.g. a patient) always land in the same part."""
+
+    def __init__(self, key_column, num_parts):
+        self.key_column = key_column
+        self.num_parts = num_parts
+
+    def __call__(self, chunk):
+        # The key column is read as text, so a key hashes the same in every chunk.
+        # hash_pandas_object uses a fixed hash key, so the assignment is the same across runs and machines.
+        hashes = pd.util.hash_pandas_object(chunk[self.key_column].astype(str), index=False).to_numpy()
+        return (hashes % np.uint64(self.num_parts)).astype(np.int64)
+
+
+class StratifiedRouter:
+    """Deals the rows of each label value round-robin across the parts, so every part gets the same label mix."""
+
+    def __init__(self, label_column, num_parts):
+        self.label_column = label_column
+        self.num_parts = num_parts
+        self.label_counts = {}
+
+    def __call__(self, chunk):
+        labels = chunk[self.label_column].astype(str)
+        offsets = labels.map(self.label_counts).fillna(0).astype(np.int64)
+        part_ids = (offsets + labels.groupby(labels).cumcount()) % self.num_parts
+        for label, count in labels.value_counts().items():
+            self.label_counts[label] = self.label_counts.get(label, 0) + count
+        return part_ids.to_numpy()
+
+
+def make_router(params, num_parts, chunksize, num_rows=None):
+    mode = params.get('mode', 'range')
+    if mode == 'range':
+        if num_rows is None:
+            num_rows = count_rows(INPUT_PATH, chunksize)
+        print(f"Counted {num_rows} rows")
+        return RangeRouter(num_rows, num_parts)
+    if mode == 'hash':
+        return HashRouter(params['key_column'], num_parts)
+    return StratifiedRouter(params['label_column'], num_parts)
+
+
+def split_dataset(params, num_parts):
+    chunksize = int(params.get('chunksize', DEFAULT_CHUNKSIZE))
+    output_format = params.get('output_format', 'csv')
+    mode = params.get('mode', 'range')
+    # The columns rows are routed by are always read as text, so that the same value routes the same way in every chunk
+    text_columns = [params['key_column']] if mode == 'hash' else [params['label_column']] if mode == 'stratified' else []
+    columns = list(pd.read_csv(INPUT_PATH, nrows=0).columns)
+    if output_format == 'parquet':
+        dtypes, num_rows = infer_dtypes(INPUT_PATH, chunksize, text_columns)
+        read_options = {'dtype': dtypes}
+    else:
+        # Values are copied as text, so they are not re-formatted
+        dtypes, num_rows = None, None
+        read_options = {'dtype': str, 'keep_default_na': False}
+    router = make_router(params, num_parts, chunksize, num_rows)
+
+    writers = [PartWriter(f"/output/0/part_{index}/", output_format, columns, dtypes) for index in range(num_parts)]
+    num_rows = 0
+    with ThreadPoolExecutor(max_workers=min(num_parts, os.cpu_count() or 1)) as executor:
+        for chunk in pd.read_csv(INPUT_PATH, chunksize=chunksize, **read_options):
+            part_ids = router(chunk)
+            # Each part has its own file, so the parts of a chunk can be written concurrently.
+            # Waiting for them before reading the next chunk keeps memory bounded and the row order within each part.
+            futures = [
+                executor.submit(writers[part_id].write, part)
+                for part_id, part in chunk.groupby(part_ids, sort=False)
+            ]
+            for future in futures:
+                future.result()
+            num_rows += len(chunk)
+
+    for writer in writers:
+        writer.close()
+    print(f"Split dataset (len={num_rows}) into {num_parts} parts")
+
 
 if __name__ == '__main__':
     print("Starting")
 
-    # Read the number of expected parts from the input parameters
+    # Read the number of expected parts and the split options from the input parameters
     try:
         with open('/input/run_params.json') as params_file:
             params_json = json.load(params_file)
     except FileNotFoundError:
-        num_parts = DEFAULT_NUM_PARTS
-    else:
-        num_parts = params_json.get('num_parts', DEFAULT_NUM_PARTS)
+        params_json = {}
+    num_parts = params_json.get('num_parts', DEFAULT_NUM_PARTS)
     print(f"Got {num_parts=}")
 
     try:
@@ -28,16 +203,21 @@ if __name__ == '__main__':
         print(f"Invalid value for num_parts (must be a positive integer): {num_parts}")
         exit(1)
 
-    # Read the input data from /input and split it using np.array_split
-    df = pd.read_csv('/input/0/dataset.csv')
-    df_parts = np.array_split(df, num_parts)
-    print(f"Split dataframe (len={df.shape[0]}) into {num_parts} parts")
+    mode = params_json.get('mode', 'range')
+    if mode not in SPLIT_MODES:
+        print(f"Invalid value for mode (must be one of {', '.join(SPLIT_MODES)}): {mode}")
+        exit(1)
+    if mode == 'hash' and 'key_column' not in params_json:
+        print("mode 'hash' requires a key_column")
+        exit(1)
+    if mode == 'stratified' and 'label_column' not in params_json:
+        print("mode 'stratified' requires a label_column")
+        exit(1)
+    if params_json.get('output_format', 'csv') not in OUTPUT_FORMATS:
+        print(f"Invalid value for output_format (must be one of {', '.join(OUTPUT_FORMATS)})")
+        exit(1)
 
-    # Write the outputs - each one to a different subdirectory under /output/0
-    for index, part in enumerate(df_parts):
-        dirpath = f"/output/0/part_{index}/"
-        print(f"Writing output into {dirpath}")
-        os.mkdir(dirpath)
-        part.to_csv(dirpath + "/dataset.csv", index=False)
+    # Stream the input from /input and write each part to a different subdirectory under /output/0
+    split_dataset(params_json, num_parts)
 
     print("Done")
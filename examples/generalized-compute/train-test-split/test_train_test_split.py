@@ -0,0 +1,43 @@
+import pandas as pd
+
+from train_test_split import streaming_split
+
+
+def read_text(path):
+	return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def write_input(path):
+	# Integer columns with one missing value, so pandas would read them as floats in the second chunk only
+	pids = [str(i % 50) for i in range(200)]
+	pids[157] = ''
+	labels = [str(i % 3) for i in range(200)]
+	labels[160] = ''
+	pd.DataFrame({'pid': pids, 'label': labels}).to_csv(path, index=False)
+
+
+def test_streaming_split_keeps_each_id_on_one_side(tmp_path):
+	input_path, train_path, test_path = tmp_path / 'input.csv', tmp_path / 'train.csv', tmp_path / 'test.csv'
+	write_input(input_path)
+
+	streaming_split(input_path, train_path, test_path, {'id_column': 'pid', 'chunksize': 150, 'seed': 3})
+
+	train, test = read_text(train_path), read_text(test_path)
+	assert not train.empty and not test.empty
+	assert set(train['pid']).isdisjoint(test['pid'])
+	assert sorted([*train['pid'], *test['pid']]) == sorted(read_text(input_path)['pid'])
+
+
+def test_streaming_split_stratified_test_fraction(tmp_path):
+	input_path, train_path, test_path = tmp_path / 'input.csv', tmp_path / 'train.csv', tmp_path / 'test.csv'
+	write_input(input_path)
+	params = {'id_column': 'pid', 'stratify_column': 'label', 'test_size': 0.25, 'chunksize': 150, 'seed': 3}
+
+	streaming_split(input_path, train_path, test_path, params)
+
+	label_counts = read_text(input_path)['label'].value_counts()
+	test_counts = read_text(test_path)['label'].value_counts()
+	train_counts = read_text(train_path)['label'].value_counts()
+	for label, count in label_counts.items():
+		assert test_counts.get(label, 0) == round(0.25 * count)
+		assert test_counts.get(label, 0) + train_counts.get(label, 0) == count
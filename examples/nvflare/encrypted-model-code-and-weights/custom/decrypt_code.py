@@ -5,7 +5,7 @@ import logging
 import sys
 from pathlib import Path
 
-from cryptography.fernet import Fernet
+from chunked_fernet import decrypt_file
 
 logging.basicConfig(
     level=logging.INFO,
@@ -51,16 +51,11 @@ if __name__ == "__main__":
         print('Missing key in secret_run_params.json: "key"', file=sys.stderr)
         sys.exit(1)
 
-    logging.info(f"Decrypting input file '{args.input_filename}'")
-
-    encrypted = Path(args.input_filename).read_bytes()
-    logging.info(f"Read {len(encrypted)} bytes of encrypted content")
-
-    fernet = Fernet(key)
-    decrypted = fernet.decrypt(encrypted)
-    logging.info(f"Decrypted contents resulted in {len(decrypted)} bytes")
-
-    logging.info(f"Writing decrypted contents to output file '{args.output_filename}'")
-    Path(args.output_filename).write_bytes(decrypted)
+    logging.info(f"Decrypting input file '{args.input_filename}' ({Path(args.input_filename).stat().st_size} bytes)")
+    decrypt_file(key, args.input_filename, args.output_filename)
+    logging.info(
+        f"Wrote {Path(args.output_filename).stat().st_size} bytes of decrypted contents "
+        f"to output file '{args.output_filename}'"
+    )
 
     logging.info("Done.")
\ No newline at end of file
@@ -20,7 +20,6 @@ import os
 import re
 from collections import OrderedDict
 from pathlib import Path
-from cryptography.fernet import Fernet
 
 import torch
 
@@ -34,6 +33,8 @@ from nvflare.app_common.app_event_type import AppEventType
 from nvflare.app_common.model_desc import ModelDescriptor
 from nvflare.app_common.pt.pt_fed_utils import PTModelPersistenceFormatManager
 
+from chunked_fernet import encrypt_file
+
 
 class PTSecuredModelPersistor(ModelPersistor):
     def __init__(
@@ -221,10 +222,8 @@ class PTSecuredModelPersistor(ModelPersistor):
             self.save_model_file(self._best_ckpt_save_path)
 
     def encrypt_weights(self, key, weights_path):
-        fernet = Fernet(key)
-        decrypted = Path(weights_path).read_bytes()
-        encrypted = fernet.encrypt(decrypted)
-        Path(weights_path).write_bytes(encrypted)
+        # Encrypt block by block (in place) so that large checkpoints are never held in memory
+        encrypt_file(key, weights_path, weights_path)
 
     def save_model_file(self, save_path: str):
         save_dict = self.persistence_manager.to_persistence_dict()
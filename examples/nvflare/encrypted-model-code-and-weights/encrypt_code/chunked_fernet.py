@@ -0,0 +1,117 @@
+"""
+Chunked, authenticated file encryption with constant memory use.
+
+The file is encrypted as a sequence of Fernet tokens, one per fixed-size block of plaintext, so that
+multi-GB files (e.g. model weights) never need to be held in memory. The layout is:
+
+    header: MAGIC (4 bytes) | VERSION (1 byte) | file ID (16 random bytes)
+    frames: token length (4 bytes, big-endian) | Fernet token, repeated
+
+Each token encrypts: file ID (16 bytes) | frame index (8 bytes) | final flag (1 byte) | block.
+Since Fernet authenticates every token, binding the file ID, index and final flag into it means that
+reordered, dropped, truncated or spliced frames are detected on decryption.
+
+Files written by plain `Fernet.encrypt` (the previous single-blob format) are still decrypted: a Fernet
+token always starts with "gAAAAA", which can never match MAGIC.
+"""
+import os
+import stat
+import struct
+import tempfile
+
+from cryptography.fernet import Fernet, InvalidToken
+
+MAGIC = b"RHCF"
+VERSION = 1
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+_FILE_ID_SIZE = 16
+_PREFIX = struct.Struct(">16sQ?")
+_LENGTH = struct.Struct(">I")
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise InvalidToken("Encrypted file is truncated")
+    return data
+
+
+def encrypt_stream(fernet, input_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    file_id = os.urandom(_FILE_ID_SIZE)
+    output_file.write(MAGIC + bytes([VERSION]) + file_id)
+    index = 0
+    block = input_file.read(chunk_size)
+    while True:
+        next_block = input_file.read(chunk_size)
+        is_final = not next_block
+        token = fernet.encrypt(_PREFIX.pack(file_id, index, is_final) + block)
+        output_file.write(_LENGTH.pack(len(token)) + token)
+        if is_final:
+            return
+        block = next_block
+        index += 1
+
+
+def decrypt_stream(fernet, input_file, output_file):
+    magic = input_file.read(len(MAGIC))
+    if magic != MAGIC:
+        # Legacy single-blob format, which can only be decrypted as a whole.
+        output_file.write(fernet.decrypt(magic + input_file.read()))
+        return
+
+    version = _read_exactly(input_file, 1)[0]
+    if version != VERSION:
+        raise ValueError(f"Unsupported encrypted file version {version}")
+    file_id = _read_exactly(input_file, _FILE_ID_SIZE)
+    index = 0
+    while True:
+        length_bytes = input_file.read(_LENGTH.size)
+        if not length_bytes:
+            raise InvalidToken("Encrypted file is truncated")
+        (length,) = _LENGTH.unpack(length_bytes)
+        plaintext = fernet.decrypt(_read_exactly(input_file, length))
+        frame_file_id, frame_index, is_final = _PREFIX.unpack_from(plaintext)
+        if frame_file_id != file_id or frame_index != index:
+            raise InvalidToken("Encrypted file frames are out of order or from another file")
+        output_file.write(plaintext[_PREFIX.size :])
+        if is_final:
+            if input_file.read(1):
+                raise InvalidToken("Unexpected data after the final frame")
+            return
+        index += 1
+
+
+def _output_mode(output_path):
+    # The permissions open(output_path, "wb") would give: those of an existing output, else 0o666 minus the umask
+    try:
+        return stat.S_IMODE(os.stat(output_path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _transform_file(transform, input_path, output_path):
+    # Write to a temporary file next to the output, so that input_path == output_path works
+    # and a failure never leaves a partially written output behind.
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir)
+    try:
+        with open(input_path, "rb") as input_file, os.fdopen(fd, "wb") as output_file:
+            transform(input_file, output_file)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, _output_mode(output_path))
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def encrypt_file(key, input_path, output_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    fernet = Fernet(key)
+    _transform_file(lambda i, o: encrypt_stream(fernet, i, o, chunk_size), input_path, output_path)
+
+
+def decrypt_file(key, input_path, output_path):
+    fernet = Fernet(key)
+    _transform_file(lambda i, o: decrypt_stream(fernet, i, o), input_path, output_path)
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 import argparse
 import logging
+import os
 import sys
 
-from cryptography.fernet import Fernet
+from chunked_fernet import DEFAULT_CHUNK_SIZE, encrypt_file
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -13,25 +14,19 @@ if __name__ == "__main__":
     parser.add_argument("input_filename", help="input filename")
     parser.add_argument("key_file", help="encryption key filename")
     parser.add_argument("output_filename", help="output filename")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE, help="plaintext bytes per encrypted frame")
 
     args = parser.parse_args()
 
     with open(args.key_file, "rb") as keyfile:
         key = keyfile.read()
 
-    fernet = Fernet(key)
-
-    logging.info(f"Processing input file '{args.input_filename}'")
-    with open(args.input_filename, "rb") as input_file:
-        original = input_file.read()
-        logging.info(f"Read {len(original)} bytes")
-
-    encrypted = fernet.encrypt(original)
-    logging.info(f"Encrypted content resulted in {len(encrypted)} bytes")
-
-    logging.info(f"Writing encrypted contents to output file '{args.output_filename}'")
-    with open(args.output_filename, "wb") as output_file:
-        output_file.write(encrypted)
+    logging.info(f"Encrypting input file '{args.input_filename}' ({os.path.getsize(args.input_filename)} bytes)")
+    encrypt_file(key, args.input_filename, args.output_filename, chunk_size=args.chunk_size)
+    logging.info(
+        f"Wrote {os.path.getsize(args.output_filename)} bytes of encrypted contents "
+        f"to output file '{args.output_filename}'"
+    )
 
     logging.info("Done")
     sys.exit(0)
\ No newline at end of file
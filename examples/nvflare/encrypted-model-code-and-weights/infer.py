@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 import sys
 from pathlib import Path
-from cryptography.fernet import Fernet
 import json
 import pandas as pd
 import torch
@@ -9,6 +8,7 @@ import torchvision
 from torch.utils.data.dataloader import DataLoader
 from torchvision.transforms import ToTensor, Normalize, Compose,  Resize, RandomRotation, CenterCrop
 
+from chunked_fernet import decrypt_file
 from network import PneumoniaModel
 
 
@@ -18,11 +18,8 @@ def decrypt_weights(model_parameters_path):
         with secret_run_params_file_path.open("rb") as secret_run_params_file:
             secret_run_params = json.load(secret_run_params_file)
             key = secret_run_params["key"]
-            fernet = Fernet(key)
-            encrypted = Path(model_parameters_path).read_bytes()
-            decrypted = fernet.decrypt(encrypted)
+            decrypt_file(key, model_parameters_path, '/output/model_parameters.pt')
             model_parameters_path = '/output/model_parameters.pt'
-            Path(model_parameters_path).write_bytes(decrypted)
     return model_parameters_path
 
 
@@ -13,6 +13,9 @@ REGULARIZATION = 0.0
 SCRYPT_N       = 512   # iterations (must be power of 2)
 SCRYPT_R       = 8
 SCRYPT_P       = 1
+# dtype of the sample-level matrices sent each iteration (partial z, residuals,
+# weights).  np.float32 halves their size, at ~1e-7 relative precision.
+TRANSPORT_DTYPE = np.float64
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -26,7 +29,8 @@ class ClinicalParty:
     Shares with the server:
       - Null model betas (once, before GWAS)
       - Per-variant gradient and Hessian for clinical betas
-      - Per-variant residuals (y - p) and weights w = p(1-p)
+      - Per-variant residuals (y - p) and weights w = p(1-p), as the columns
+        of N_samples × N_variants matrices
       - Phenotype vector for MAF computation (once, at finalize step)
 
     NOTE: Residuals and weights are correlated with phenotype labels.
@@ -89,40 +93,35 @@ class ClinicalParty:
                 break
         return betas
 
-    def clinical_iterate(self, betas_clin_by_variant: dict,
-                         partial_z_geno_by_variant: dict) -> dict:
+    def clinical_iterate(self, betas_clin: np.ndarray,
+                         partial_z_geno: np.ndarray) -> dict:
         """
-        For each variant, compute z_total = x_clin @ betas_clin + partial_z_geno,
-        then return the gradient, Hessian, residuals, and weights for clinical betas.
-
-        gradient_clin[v] = x_clin.T @ (y - p_v)             shape (N_clin,)
-        h_cc[v]          = -(x_clin.T * w_v) @ x_clin       shape (N_clin, N_clin)
-        residual[v]      = y - p_v                           shape (N_samples,)
-        w[v]             = p_v * (1 - p_v)                  shape (N_samples,)
+        For all variants at once (the columns of partial_z_geno), compute
+        z_total = x_clin @ betas_clin[v] + partial_z_geno[:, v], then return
+        the gradient, Hessian, residuals, and weights for clinical betas.
+
+        gradient_clin[v] = x_clin.T @ (y - p_v)             shape (N_variants, N_clin)
+        h_cc[v]          = -(x_clin.T * w_v) @ x_clin       shape (N_variants, N_clin, N_clin)
+        residual[:, v]   = y - p_v                           shape (N_samples, N_variants)
+        w[:, v]          = p_v * (1 - p_v)                  shape (N_samples, N_variants)
         """
-        gradient_clin_bv = {}
-        h_cc_bv          = {}
-        residual_bv      = {}
-        w_bv             = {}
-
-        for v, bc in betas_clin_by_variant.items():
-            bc      = np.array(bc, dtype=np.float64)
-            z_total = self.x @ bc + np.array(partial_z_geno_by_variant[v], dtype=np.float64)
-            p       = np.clip(1 / (1 + np.exp(-z_total)), 1e-15, 1 - 1e-15)
-            w       = p * (1 - p)
-            r       = self.y - p
-
-            gradient_clin_bv[v] = (self.x.T @ r - REGULARIZATION * bc).tolist()
-            h_cc_bv[v]          = (-(self.x.T * w) @ self.x
-                                   - REGULARIZATION * np.eye(len(bc))).tolist()
-            residual_bv[v]      = r.tolist()
-            w_bv[v]             = w.tolist()
+        bc      = np.asarray(betas_clin, dtype=np.float64)
+        z_total = self.x @ bc.T + np.asarray(partial_z_geno, dtype=np.float64)
+        p       = np.clip(1 / (1 + np.exp(-z_total)), 1e-15, 1 - 1e-15)
+        w       = p * (1 - p)
+        r       = self.y[:, None] - p
+
+        # Products of all pairs of clinical columns, so that the Hessians of
+        # all variants come from a single matrix product with w
+        n_clin  = self.x.shape[1]
+        x_pairs = (self.x[:, :, None] * self.x[:, None, :]).reshape(len(self.x), -1)
 
         return {
-            'gradient_clin_by_variant': gradient_clin_bv,
-            'h_cc_by_variant':          h_cc_bv,
-            'residual_by_variant':      residual_bv,
-            'w_by_variant':             w_bv,
+            'gradient_clin': (self.x.T @ r).T - REGULARIZATION * bc,
+            'h_cc':          (-(x_pairs.T @ w).T.reshape(-1, n_clin, n_clin)
+                              - REGULARIZATION * np.eye(n_clin)),
+            'residual':      r.astype(TRANSPORT_DTYPE, copy=False),
+            'w':             w.astype(TRANSPORT_DTYPE, copy=False),
         }
 
 
@@ -144,6 +143,9 @@ class GenotypeParty:
       - Residuals y - p    (per iteration — label-correlated, see privacy note)
       - weights w = p(1-p) (per iteration)
       - Phenotype vector y (once, at finalize — for MAF case/control split)
+
+    Variants are addressed by their index in the variant column list, and
+    their dosages are kept as the columns of N_samples × N_variants matrices.
     """
 
     def __init__(self, data: pd.DataFrame):
@@ -151,14 +153,12 @@ class GenotypeParty:
         self._sample_ids  = data['sample_id'].tolist()
         self.variant_cols = [c for c in data.columns if c.startswith('rs')]
 
-        # Standardize dosage vectors and cache both raw and standardized
-        self._dosage_std = {}
-        self._dosage_raw = {}
-        for v in self.variant_cols:
-            raw = data[v].values.astype(np.float64)
-            std = raw.std()
-            self._dosage_std[v] = (raw - raw.mean()) / std if std > 0 else raw - raw.mean()
-            self._dosage_raw[v] = raw
+        # Standardize dosage columns and cache both raw and standardized
+        # (column-major, so that selecting variants copies contiguous columns)
+        raw = data[self.variant_cols].to_numpy(dtype=np.float64)
+        std = raw.std(axis=0)
+        self._dosage_std = np.asfortranarray((raw - raw.mean(axis=0)) / np.where(std > 0, std, 1.0))
+        self._dosage_raw = np.asfortranarray(raw)
 
     def hash_sample_ids(self, salt: str) -> list:
         """Hash sample IDs with shared salt for PSI using scrypt."""
@@ -182,64 +182,69 @@ class GenotypeParty:
             ).decode("utf-8") in common_hashes
         ]
         self._sample_ids = [self._sample_ids[i] for i in keep]
-        for v in self.variant_cols:
-            self._dosage_std[v] = self._dosage_std[v][keep]
-            self._dosage_raw[v] = self._dosage_raw[v][keep]
-
-    def compute_partial_z(self, betas_geno_by_variant: dict) -> dict:
-        """Partial linear predictor z_geno_v = dosage_std_v * beta_geno_v."""
-        return {v: (self._dosage_std[v] * float(beta)).tolist()
-                for v, beta in betas_geno_by_variant.items()}
-
-    def geno_iterate(self, betas_geno_by_variant: dict,
-                     residual_by_variant: dict, w_by_variant: dict) -> dict:
+        self._dosage_std = np.asfortranarray(self._dosage_std[keep])
+        self._dosage_raw = np.asfortranarray(self._dosage_raw[keep])
+
+    def _dosage(self, variant_index: np.ndarray) -> np.ndarray:
+        """Standardized dosage columns of the given variants."""
+        variant_index = np.asarray(variant_index, dtype=np.int64)
+        if len(variant_index) == self._dosage_std.shape[1] and \
+                np.array_equal(variant_index, np.arange(len(variant_index))):
+            return self._dosage_std
+        return self._dosage_std[:, variant_index]
+
+    def compute_partial_z(self, variant_index: np.ndarray,
+                          betas_geno: np.ndarray) -> np.ndarray:
+        """Partial linear predictor z_geno[:, v] = dosage_std_v * beta_geno_v."""
+        betas_geno = np.asarray(betas_geno, dtype=np.float64)
+        return (self._dosage(variant_index) * betas_geno).astype(TRANSPORT_DTYPE, copy=False)
+
+    def geno_iterate(self, variant_index: np.ndarray, betas_geno: np.ndarray,
+                     residual: np.ndarray, w: np.ndarray) -> dict:
         """
         Compute gradient and (block-diagonal) Hessian for each variant's
-        genotype beta, given residuals and weights from the clinical party.
+        genotype beta, given the residuals and weights from the clinical
+        party (one column per variant).
 
-        gradient_geno[v] = dosage_std.T @ residual       (scalar)
-        h_gg[v]          = -(dosage_std.T * w) @ dosage  (scalar, negative)
+        gradient_geno[v] = dosage_std_v.T @ residual[:, v]       shape (N_variants,)
+        h_gg[v]          = -(dosage_std_v.T * w[:, v]) @ dosage  shape (N_variants,), negative
         """
-        gradient_geno_bv = {}
-        h_gg_bv          = {}
+        dosage   = self._dosage(variant_index)
+        residual = np.asarray(residual, dtype=np.float64)
+        w        = np.asarray(w,        dtype=np.float64)
 
-        for v, beta in betas_geno_by_variant.items():
-            dosage   = self._dosage_std[v]
-            residual = np.array(residual_by_variant[v], dtype=np.float64)
-            w        = np.array(w_by_variant[v],        dtype=np.float64)
+        return {
+            'gradient_geno': (np.einsum('nv,nv->v', dosage, residual)
+                              - REGULARIZATION * np.asarray(betas_geno, dtype=np.float64)),
+            'h_gg':          -np.einsum('nv,nv,nv->v', dosage, w, dosage) - REGULARIZATION,
+        }
 
-            gradient_geno_bv[v] = float(dosage @ residual) - REGULARIZATION * float(beta)
-            h_gg_bv[v]          = float(-(dosage * w) @ dosage) - REGULARIZATION
+    def compute_maf_and_contingency(self, phenotype_vector: np.ndarray) -> dict:
+        """
+        MAF and 2×2 contingency table of all variants using raw
+        (unstandardized) dosage, as arrays in the order of variant_cols.
+        """
+        y          = np.asarray(phenotype_vector)
+        cases      = self._dosage_raw[y == 1]
+        controls   = self._dosage_raw[y == 0]
+        n_cases    = len(cases)
+        n_controls = len(controls)
+        alt_cases    = cases.sum(axis=0)
+        alt_controls = controls.sum(axis=0)
 
         return {
-            'gradient_geno_by_variant': gradient_geno_bv,
-            'h_gg_by_variant':          h_gg_bv,
+            'maf_cases':      (alt_cases / (2 * n_cases) if n_cases > 0
+                               else np.full(len(self.variant_cols), np.nan)),
+            'maf_controls':   (alt_controls / (2 * n_controls) if n_controls > 0
+                               else np.full(len(self.variant_cols), np.nan)),
+            'n_cases':        n_cases,
+            'n_controls':     n_controls,
+            'n_cases_ref':    (2 * n_cases    - alt_cases).astype(np.int64),
+            'n_cases_alt':    alt_cases.astype(np.int64),
+            'n_controls_ref': (2 * n_controls - alt_controls).astype(np.int64),
+            'n_controls_alt': alt_controls.astype(np.int64),
         }
 
-    def compute_maf_and_contingency(self, variant_ids: list,
-                                    phenotype_vector: np.ndarray) -> dict:
-        """MAF and 2×2 contingency table using raw (unstandardized) dosage."""
-        results = {}
-        for v in variant_ids:
-            dosage   = self._dosage_raw[v]
-            y        = phenotype_vector
-            cases    = dosage[y == 1]
-            controls = dosage[y == 0]
-
-            results[v] = {
-                'maf_cases':      float(cases.sum() / (2 * len(cases)))
-                                  if len(cases) > 0 else float('nan'),
-                'maf_controls':   float(controls.sum() / (2 * len(controls)))
-                                  if len(controls) > 0 else float('nan'),
-                'n_cases':        int(len(cases)),
-                'n_controls':     int(len(controls)),
-                'n_cases_ref':    int((2 * len(cases))    - cases.sum()),
-                'n_cases_alt':    int(cases.sum()),
-                'n_controls_ref': int((2 * len(controls)) - controls.sum()),
-                'n_controls_alt': int(controls.sum()),
-            }
-        return results
-
 
 # ══════════════════════════════════════════════════════════════════════════════
 # MAIN — NVFlare client entrypoint
@@ -309,9 +314,12 @@ if __name__ == '__main__':
         # ── Genotype → partial linear predictor ───────────────────────────
         elif task == 'partial_z':
             if party_type == 'genotype':
-                partial_z = party.compute_partial_z(inp.params['betas_geno_by_variant'])
+                partial_z = party.compute_partial_z(
+                    inp.params['variant_index'],
+                    inp.params['betas_geno'],
+                )
                 flare.send(flare.FLModel(params={
-                    'partial_z_geno_by_variant': partial_z
+                    'partial_z_geno': partial_z
                 }))
             else:
                 flare.send(flare.FLModel(params={}))
@@ -320,8 +328,8 @@ if __name__ == '__main__':
         elif task == 'clinical_iterate':
             if party_type == 'clinical':
                 out = party.clinical_iterate(
-                    inp.params['betas_clin_by_variant'],
-                    inp.params['partial_z_geno_by_variant'],
+                    inp.params['betas_clin'],
+                    inp.params['partial_z_geno'],
                 )
                 flare.send(flare.FLModel(params=out))
             else:
@@ -331,9 +339,10 @@ if __name__ == '__main__':
         elif task == 'geno_iterate':
             if party_type == 'genotype':
                 out = party.geno_iterate(
-                    inp.params['betas_geno_by_variant'],
-                    inp.params['residual_by_variant'],
-                    inp.params['w_by_variant'],
+                    inp.params['variant_index'],
+                    inp.params['betas_geno'],
+                    inp.params['residual'],
+                    inp.params['w'],
                 )
                 flare.send(flare.FLModel(params=out))
             else:
@@ -343,7 +352,7 @@ if __name__ == '__main__':
         elif task == 'get_phenotype':
             if party_type == 'clinical':
                 flare.send(flare.FLModel(params={
-                    'phenotype': party.y.tolist()
+                    'phenotype': party.y
                 }))
             else:
                 flare.send(flare.FLModel(params={}))
@@ -351,8 +360,8 @@ if __name__ == '__main__':
         # ── Genotype → MAF and contingency stats ──────────────────────────
         elif task == 'finalize_gwas':
             if party_type == 'genotype':
-                y     = np.array(inp.params['phenotype_vector'], dtype=np.float64)
-                stats = party.compute_maf_and_contingency(inp.params['variant_cols'], y)
+                y     = np.asarray(inp.params['phenotype_vector'], dtype=np.float64)
+                stats = party.compute_maf_and_contingency(y)
                 flare.send(flare.FLModel(params={'stats': stats}))
             else:
                 flare.send(flare.FLModel(params={}))
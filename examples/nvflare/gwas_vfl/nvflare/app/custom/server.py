@@ -14,6 +14,28 @@ MAX_ITERATIONS  = 20
 CONVERGENCE_TOL = 1e-6
 GW_SIGNIFICANCE = 5e-8
 REGULARIZATION  = 0.0
+# Variants per sub-round, which bounds the N_samples × N_variants matrices
+# exchanged (and held in memory by both parties) on large panels
+VARIANT_BATCH_SIZE = 10000
+
+
+def solve_blocks(a: np.ndarray, b: np.ndarray):
+    """
+    Solve a[v] @ x[v] = b[v] for every variant v at once.  Returns the
+    solutions and a mask of the solved systems (singular ones are left at 0).
+    """
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0], np.ones(len(b), dtype=bool)
+    except np.linalg.LinAlgError:
+        x      = np.zeros_like(b)
+        solved = np.zeros(len(b), dtype=bool)
+        for v in range(len(b)):
+            try:
+                x[v]      = np.linalg.solve(a[v], b[v])
+                solved[v] = True
+            except np.linalg.LinAlgError:
+                continue
+        return x, solved
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -28,16 +50,20 @@ class VFLGWASServer(BaseFedAvg):
     gradients, Hessians) between the two parties.
 
     Optimization: block-diagonal Newton-Raphson, processing all variants per
-    communication round (same batching strategy as the horizontal FL baseline).
+    communication round (same batching strategy as the horizontal FL baseline),
+    up to VARIANT_BATCH_SIZE variants per sub-round.
 
-    Per-iteration protocol (3 sub-rounds):
-      A. Server → Genotype: current betas_geno
-         Genotype → Server: partial_z_geno   [N_variants × N_samples]
+    Per-iteration protocol (3 sub-rounds per batch of not-converged variants):
+      A. Server → Genotype: variant_index + current betas_geno
+         Genotype → Server: partial_z_geno   [N_samples × N_variants]
       B. Server → Clinical: betas_clin + partial_z_geno
-         Clinical → Server: gradient_clin, h_cc, residuals, w  [per variant]
-      C. Server → Genotype: residuals + w
-         Genotype → Server: gradient_geno, h_gg               [scalars per variant]
-      Server: Newton-Raphson update, convergence check per variant.
+         Clinical → Server: gradient_clin, h_cc, residual, w  [N_variants × ..., N_samples × N_variants]
+      C. Server → Genotype: variant_index + betas_geno + residual + w
+         Genotype → Server: gradient_geno, h_gg               [N_variants]
+      Server: Newton-Raphson update, convergence check for all variants at once.
+
+    Every payload is packed: variants are the rows or columns of contiguous
+    arrays, addressed by their index in the genotype party's variant list.
 
     Note on privacy: residuals (y-p) and weights w are forwarded from the
     clinical party to the genotype party via the server.  These are correlated
@@ -45,6 +71,53 @@ class VFLGWASServer(BaseFedAvg):
     secure aggregation or homomorphic encryption before forwarding.
     """
 
+    def iterate_variants(self, model, variant_index: np.ndarray,
+                         betas_clin: np.ndarray, betas_geno: np.ndarray,
+                         clinical_targets: list, genotype_targets: list):
+        """
+        Run sub-rounds A–C for the given variants, VARIANT_BATCH_SIZE at a
+        time.  Returns gradient_clin [N_variants × N_clin],
+        h_cc [N_variants × N_clin × N_clin], gradient_geno and h_gg [N_variants].
+        """
+        outputs = []
+        for start in range(0, len(variant_index), VARIANT_BATCH_SIZE):
+            batch = variant_index[start:start + VARIANT_BATCH_SIZE]
+
+            # Sub-round A — genotype sends partial linear predictor
+            model.meta['current_task'] = 'partial_z'
+            model.params = {
+                'variant_index': batch,
+                'betas_geno':    betas_geno[batch],
+            }
+            gr_a = self.send_model_and_wait(targets=genotype_targets, data=model)
+            partial_z_geno = gr_a[0].params['partial_z_geno']
+
+            # Sub-round B — clinical computes gradients from z_total
+            model.meta['current_task'] = 'clinical_iterate'
+            model.params = {
+                'betas_clin':     betas_clin[batch],
+                'partial_z_geno': partial_z_geno,
+            }
+            gr_b     = self.send_model_and_wait(targets=clinical_targets, data=model)
+            clin_out = gr_b[0].params
+
+            # Sub-round C — genotype computes gradient and Hessian from residuals
+            model.meta['current_task'] = 'geno_iterate'
+            model.params = {
+                'variant_index': batch,
+                'betas_geno':    betas_geno[batch],
+                'residual':      clin_out['residual'],
+                'w':             clin_out['w'],
+            }
+            gr_c     = self.send_model_and_wait(targets=genotype_targets, data=model)
+            geno_out = gr_c[0].params
+
+            outputs.append((clin_out['gradient_clin'], clin_out['h_cc'],
+                            geno_out['gradient_geno'], geno_out['h_gg']))
+
+        return [np.concatenate([np.asarray(out[i], dtype=np.float64) for out in outputs])
+                for i in range(4)]
+
     def run(self) -> None:
         model   = self.load_model()
         clients = self.sample_clients(self.num_clients)
@@ -107,93 +180,41 @@ class VFLGWASServer(BaseFedAvg):
                                    dtype=np.float64)
         self.info("Null model fitted on clinical party.")
 
-        # ── Initialise per-variant betas ──────────────────────────────────
-        betas_clin_bv = {v: betas_clin_null.copy() for v in variant_cols}
-        betas_geno_bv = {v: 0.0 for v in variant_cols}
-        not_converged = set(variant_cols)
+        # ── Initialise per-variant betas (one row / entry per variant) ────
+        n_variants    = len(variant_cols)
+        betas_clin    = np.tile(betas_clin_null, (n_variants, 1))
+        betas_geno    = np.zeros(n_variants)
+        not_converged = np.ones(n_variants, dtype=bool)
 
         # ── Phase 4: Block-diagonal Newton-Raphson ────────────────────────
         for iteration in range(MAX_ITERATIONS):
-            nc = list(not_converged)
-
-            # Sub-round A — genotype sends partial linear predictor
-            model.meta['current_task'] = 'partial_z'
-            model.params = {
-                'betas_geno_by_variant': {v: float(betas_geno_bv[v]) for v in nc}
-            }
-            gr_a = self.send_model_and_wait(targets=genotype_targets, data=model)
-            partial_z_geno = gr_a[0].params['partial_z_geno_by_variant']
-
-            # Sub-round B — clinical computes gradients from z_total
-            model.meta['current_task'] = 'clinical_iterate'
-            model.params = {
-                'betas_clin_by_variant':     {v: betas_clin_bv[v].tolist() for v in nc},
-                'partial_z_geno_by_variant': {v: partial_z_geno[v] for v in nc},
-            }
-            gr_b     = self.send_model_and_wait(targets=clinical_targets, data=model)
-            clin_out = gr_b[0].params
-
-            # Sub-round C — genotype computes gradient and Hessian from residuals
-            model.meta['current_task'] = 'geno_iterate'
-            model.params = {
-                'betas_geno_by_variant': {v: float(betas_geno_bv[v]) for v in nc},
-                'residual_by_variant':   {v: clin_out['residual_by_variant'][v] for v in nc},
-                'w_by_variant':          {v: clin_out['w_by_variant'][v] for v in nc},
-            }
-            gr_c     = self.send_model_and_wait(targets=genotype_targets, data=model)
-            geno_out = gr_c[0].params
-
-            # Server: Newton-Raphson update, check convergence
-            newly_converged = set()
-            for v in nc:
-                g_clin  = np.array(clin_out['gradient_clin_by_variant'][v], dtype=np.float64)
-                h_cc    = np.array(clin_out['h_cc_by_variant'][v],          dtype=np.float64)
-                g_geno  = float(geno_out['gradient_geno_by_variant'][v])
-                h_gg    = float(geno_out['h_gg_by_variant'][v])    # negative
-
-                try:
-                    delta_clin = np.linalg.solve(-h_cc, g_clin)
-                except np.linalg.LinAlgError:
-                    continue
+            nc = np.flatnonzero(not_converged)
 
-                delta_geno = -g_geno / h_gg if abs(h_gg) > 1e-12 else 0.0
+            g_clin, h_cc, g_geno, h_gg = self.iterate_variants(
+                model, nc, betas_clin, betas_geno, clinical_targets, genotype_targets)
 
-                betas_clin_bv[v] = betas_clin_bv[v] + delta_clin
-                betas_geno_bv[v] = betas_geno_bv[v] + delta_geno
+            # Server: Newton-Raphson update for all variants at once (variants
+            # with a singular clinical Hessian are left as they are)
+            delta_clin, solved = solve_blocks(-h_cc, g_clin)
+            h_gg_ok    = np.abs(h_gg) > 1e-12    # h_gg is negative
+            delta_geno = np.where(h_gg_ok, -g_geno / np.where(h_gg_ok, h_gg, 1.0), 0.0)
 
-                if np.linalg.norm(delta_clin) ** 2 + delta_geno ** 2 < CONVERGENCE_TOL ** 2:
-                    newly_converged.add(v)
+            betas_clin[nc[solved]] += delta_clin[solved]
+            betas_geno[nc[solved]] += delta_geno[solved]
 
-            not_converged -= newly_converged
-            self.info(f"Iteration {iteration + 1}: {len(newly_converged)} converged, "
-                      f"{len(not_converged)} remaining")
+            newly_converged = solved & (np.sum(delta_clin ** 2, axis=1) + delta_geno ** 2
+                                        < CONVERGENCE_TOL ** 2)
+            not_converged[nc[newly_converged]] = False
+            self.info(f"Iteration {iteration + 1}: {int(newly_converged.sum())} converged, "
+                      f"{int(not_converged.sum())} remaining")
 
-            if not not_converged:
+            if not not_converged.any():
                 break
 
         # ── Phase 5: Final Hessian pass (all variants, for SE computation) ─
-        model.meta['current_task'] = 'partial_z'
-        model.params = {'betas_geno_by_variant': {v: float(betas_geno_bv[v])
-                                                  for v in variant_cols}}
-        gr_f1 = self.send_model_and_wait(targets=genotype_targets, data=model)
-        pz_final = gr_f1[0].params['partial_z_geno_by_variant']
-
-        model.meta['current_task'] = 'clinical_iterate'
-        model.params = {
-            'betas_clin_by_variant':     {v: betas_clin_bv[v].tolist() for v in variant_cols},
-            'partial_z_geno_by_variant': {v: pz_final[v] for v in variant_cols},
-        }
-        gr_f2    = self.send_model_and_wait(targets=clinical_targets, data=model)
-        clin_fin = gr_f2[0].params
-
-        model.meta['current_task'] = 'geno_iterate'
-        model.params = {
-            'betas_geno_by_variant': {v: float(betas_geno_bv[v]) for v in variant_cols},
-            'residual_by_variant':   clin_fin['residual_by_variant'],
-            'w_by_variant':          clin_fin['w_by_variant'],
-        }
-        gr_f3    = self.send_model_and_wait(targets=genotype_targets, data=model)
-        h_gg_fin = gr_f3[0].params['h_gg_by_variant']
+        _, _, _, h_gg_fin = self.iterate_variants(
+            model, np.arange(n_variants), betas_clin, betas_geno,
+            clinical_targets, genotype_targets)
 
         # ── Phase 6: Collect MAF / contingency stats ──────────────────────
         # Phenotype labels are requested from clinical and forwarded to genotype
@@ -205,53 +226,49 @@ class VFLGWASServer(BaseFedAvg):
         phenotype_vector = phen_resp[0].params['phenotype']
 
         model.meta['current_task'] = 'finalize_gwas'
-        model.params = {
-            'variant_cols':     variant_cols,
-            'phenotype_vector': phenotype_vector,
-        }
-        fin_resp   = self.send_model_and_wait(targets=genotype_targets, data=model)
-        site_stats = fin_resp[0].params['stats']
-
-        # ── Phase 7: Compute summary statistics ───────────────────────────
-        all_results = []
-        for v in variant_cols:
-            beta  = float(betas_geno_bv[v])
-            h_gg  = float(h_gg_fin[v])
-            var_g = (1.0 / (-h_gg)) if abs(h_gg) > 1e-12 else np.nan
-            se    = float(np.sqrt(var_g)) if (not np.isnan(var_g) and var_g > 0) else np.nan
-            z     = (beta / se) if (se and not np.isnan(se) and se > 0) else np.nan
-            p     = float(2 * (1 - norm.cdf(abs(z)))) if not np.isnan(z) else np.nan
-
-            s = site_stats[v]
-            all_results.append({
-                'variant_id':        v,
-                'beta':              beta,
-                'se':                se,
-                'z_stat':            z,
-                'chi2_stat':         z ** 2 if not np.isnan(z) else np.nan,
-                'p_value':           p,
-                'OR':                float(np.exp(np.clip(beta, -500, 500))),
-                'OR_lower_95':       float(np.exp(np.clip(beta - 1.96 * se, -500, 500)))
-                                     if not np.isnan(se) else np.nan,
-                'OR_upper_95':       float(np.exp(np.clip(beta + 1.96 * se, -500, 500)))
-                                     if not np.isnan(se) else np.nan,
-                'MAF_cases':         s['maf_cases'],
-                'MAF_controls':      s['maf_controls'],
-                'n_cases':           s['n_cases'],
-                'n_controls':        s['n_controls'],
-                'risk_allele':       'alt' if beta > 0 else 'ref',
-                'n_cases_ref':       s['n_cases_ref'],
-                'n_cases_alt':       s['n_cases_alt'],
-                'n_controls_ref':    s['n_controls_ref'],
-                'n_controls_alt':    s['n_controls_alt'],
-                'contingency_table': (
-                    f"            ref    alt\n"
-                    f"cases       {s['n_cases_ref']:<6} {s['n_cases_alt']:<6}\n"
-                    f"controls    {s['n_controls_ref']:<6} {s['n_controls_alt']:<6}"
-                ),
-            })
-
-        results_df = pd.DataFrame(all_results)
+        model.params = {'phenotype_vector': phenotype_vector}
+        fin_resp = self.send_model_and_wait(targets=genotype_targets, data=model)
+        s        = fin_resp[0].params['stats']    # arrays in variant_cols order
+
+        # ── Phase 7: Compute summary statistics (all variants at once) ────
+        beta = betas_geno
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var_g = np.where(np.abs(h_gg_fin) > 1e-12, 1.0 / -h_gg_fin, np.nan)
+            se    = np.where(var_g > 0, np.sqrt(var_g), np.nan)
+            z     = beta / se
+        p = 2 * (1 - norm.cdf(np.abs(z)))
+
+        n_cases_ref    = np.asarray(s['n_cases_ref'])
+        n_cases_alt    = np.asarray(s['n_cases_alt'])
+        n_controls_ref = np.asarray(s['n_controls_ref'])
+        n_controls_alt = np.asarray(s['n_controls_alt'])
+        results_df = pd.DataFrame({
+            'variant_id':        variant_cols,
+            'beta':              beta,
+            'se':                se,
+            'z_stat':            z,
+            'chi2_stat':         z ** 2,
+            'p_value':           p,
+            'OR':                np.exp(np.clip(beta, -500, 500)),
+            'OR_lower_95':       np.exp(np.clip(beta - 1.96 * se, -500, 500)),
+            'OR_upper_95':       np.exp(np.clip(beta + 1.96 * se, -500, 500)),
+            'MAF_cases':         s['maf_cases'],
+            'MAF_controls':      s['maf_controls'],
+            'n_cases':           int(s['n_cases']),
+            'n_controls':        int(s['n_controls']),
+            'risk_allele':       np.where(beta > 0, 'alt', 'ref'),
+            'n_cases_ref':       n_cases_ref,
+            'n_cases_alt':       n_cases_alt,
+            'n_controls_ref':    n_controls_ref,
+            'n_controls_alt':    n_controls_alt,
+            'contingency_table': [
+                f"            ref    alt\n"
+                f"cases       {cr:<6} {ca:<6}\n"
+                f"controls    {tr:<6} {ta:<6}"
+                for cr, ca, tr, ta in zip(n_cases_ref.tolist(), n_cases_alt.tolist(),
+                                          n_controls_ref.tolist(), n_controls_alt.tolist())
+            ],
+        })
         _, p_fdr, _, _ = multipletests(results_df['p_value'].fillna(1.0), method='fdr_bh')
         results_df['p_fdr']          = p_fdr
         results_df['gw_significant'] = results_df['p_value'] < GW_SIGNIFICANCE
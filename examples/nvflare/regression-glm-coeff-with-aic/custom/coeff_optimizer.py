@@ -1,13 +1,232 @@
+import os
+
 import statsmodels.api as sm
 import statsmodels.formula.api as smf
 import numpy as np
 import pandas as pd
+import patsy
+import scipy.linalg
+
+# Families for which GLM.estimate_scale is 1 rather than Pearson's chi2 estimate
+FIXED_SCALE_FAMILIES = (sm.families.Binomial, sm.families.Poisson, sm.families.NegativeBinomial)
+
+# The canonical link of each family, for which the observed Hessian equals minus the IRLS X^T W X (over the scale)
+CANONICAL_LINKS = {
+    sm.families.Binomial: sm.families.links.Logit,
+    sm.families.Poisson: sm.families.links.Log,
+    sm.families.Gaussian: sm.families.links.Identity,
+    sm.families.Gamma: sm.families.links.InversePower,
+    sm.families.InverseGaussian: sm.families.links.InverseSquared,
+}
+
+
+def has_canonical_link(family):
+    link_class = CANONICAL_LINKS.get(type(family))
+    return link_class is not None and type(family.link) is link_class
+
+
+def iter_row_chunks(nobs, chunk_size):
+    for start in range(0, nobs, chunk_size):
+        yield slice(start, min(start + chunk_size, nobs))
+
+
+def take_rows(values, rows):
+    # Offsets, weights and trial counts are plain scalars when they are not given per row
+    return values[rows] if np.ndim(values) else values
+
+
+def memory_map_array(array, path):
+    np.save(path, array)
+    return np.load(path, mmap_mode="r")
+
+
+def rank_from_gram(gram, nobs):
+    """
+    The rank of X given X^T X, with the tolerance np.linalg.matrix_rank uses on X itself (the singular values of X
+    are the square roots of the eigenvalues of X^T X).
+    """
+    singular_values = np.sqrt(np.clip(np.linalg.eigvalsh(gram), 0, None))
+    tol = singular_values.max(initial=0.) * max(nobs, gram.shape[0]) * np.finfo(np.float64).eps
+    return int(np.sum(singular_values > tol))
+
+
+def chunked_gram(exog, chunk_size):
+    """
+    X^T X in float64, summed over chunks of rows of exog.
+    """
+    gram = np.zeros((exog.shape[1], exog.shape[1]))
+    for rows in iter_row_chunks(exog.shape[0], chunk_size):
+        exog_rows = np.asarray(exog[rows], dtype=np.float64)
+        gram += exog_rows.T.dot(exog_rows)
+    return gram
+
+
+class ColumnSubset:
+    """
+    Some of the columns of a 2D array, which are only copied out of the rows that it is indexed with. Indexing it with
+    chunks of rows (as the chunked sweeps do) never copies the columns of all the rows at once.
+    """
+
+    def __init__(self, array, indices):
+        self.array = array
+        self.indices = tuple(indices)
+        self.shape = (array.shape[0], len(self.indices))
+
+    def __getitem__(self, rows):
+        return np.take(self.array[rows], self.indices, axis=1)
+
+
+def pack_symmetric(matrix, dtype=np.float64):
+    """
+    Pack a symmetric matrix into the flat upper triangle (row by row), which is all that needs to be sent.
+    """
+    matrix = np.asarray(matrix)
+    return np.ascontiguousarray(matrix[np.triu_indices(matrix.shape[0])], dtype=dtype)
+
+
+def unpack_symmetric(values):
+    """
+    Rebuild the full float64 matrix from pack_symmetric's output. Full (2D) matrices are returned unchanged.
+    """
+    values = np.asarray(values)
+    if values.ndim != 1:
+        return values
+    size = int(round((np.sqrt(8 * values.size + 1) - 1) / 2))
+    if size * (size + 1) // 2 != values.size:
+        raise ValueError(f"{values.size} values are not the upper triangle of a square matrix")
+    matrix = np.empty((size, size), dtype=np.float64)
+    rows, cols = np.triu_indices(size)
+    matrix[rows, cols] = values
+    matrix[cols, rows] = values
+    return matrix
+
+
+def accumulate(total, values):
+    """
+    Add values to the running float64 sum total, in place once it has been allocated (sums start out as 0).
+    """
+    if isinstance(total, np.ndarray):
+        total += values
+        return total
+    return total + np.asarray(values, dtype=np.float64)
+
+
+# Below this reciprocal condition number, a Cholesky solve is not trusted and the pseudo-inverse is used instead
+MIN_RCOND = 1e-12
+
+
+class SymmetricSolver:
+    """
+    Factorizes a symmetric positive definite matrix (e.g. a Fisher information or X^T W X) once, and reuses the
+    factorization both to solve for the iteration step and for the diagonal of the inverse (for the standard errors).
+    Falls back to the pseudo-inverse when the matrix is not positive definite or is too ill-conditioned.
+    A matrix with infinite or NaN entries (e.g. a Hessian evaluated where the mean is infinite) gives NaN solutions,
+    inverse and condition number, as np.linalg.inv does.
+    """
+
+    def __init__(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if not np.all(np.isfinite(matrix)):
+            self.method = "pinv"
+            self.condition_number = np.nan
+            self._pinv = np.full_like(matrix, np.nan)
+            print("Matrix has infinite or NaN entries, its solutions and inverse are NaN")
+            return
+        try:
+            self._lower = scipy.linalg.cholesky(matrix, lower=True)
+            rcond, _ = scipy.linalg.lapack.dpocon(self._lower, np.linalg.norm(matrix, 1), uplo="L")
+        except np.linalg.LinAlgError:
+            rcond = 0.
+        if rcond >= MIN_RCOND:
+            self.method = "cholesky"
+            self.condition_number = float(1 / rcond)
+            return
+
+        self.method = "pinv"
+        eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+        abs_eigenvalues = np.abs(eigenvalues)
+        self.condition_number = float(abs_eigenvalues.max() / abs_eigenvalues.min()) if abs_eigenvalues.min() > 0 else np.inf
+        inverse_eigenvalues = np.zeros_like(eigenvalues)
+        nonzero = abs_eigenvalues > abs_eigenvalues.max() * matrix.shape[0] * np.finfo(np.float64).eps
+        inverse_eigenvalues[nonzero] = 1 / eigenvalues[nonzero]
+        self._pinv = (eigenvectors * inverse_eigenvalues).dot(eigenvectors.T)
+        print(f"Matrix is not positive definite or is ill-conditioned (condition number {self.condition_number:.3g}), "
+              f"using the pseudo-inverse")
+
+    def solve(self, rhs):
+        if self.method == "cholesky":
+            return scipy.linalg.cho_solve((self._lower, True), rhs)
+        return self._pinv.dot(rhs)
+
+    def inverse_diagonal(self):
+        if self.method == "cholesky":
+            # inv(L L^T) = inv(L)^T inv(L), so its diagonal holds the squared column norms of inv(L)
+            lower_inverse = scipy.linalg.solve_triangular(self._lower, np.eye(self._lower.shape[0]), lower=True)
+            return np.einsum("ij,ij->j", lower_inverse, lower_inverse)
+        return np.diag(self._pinv).copy()
+
+
+class StreamingGLM:
+    """
+    The parts of a GLM that the chunked sweeps (IRLS._site_irls_sweep and NewtonRaphson._site_nr_sweep) use, over a
+    design matrix that was written to memory-mapped .npy files chunk by chunk (see CoeffOptimizer.build_streaming_site_glm),
+    or over some of the columns of another GLM's design matrix (see CoeffOptimizer.build_subset_glm). Unlike sm.GLM,
+    nothing here works on the full exog at once: the rank behind df_model and df_resid is computed from X^T X.
+    """
+    iweights = var_weights = freq_weights = n_trials = 1.
+
+    def __init__(self, endog, exog, offset, family, rank):
+        self.endog = endog
+        self.exog = exog
+        self.offset = offset
+        self._offset_exposure = 0. if offset is None else offset
+        self.family = family
+        self.nobs = exog.shape[0]
+        self.rank = rank
+        # As in sm.GLM, which counts one parameter for the intercept whether or not there is one
+        self.df_model = rank - 1
+        self.df_resid = self.nobs - rank
+
 
 class CoeffOptimizer:
+    # Paths in the client results of the symmetric matrices, which can be sent packed (see pack_symmetric)
+    symmetric_fields = ()
 
     def name(self):
         raise NotImplementedError
 
+    def pack_symmetric_fields(self, np_data, dtypes=None):
+        """
+        Replace the symmetric matrices in the client results with their packed upper triangles.
+        dtypes optionally maps the last key of a path to the dtype to send it in (float64 by default).
+        """
+        dtypes = dtypes or {}
+        for path in self.symmetric_fields:
+            *parents, key = path
+            container = np_data
+            for parent in parents:
+                container = container.get(parent, {})
+            if key in container:
+                container[key] = pack_symmetric(container[key], dtypes.get(key, np.float64))
+
+    def unpack_symmetric_fields(self, data):
+        """
+        Return a copy of the client results with the packed symmetric matrices rebuilt.
+        """
+        data = dict(data)
+        for path in self.symmetric_fields:
+            *parents, key = path
+            container = data
+            for parent in parents:
+                if not isinstance(container.get(parent), dict):
+                    break
+                container[parent] = dict(container[parent])
+                container = container[parent]
+            else:
+                if key in container:
+                    container[key] = unpack_symmetric(container[key])
+        return data
+
     @staticmethod
     def get_glm_obj(formula, offset, family_class, data=None, data_y=None, data_x=None) -> sm.GLM:
         offset = np.log(data[offset] + 1e-10) if offset else None
@@ -17,6 +236,148 @@ class CoeffOptimizer:
             glm = sm.GLM(data_y, data_x, family=family_class(), offset=offset)
         return glm
 
+    @classmethod
+    def build_site_glm(cls, formula, offset, family_class, data=None, data_y=None, data_x=None, dtype=np.float64,
+                       mmap_dir=None):
+        """
+        Parse the formula (or the x/y columns) and the offset once, and return a GLM over contiguous
+        arrays of the given dtype, along with the exog names (which the arrays no longer carry).
+        If mmap_dir is given, the arrays are saved there as .npy files and memory-mapped back, so that
+        the design does not have to stay resident in memory between rounds.
+        """
+        parsed = cls.get_glm_obj(formula, offset, family_class, data, data_y, data_x)
+        endog = np.ascontiguousarray(parsed.data.endog, dtype=dtype)
+        exog = np.ascontiguousarray(parsed.exog, dtype=dtype)
+        offset = None if parsed.offset is None else np.ascontiguousarray(parsed.offset, dtype=dtype)
+        if mmap_dir is not None:
+            os.makedirs(mmap_dir, exist_ok=True)
+            endog = memory_map_array(endog, os.path.join(mmap_dir, "endog.npy"))
+            exog = memory_map_array(exog, os.path.join(mmap_dir, "exog.npy"))
+            if offset is not None:
+                offset = memory_map_array(offset, os.path.join(mmap_dir, "offset.npy"))
+        glm = sm.GLM(endog, exog, family=family_class(), offset=offset)
+        return glm, list(parsed.exog_names)
+
+    @staticmethod
+    def build_subset_glm(site_glm, exog_names, columns, exog_gram):
+        """
+        Return a GLM over a subset of the columns of an already built site GLM (for the candidate models of a model
+        selection), along with its exog names. Nothing is copied: the GLM only keeps the indices of the columns, and
+        takes them out of the site GLM's (possibly memory-mapped) exog chunk by chunk, so it can only be fitted with
+        the chunked sweeps. exog_gram is X^T X of the site GLM's exog (see chunked_gram), for the rank of the subset.
+        """
+        missing = [column for column in columns if column not in exog_names]
+        if missing:
+            print(f"Columns {missing} are not in the model.")
+            raise ValueError(f"Columns {missing} are not in the model.")
+        indices = [exog_names.index(column) for column in columns]
+        rank = rank_from_gram(exog_gram[np.ix_(indices, indices)], site_glm.nobs)
+        glm = StreamingGLM(site_glm.endog, ColumnSubset(site_glm.exog, indices), getattr(site_glm, "offset", None),
+                           site_glm.family.__class__(), rank)
+        return glm, list(columns)
+
+    @staticmethod
+    def get_formula_design(formula, offset, read_chunks):
+        """
+        Returns a function that builds the (endog, exog, offset) of a chunk of the data for the formula, as
+        smf.glm does with the full data. The factor levels (and anything else the formula's transforms depend on)
+        are taken from a first pass over all the chunks given by read_chunks, so that every chunk gets the same columns.
+        """
+        y_design_info, x_design_info = patsy.incr_dbuilders(
+            formula, read_chunks, eval_env=patsy.EvalEnvironment.capture(0))
+        na_action = patsy.NAAction(on_NA="drop")
+
+        def design_chunk(chunk):
+            endog, exog = patsy.build_design_matrices(
+                [y_design_info, x_design_info], chunk, NA_action=na_action, return_type="dataframe")
+            # The rows with missing values are dropped, so the offset is taken from the rows that are left
+            chunk_offset = np.log(chunk.loc[exog.index, offset] + 1e-10) if offset else None
+            return endog, exog, chunk_offset
+
+        return design_chunk
+
+    @classmethod
+    def build_streaming_site_glm(cls, read_chunks, design_chunk, max_rows, family_class, mmap_dir, dtype=np.float64):
+        """
+        Build the design matrix without holding the dataset or the full design in memory: the chunks of the dataset
+        given by read_chunks are turned into (endog, exog, offset) by design_chunk, and written straight into .npy
+        files in mmap_dir, which hold at most max_rows rows. Returns a StreamingGLM over the memory-mapped arrays,
+        along with the exog names.
+        """
+        os.makedirs(mmap_dir, exist_ok=True)
+        endog_path, exog_path, offset_path = (os.path.join(mmap_dir, f"{name}.npy") for name in ("endog", "exog", "offset"))
+        endog_file = exog_file = offset_file = None
+        nobs = 0
+        for chunk in read_chunks():
+            chunk_endog, chunk_exog, chunk_offset = design_chunk(chunk)
+            if exog_file is None:
+                exog_names = list(chunk_exog.columns)
+                n_params = len(exog_names)
+                endog_file = np.lib.format.open_memmap(endog_path, mode="w+", dtype=dtype, shape=(max_rows,))
+                exog_file = np.lib.format.open_memmap(exog_path, mode="w+", dtype=dtype, shape=(max_rows, n_params))
+                if chunk_offset is not None:
+                    offset_file = np.lib.format.open_memmap(offset_path, mode="w+", dtype=dtype, shape=(max_rows,))
+                gram = np.zeros((n_params, n_params))
+            chunk_endog = np.asarray(chunk_endog, dtype=np.float64)
+            if chunk_endog.ndim > 1:
+                if chunk_endog.shape[1] != 1:
+                    print("The dependent variable must be a single column.")
+                    raise ValueError("The dependent variable must be a single column.")
+                chunk_endog = chunk_endog[:, 0]
+            chunk_exog = np.asarray(chunk_exog, dtype=np.float64)
+            if not (np.all(np.isfinite(chunk_endog)) and np.all(np.isfinite(chunk_exog))):
+                # As sm.GLM does - the formula drops the rows with missing values, but the x/y columns are taken as is
+                print("The endog or exog contains inf or nans.")
+                raise ValueError("The endog or exog contains inf or nans.")
+            rows = slice(nobs, nobs + chunk_exog.shape[0])
+            endog_file[rows] = chunk_endog
+            exog_file[rows] = chunk_exog
+            if offset_file is not None:
+                offset_file[rows] = chunk_offset
+            gram += chunk_exog.T.dot(chunk_exog)
+            nobs = rows.stop
+        if exog_file is None or nobs == 0:
+            print("The dataset has no rows to fit the model on.")
+            raise ValueError("The dataset has no rows to fit the model on.")
+        with_offset = offset_file is not None
+        for array in (endog_file, exog_file, offset_file):
+            if array is not None:
+                array.flush()
+        del endog_file, exog_file, offset_file
+
+        endog = np.load(endog_path, mmap_mode="r")[:nobs]
+        exog = np.load(exog_path, mmap_mode="r")[:nobs]
+        offset = np.load(offset_path, mmap_mode="r")[:nobs] if with_offset else None
+        glm = StreamingGLM(endog, exog, offset, family_class(), rank_from_gram(gram, nobs))
+        return glm, exog_names
+
+    @classmethod
+    def get_site_glm(cls, site_info, formula, offset, family_class, data=None, data_y=None, data_x=None):
+        """
+        Return the GLM of the local data cached in site_info, building it on first use.
+        Parsing the formula and building exog/endog does not depend on the round, and on wide datasets
+        it dominates the client round time, so it is done only once per site.
+        """
+        if "site_glm" not in site_info:
+            site_info["site_glm"], site_info["exog_names"] = cls.build_site_glm(
+                formula, offset, family_class, data, data_y, data_x)
+        return site_info["site_glm"]
+
+    @staticmethod
+    def get_warm_start_beta(np_data, site_info):
+        """
+        Take the coefficients of a previous fit sent by the server (see GLMModelPersistor's warm_start_from) out of
+        np_data, and return them if the previous fit was of the same model - i.e. it has the same exog names.
+        """
+        warm_start = np_data.pop("warm_start", None)
+        if not warm_start:
+            return None
+        if list(warm_start.get("exog_names") or []) != list(site_info["exog_names"]):
+            print(f"Not warm starting: the exog_names of the previous fit {warm_start.get('exog_names')} do not match "
+                  f"{site_info['exog_names']}.")
+            return None
+        return np.asarray(warm_start["beta"], dtype=np.float64)
+
     def get_local_coeffs(self, current_round, np_data, formula, offset, family_class, logger_warnings, data=None, data_y=None, data_x=None, site_info=None):
         raise NotImplementedError
 
@@ -28,6 +389,7 @@ class CoeffOptimizer:
 
 
 class NewtonRaphson(CoeffOptimizer):
+    symmetric_fields = (("second_derivative",),)
 
     def __init__(self, **kwargs):
         self.accuracy_threshold = None
@@ -35,25 +397,101 @@ class NewtonRaphson(CoeffOptimizer):
     def name(self):
         return "NR"
 
+    @staticmethod
+    def _chunked_fit(glm, chunk_size, logger_warnings, maxiter=100, tol=1e-8):
+        """
+        Same as glm.fit() - IRLS iterations until the deviance converges - with the sums of each iteration accumulated
+        over chunks of rows by IRLS._site_irls_sweep.
+        """
+        site_info = {"glm": glm}
+        params = None
+        previous_deviance = None
+        for _ in range(maxiter):
+            site_info["params"] = params
+            ols_params, _ = IRLS._site_irls_sweep(site_info, params, logger_warnings, chunk_size)
+            if previous_deviance is not None and np.isclose(site_info["deviance"], previous_deviance, rtol=tol, atol=tol):
+                break
+            previous_deviance = site_info["deviance"]
+            params = SymmetricSolver(ols_params["A"]).solve(ols_params["B"])
+        return params
+
+    @staticmethod
+    def _site_nr_sweep(glm, params, chunk_size):
+        """
+        Same as glm.loglike, glm.score and glm.hessian at params, summed over chunks of rows. Families without a fixed
+        scale need a first pass over all the rows for Pearson's chi2 estimate of the scale (as GLM.estimate_scale).
+        """
+        family = glm.family
+        n_params = glm.exog.shape[1]
+
+        def iter_chunks():
+            for rows in iter_row_chunks(glm.nobs, chunk_size):
+                exog = glm.exog[rows]
+                lin_pred = np.dot(exog, params) + take_rows(glm._offset_exposure, rows)
+                yield rows, exog, family.fitted(lin_pred)
+
+        scale = 1.
+        if not isinstance(family, FIXED_SCALE_FAMILIES):
+            pearson_chi2 = sum(
+                np.sum(np.power(glm.endog[rows] - mu, 2) * take_rows(glm.iweights, rows) / family.variance(mu))
+                for rows, _, mu in iter_chunks()
+            )
+            scale = pearson_chi2 / glm.df_resid
+        log_likelihood = 0.
+        score = np.zeros(n_params)
+        hessian = np.zeros((n_params, n_params))
+        for rows, exog, mu in iter_chunks():
+            endog = glm.endog[rows]
+            iweights = take_rows(glm.iweights, rows) * take_rows(glm.n_trials, rows)
+            log_likelihood += family.loglike(endog, mu, take_rows(glm.var_weights, rows), take_rows(glm.freq_weights, rows), scale)
+
+            # Score and observed Hessian, as in GLM.score_factor and GLM.hessian_factor
+            link_deriv = family.link.deriv(mu)
+            variance = family.variance(mu)
+            score_factor = (endog - mu) / link_deriv
+            score_factor /= variance
+            score_factor *= iweights
+            score += exog.T.dot(score_factor)
+            eim_factor = 1 / (link_deriv ** 2 * variance)
+            eim_factor *= iweights
+            tmp = variance * family.link.deriv2(mu)
+            tmp += family.variance.deriv(mu) * link_deriv
+            tmp = score_factor * tmp
+            tmp /= iweights
+            hessian -= (exog.T * (eim_factor * (1 + tmp))).dot(exog)
+        return log_likelihood, score / scale, hessian / scale
+
     def get_local_coeffs(self, current_round, np_data, formula, offset, family_class, logger_warnings, data=None, data_y=None, data_x=None, site_info=None):
         """
         This function is called by the client to calculate the local coefficients, and modifies the np_data object with the results.
         """
+        # The candidate models of a model selection are only ever fitted over chunks of rows (see build_subset_glm)
+        chunk_size = site_info.get("chunk_size")
         if current_round == 0:
             np_data["method"] = self.name()
-            glm = self.get_glm_obj(formula, offset, family_class, data, data_y, data_x)
-            res = glm.fit()
-            beta = res.params
-            np_data['beta'] = beta.values
+            glm = self.get_site_glm(site_info, formula, offset, family_class, data, data_y, data_x)
+            np_data["exog_names"] = site_info["exog_names"]
+            warm_beta = self.get_warm_start_beta(np_data, site_info)
+            if warm_beta is not None:
+                # Start the iterations from the coefficients of the previous fit instead of the local fits
+                np_data['beta'] = warm_beta
+            elif chunk_size:
+                np_data['beta'] = self._chunked_fit(glm, chunk_size, logger_warnings)
+            else:
+                res = glm.fit()
+                np_data['beta'] = np.asarray(res.params)
 
         elif 'beta' in np_data:
             fed_beta = np_data['beta']
-            glm = self.get_glm_obj(formula, offset, family_class, data, data_y, data_x)
-            # Compute the log-likelihood of the global model parameters (fed_beta) on the local dataset
-            log_likelihood = glm.loglike(params=fed_beta)
+            glm = self.get_site_glm(site_info, formula, offset, family_class, data, data_y, data_x)
+            if chunk_size:
+                log_likelihood, first_derivative, second_derivative = self._site_nr_sweep(glm, fed_beta, chunk_size)
+            else:
+                # Compute the log-likelihood of the global model parameters (fed_beta) on the local dataset
+                log_likelihood = glm.loglike(params=fed_beta)
+                first_derivative = glm.score(params=fed_beta)
+                second_derivative = glm.hessian(params=fed_beta)
             np_data["prev_global_loglik"] = log_likelihood
-            first_derivative = glm.score(params=fed_beta)
-            second_derivative = glm.hessian(params=fed_beta)
             np_data["first_derivative"] = first_derivative
             np_data["second_derivative"] = second_derivative
 
@@ -77,8 +515,8 @@ class NewtonRaphson(CoeffOptimizer):
                 add_results["beta_opt"] += data["beta"]
                 add_results["count_clients"] += 1
             else:
-                add_results["first_derivative_sum"] += data["first_derivative"]
-                add_results["second_derivative_sum"] += data["second_derivative"]
+                add_results["first_derivative_sum"] = accumulate(add_results["first_derivative_sum"], data["first_derivative"])
+                add_results["second_derivative_sum"] = accumulate(add_results["second_derivative_sum"], data["second_derivative"])
 
     def get_accuracy_threshold(self, target_accuracy, prev_beta, **kwargs):
         return np.absolute(target_accuracy * prev_beta)
@@ -89,33 +527,35 @@ class NewtonRaphson(CoeffOptimizer):
             prev_beta = add_results["beta_opt"] / add_results["count_clients"]
             accuracy_threshold = self.get_accuracy_threshold(target_accuracy, prev_beta)
             fed_stderror = np.zeros(prev_beta.shape)
+            condition_number = None
             next_beta = prev_beta
         else:
             prev_beta = add_results["betas_list"][-1]
-            second_derivative_sum_inverse = np.linalg.inv(add_results["second_derivative_sum"])
-            iteration_step = np.matmul(add_results["first_derivative_sum"], second_derivative_sum_inverse) * -1
+            # The Newton step -H^-1 g and the federated stderror both come from the Fisher information -H
+            fisher = SymmetricSolver(-1 * add_results["second_derivative_sum"])
+            condition_number = fisher.condition_number
+            iteration_step = fisher.solve(add_results["first_derivative_sum"])
             next_beta = prev_beta + iteration_step
             accuracy = np.absolute(next_beta - prev_beta)
 
             # calculate federated stderror
-            fisher = -1 * add_results["second_derivative_sum"]
-            fisher_inv = np.linalg.inv(fisher)
-            fed_stderror = np.sqrt(np.diag(fisher_inv))
+            fed_stderror = np.sqrt(fisher.inverse_diagonal())
 
             # Stop if the result is already accurate enough
             if np.all(np.greater(accuracy_threshold, accuracy)):
                 print(f"Reached accuracy threshold")
                 add_results["log_likelihood_sum"] = 0
-                return accuracy_threshold, {"beta": next_beta, "fed_stderror": fed_stderror, "signal": 'ABORT', "Reached accuracy threshold": True}
+                return accuracy_threshold, {"beta": next_beta, "fed_stderror": fed_stderror, "condition_number": condition_number, "signal": 'ABORT', "Reached accuracy threshold": True}
 
         add_results["first_derivative_sum"] = 0
         add_results["second_derivative_sum"] = 0
         add_results["betas_list"].append(next_beta)
         print(f"next beta after contribution round {contribution_round} is {next_beta}")
-        return accuracy_threshold, {"beta": next_beta, "fed_stderror": fed_stderror, "Reached accuracy threshold": False}
+        return accuracy_threshold, {"beta": next_beta, "fed_stderror": fed_stderror, "condition_number": condition_number, "Reached accuracy threshold": False}
 
 
 class IRLS(CoeffOptimizer):
+    symmetric_fields = (("site_hessian",), ("site_ols_params", "A"))
 
     def name(self):
         return "IRLS"
@@ -144,6 +584,20 @@ class IRLS(CoeffOptimizer):
                              " problem and should be reported.")
         return glm, lin_pred, mu
 
+    @classmethod
+    def _site_irls_start(cls, site_info, glm, use_sweep):
+        """
+        Prepare the first IRLS iteration of the site - in round 0, or in a later round when resuming a checkpointed job.
+        """
+        if use_sweep or site_info.get("params") is not None:
+            # The initial mu is computed in _site_irls_sweep, or from the params
+            site_info["glm"] = glm
+        else:
+            glm, lin_pred, mu = cls._site_irls_initialization(glm)
+            site_info["glm"] = glm
+            site_info["initial_lin_pred"] = lin_pred
+            site_info["initial_mu"] = mu
+
     @staticmethod
     def _site_irls_iteration(site_info, logger_warnings):
         """
@@ -158,16 +612,6 @@ class IRLS(CoeffOptimizer):
             mu = site_info['initial_mu']
         else:
             # Advanced iteration - use the params to calculate lin_pred and mu
-            wexog = site_info['wexog']
-            wendog = site_info['wendog']
-            wlsendog = site_info['wlsendog']
-
-            fitted_values = glm.exog.dot(params)
-            resid = wlsendog - fitted_values
-            wresid = wendog - wexog.dot(params)
-            df_resid = wexog.shape[0] - wexog.shape[1]
-            scale = np.dot(wresid, wresid) / df_resid
-
             lin_pred = np.dot(glm.exog, params)
             lin_pred += glm._offset_exposure
             mu = glm.family.fitted(lin_pred)
@@ -192,9 +636,6 @@ class IRLS(CoeffOptimizer):
 
         # Store info for the next iteration (to be used locally)
         site_info["glm"] = glm
-        site_info["wexog"] = wexog
-        site_info["wendog"] = wendog
-        site_info["wlsendog"] = wlsendog
 
         # Prepare the partial matrices to solve federated WLS (to be shared with the cloud)
         A = wexog.transpose().dot(wexog)
@@ -207,20 +648,144 @@ class IRLS(CoeffOptimizer):
 
         return ols_params
 
+    @staticmethod
+    def _site_irls_sweep(site_info, hessian_params, logger_warnings, chunk_size, with_loglike=False):
+        """
+        Does the work of _site_irls_initialization, _site_irls_iteration and glm.hessian in one pass over the data,
+        computing the linear predictor, mu and the weights once and accumulating A, B, the Hessian and the deviance
+        (and, with_loglike, the log-likelihood) over chunks of chunk_size rows.
+        For canonical links the observed Hessian at the current params is -A / scale, so it is not computed separately.
+        Nothing of size N x p is kept in site_info.
+        """
+        glm = site_info['glm']
+        family = glm.family
+        params = site_info.get('params', None)
+        n_params = glm.exog.shape[1]
+        fixed_scale = isinstance(family, FIXED_SCALE_FAMILIES)
+        hessian_from_A = hessian_params is params and has_canonical_link(family)
+        with_loglike = with_loglike and params is not None and fixed_scale
+        A = np.zeros((n_params, n_params))
+        B = np.zeros(n_params)
+        hessian = np.zeros((n_params, n_params))
+        deviance = 0.
+        pearson_chi2 = 0.
+        log_likelihood = 0.
+        perfect_prediction = True
+        if params is None:
+            # First iteration - start from the family's initial guess of mu, which may depend on all of endog
+            initial_mu = family.starting_mu(glm.endog)
+
+        for rows in iter_row_chunks(glm.nobs, chunk_size):
+            exog = glm.exog[rows]
+            endog = glm.endog[rows]
+            offset_exposure = take_rows(glm._offset_exposure, rows)
+            iweights = take_rows(glm.iweights, rows) * take_rows(glm.n_trials, rows)
+
+            if params is None:
+                mu = initial_mu[rows]
+                lin_pred = family.predict(mu)
+            else:
+                lin_pred = np.dot(exog, params)
+                lin_pred += offset_exposure
+                mu = family.fitted(lin_pred)
+                perfect_prediction = perfect_prediction and np.allclose(mu - endog, 0)
+            deviance += family.deviance(endog, mu, take_rows(glm.var_weights, rows), take_rows(glm.freq_weights, rows), 1.)
+            if with_loglike:
+                log_likelihood += family.loglike(endog, mu, take_rows(glm.var_weights, rows), take_rows(glm.freq_weights, rows), 1.)
+
+            # Normal equations of the weighted least squares step, as in _site_irls_iteration
+            w_half = np.sqrt(iweights * family.weights(mu))
+            wlsendog = lin_pred + family.link.deriv(mu) * (endog - mu) - offset_exposure
+            wexog = w_half[:, None] * exog
+            A += wexog.T.dot(wexog)
+            B += wexog.T.dot(w_half * wlsendog)
+
+            if hessian_from_A:
+                variance = family.variance(mu)
+                pearson_chi2 += np.sum(np.power(endog - mu, 2) * take_rows(glm.iweights, rows) / variance)
+                continue
+
+            # Observed Hessian with scale 1, as in GLM.hessian_factor
+            if hessian_params is params:
+                hessian_mu = mu
+            else:
+                hessian_mu = family.fitted(np.dot(exog, hessian_params) + offset_exposure)
+            link_deriv = family.link.deriv(hessian_mu)
+            variance = family.variance(hessian_mu)
+            eim_factor = 1 / (link_deriv ** 2 * variance)
+            eim_factor *= iweights
+            score_factor = (endog - hessian_mu) / link_deriv
+            score_factor /= variance
+            score_factor *= iweights
+            tmp = variance * family.link.deriv2(hessian_mu)
+            tmp += family.variance.deriv(hessian_mu) * link_deriv
+            tmp = score_factor * tmp
+            tmp /= iweights
+            hessian -= (exog.T * (eim_factor * (1 + tmp))).dot(exog)
+            pearson_chi2 += np.sum(np.power(endog - hessian_mu, 2) * take_rows(glm.iweights, rows) / variance)
+
+        if params is None and np.isnan(deviance):
+            raise ValueError("The first guess on the deviance function "
+                             "returned a nan.  This could be a boundary "
+                             " problem and should be reported.")
+        if params is not None and perfect_prediction:
+            logger_warnings("Perfect separation or prediction detected, "
+                            "parameter may not be identified")
+        if hessian_from_A:
+            hessian = -A
+        if not fixed_scale:
+            # Same scale as GLM.estimate_scale, which needs all the rows
+            hessian = hessian / (pearson_chi2 / glm.df_resid)
+        site_info['deviance'] = deviance
+        site_info['log_likelihood'] = log_likelihood if with_loglike else None
+
+        ols_params = {
+            'A': A,
+            'B': B,
+        }
+
+        return ols_params, hessian
+
+    @staticmethod
+    def _chunked_loglike(glm, params, chunk_size):
+        """
+        Same as glm.loglike(params), summed over chunks of rows.
+        """
+        def iter_chunks():
+            for rows in iter_row_chunks(glm.nobs, chunk_size):
+                lin_pred = np.dot(glm.exog[rows], params) + take_rows(glm._offset_exposure, rows)
+                yield rows, glm.family.fitted(lin_pred)
+
+        scale = 1.
+        if not isinstance(glm.family, FIXED_SCALE_FAMILIES):
+            # Pearson's chi2 estimate of the scale (as GLM.estimate_scale) needs a first pass over all the rows
+            pearson_chi2 = sum(
+                np.sum(np.power(glm.endog[rows] - mu, 2) * take_rows(glm.iweights, rows) / glm.family.variance(mu))
+                for rows, mu in iter_chunks()
+            )
+            scale = pearson_chi2 / glm.df_resid
+        return sum(
+            glm.family.loglike(glm.endog[rows], mu, take_rows(glm.var_weights, rows), take_rows(glm.freq_weights, rows), scale)
+            for rows, mu in iter_chunks()
+        )
+
     def get_local_coeffs(self, current_round, np_data, formula, offset, family_class, logger_warnings, data=None, data_y=None, data_x=None, site_info=None):
         """
         Calculate the local coefficients, and modifies the np_data object with the results.
         This method is called during each iteration of IRLS and runs locally at each site.
         """
-        glm = self.get_glm_obj(formula, offset, family_class, data, data_y, data_x)
+        glm = self.get_site_glm(site_info, formula, offset, family_class, data, data_y, data_x)
+        # Stream over chunks of rows if asked to, and make a single pass over the data for canonical links
+        chunk_size = site_info.get("chunk_size")
+        use_sweep = bool(chunk_size) or has_canonical_link(glm.family)
         if current_round == 0:
             np_data["method"] = self.name()
-            glm, lin_pred, mu = self._site_irls_initialization(glm)
-            site_info["glm"] = glm
-            site_info["initial_lin_pred"] = lin_pred
-            site_info["initial_mu"] = mu
-            np_data["initial_beta"] = np.zeros(glm.exog.shape[1])
-            np_data["exog_names"] = glm.exog_names
+            warm_beta = self.get_warm_start_beta(np_data, site_info)
+            np_data["initial_beta"] = np.zeros(glm.exog.shape[1]) if warm_beta is None else warm_beta
+            np_data["exog_names"] = site_info["exog_names"]
+            if warm_beta is not None:
+                # Start the iterations from the coefficients of the previous fit
+                site_info["params"] = np_data["initial_beta"]
         else:
             site_params = np_data.get("site_info", {}).get("params")
             if site_params is not None:
@@ -229,9 +794,11 @@ class IRLS(CoeffOptimizer):
                 fed_beta = np_data.get("beta")
             if fed_beta is None:
                 raise ValueError("Could not find model parameters in np_data.")
+            # Continue the local IRLS iteration from the global model parameters
+            site_info["params"] = fed_beta
 
-            log_likelihood = glm.loglike(params=fed_beta)
-            np_data["prev_global_loglik"] = log_likelihood
+        if "glm" not in site_info:
+            self._site_irls_start(site_info, glm, use_sweep)
 
         site_params = np_data.get("site_info", {}).get("params")
         if site_params is None:
@@ -241,8 +808,22 @@ class IRLS(CoeffOptimizer):
         if site_params is None:
             raise ValueError("No parameters found to compute Hessian.")
 
-        np_data["site_hessian"] = glm.hessian(params=site_params)
-        np_data["site_ols_params"] = self._site_irls_iteration(site_info, logger_warnings)
+        if use_sweep:
+            np_data["site_ols_params"], np_data["site_hessian"] = self._site_irls_sweep(
+                site_info, site_params, logger_warnings, chunk_size or glm.nobs, with_loglike=current_round > 0)
+        else:
+            np_data["site_hessian"] = glm.hessian(params=site_params)
+            np_data["site_ols_params"] = self._site_irls_iteration(site_info, logger_warnings)
+
+        if current_round > 0:
+            # Compute the log-likelihood of the global model parameters (fed_beta) on the local dataset
+            log_likelihood = site_info.get("log_likelihood") if use_sweep else None
+            if log_likelihood is None:
+                if chunk_size:
+                    log_likelihood = self._chunked_loglike(glm, fed_beta, chunk_size)
+                else:
+                    log_likelihood = glm.loglike(params=fed_beta)
+            np_data["prev_global_loglik"] = log_likelihood
 
     @staticmethod
     def get_add_results_base_dict():
@@ -260,29 +841,31 @@ class IRLS(CoeffOptimizer):
         else:
             if add_results["beta_opt"] is None:
                 add_results["beta_opt"] = data.get("initial_beta")  # Should be sent in the first round
-            add_results["A_sum"] += data["site_ols_params"]['A']
-            add_results["B_sum"] += data["site_ols_params"]['B']
-            add_results["combined_hessian"] += data["site_hessian"]
+            add_results["A_sum"] = accumulate(add_results["A_sum"], data["site_ols_params"]['A'])
+            add_results["B_sum"] = accumulate(add_results["B_sum"], data["site_ols_params"]['B'])
+            add_results["combined_hessian"] = accumulate(add_results["combined_hessian"], data["site_hessian"])
 
     def get_result(self, add_results, contribution_round, target_accuracy, **kwargs):
-        next_beta = np.linalg.inv(add_results["A_sum"]).dot(add_results["B_sum"])
+        A_sum = SymmetricSolver(add_results["A_sum"])
+        next_beta = A_sum.solve(add_results["B_sum"])
         # Prepare for next iteration
         accuracy = np.absolute(next_beta - add_results["beta_opt"])
         add_results["beta_opt"] = next_beta
         fisher_info = -1 * add_results["combined_hessian"]
-        fisher_info_inv = np.linalg.inv(fisher_info)
-        fed_stderror = np.sqrt(np.diag(fisher_info_inv))
+        # For canonical links with a fixed scale the sites send -A as their Hessian, so the factorization is reused
+        fisher_info = A_sum if np.array_equal(fisher_info, add_results["A_sum"]) else SymmetricSolver(fisher_info)
+        fed_stderror = np.sqrt(fisher_info.inverse_diagonal())
         # Stop if the result is already accurate enough
         if np.all(np.greater(target_accuracy, accuracy)):
             print(f"Reached accuracy threshold")
             add_results["log_likelihood_sum"] = 0
-            return None, {"beta": next_beta, "fed_stderror": fed_stderror, "signal": 'ABORT', "Reached accuracy threshold": True}
+            return None, {"beta": next_beta, "fed_stderror": fed_stderror, "condition_number": A_sum.condition_number, "signal": 'ABORT', "Reached accuracy threshold": True}
 
         add_results["A_sum"] = 0
         add_results["B_sum"] = 0
         add_results["combined_hessian"] = 0
         print(f"next beta after contribution round {contribution_round} is {next_beta}")
-        return None, {"site_info": {"params": next_beta}, "beta": next_beta, "fed_stderror": fed_stderror, "Reached accuracy threshold": False}
+        return None, {"site_info": {"params": next_beta}, "beta": next_beta, "fed_stderror": fed_stderror, "condition_number": A_sum.condition_number, "Reached accuracy threshold": False}
 
 
 OPTIMIZERS = {"NR": NewtonRaphson, "IRLS": IRLS}
@@ -18,14 +18,17 @@
 import numpy as np
 import re
 import threading
+import time
 from typing import Optional
 
+from aggregation_stats import summarize_step
 from coeff_optimizer import OPTIMIZERS
+from model_selection import ModelSelection
 
 
 class EPIAggregationHelper(object):
     def __init__(self, exclude_vars: Optional[str] = None, weigh_by_local_iter: bool = True,
-                 target_accuracy: float = None):
+                 target_accuracy: float = None, selection: Optional[dict] = None):
         """Perform aggregation by the chosen optimization method.
 
         Args:
@@ -36,6 +39,8 @@ class EPIAggregationHelper(object):
                 the number of computations on encrypted ciphertext.
                 The aggregated sum will still be divided by the provided weights and `aggregation_weights` for the
                 resulting weighted sum to be valid.
+            selection (dict, optional): Arguments of a ModelSelection to run once the full model has converged and
+                its AIC was computed, e.g. {"direction": "backward", "criterion": "aic"}. Defaults to None.
         """
         super().__init__()
         self.lock = threading.Lock()
@@ -53,15 +58,53 @@ class EPIAggregationHelper(object):
         self.method = None
         self.optimizer = None
         self.exog_names = None
+        self.prev_beta = None
+        self.round_stats = {"clients": {}}
+        self.model_helpers = dict()  # One helper per model ID when the clients fit several models
+        self.model_results = dict()
+        self.round_model_ids = set()
+        self.model_rounds = dict()  # Number of aggregations of each model, which start at different rounds
+        self.model_columns = dict()  # Columns of the candidate models of the model selection
+        self.selection = ModelSelection(**selection) if selection else None
+        self.nobs = dict()
         self.abort_signal = False
         self.last_result = None
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_state(self):
+        """The optimizer state (the method, betas, accuracy threshold, ...) to checkpoint between jobs"""
+        return self.__getstate__()
+
+    def set_state(self, state):
+        """Continue from an optimizer state returned by get_state"""
+        self.__setstate__(state)
+
     def reset_stats(self):
         self.total = dict()
         self.counts = dict()
         self.history = list()
 
+    def get_model_helper(self, model_id):
+        if model_id not in self.model_helpers:
+            self.model_helpers[model_id] = EPIAggregationHelper(
+                exclude_vars=self.exclude_vars.pattern if self.exclude_vars else None,
+                weigh_by_local_iter=self.weigh_by_local_iter,
+                target_accuracy=self.target_accuracy,
+            )
+        return self.model_helpers[model_id]
+
     def verify_exog_names(self, data):
+        if "models" in data:
+            return all(self.get_model_helper(model_id).verify_exog_names(model_data)
+                       for model_id, model_data in data["models"].items())
         current_exog_names = data.get("exog_names")
         if current_exog_names is None:
             return True
@@ -76,6 +119,12 @@ class EPIAggregationHelper(object):
             return True
 
     def set_optimization_method(self, data):
+        if "models" in data:
+            if self.selection is not None and self.selection.exog_names is None:
+                raise ValueError("Model selection is only supported for jobs that fit a single model.")
+            for model_id, model_data in data["models"].items():
+                self.get_model_helper(model_id).set_optimization_method(model_data)
+            return
         if not self.method:
             try:
                 # The method is initialized by the client - set server config accordingly
@@ -88,8 +137,21 @@ class EPIAggregationHelper(object):
     def add(self, data, weight, contributor_name, contribution_round):
         """Compute sum of weights."""
         self.contribution_round = contribution_round
-        with self.lock:
-            self.optimizer.add(data, self.add_results, contribution_round)
+        start_time = time.perf_counter()
+        if "models" in data:
+            # Each model is aggregated independently, by its own helper
+            for model_id, model_data in data["models"].items():
+                model_round = self.model_rounds.get(model_id, contribution_round)
+                self.model_helpers[model_id].add(model_data, weight, contributor_name, model_round)
+                self.round_model_ids.add(model_id)
+        else:
+            if "nobs" in data:
+                self.nobs[contributor_name] = data["nobs"]
+            # Clients send the symmetric matrices as packed upper triangles
+            data = self.optimizer.unpack_symmetric_fields(data)
+            with self.lock:
+                self.optimizer.add(data, self.add_results, contribution_round)
+        self.record_client_stats(contributor_name, add_seconds=time.perf_counter() - start_time)
         self.history.append(
             {
                 "contributor_name": contributor_name,
@@ -99,12 +161,39 @@ class EPIAggregationHelper(object):
         )
 
     def get_result(self):
+        start_time = time.perf_counter()
+        if self.model_helpers:
+            result = self._get_models_result()
+        else:
+            result = self._get_result()
+            step_norm, max_relative_change = summarize_step(self.prev_beta, result.get("beta"))
+            self.prev_beta = result.get("beta")
+            self.round_stats.update(
+                step_norm=step_norm,
+                max_relative_change=max_relative_change,
+                condition_number=result.get("condition_number"),
+            )
+            if self.exog_names is not None and "exog_names" not in result:
+                # Saved with the model, to warm start later fits of the same model (see GLMModelPersistor)
+                result["exog_names"] = self.exog_names
+            if self.selection is not None and "aic" in result:
+                # The full model is done - search for a better subset of its columns
+                result = self._selection_step_result(self.selection.start(self.exog_names, result))
+        self.round_stats.update(
+            get_result_seconds=time.perf_counter() - start_time,
+            converged=result.get("signal") == "ABORT",
+        )
+        return result
+
+    def _get_result(self):
         """If already aborted"""
         if self.abort_signal:
             result = self.last_result
             k = len(self.last_result["beta"])  # number of parameters
             aic = 2 * k - 2 * self.add_results["log_likelihood_sum"]
             result["aic"] = aic
+            if self.nobs:
+                result["bic"] = k * np.log(sum(self.nobs.values())) - 2 * self.add_results["log_likelihood_sum"]
             return result
 
         """Aggregate from all sites"""
@@ -119,8 +208,87 @@ class EPIAggregationHelper(object):
             self.reset_stats()
             return result
 
+    def _get_models_result(self):
+        """Aggregate each model that was sent this round, keeping the last result of the models that are done"""
+        model_stats = dict()
+        for model_id in sorted(self.round_model_ids):
+            helper = self.model_helpers[model_id]
+            result = helper.get_result()
+            # A model is done once its AIC has been computed, in the round after it converged
+            result["done"] = "aic" in result
+            self.model_rounds[model_id] = self.model_rounds.get(model_id, self.contribution_round) + 1
+            result["model_round"] = self.model_rounds[model_id]
+            if model_id in self.model_columns:
+                result["columns"] = self.model_columns[model_id]
+            self.model_results[model_id] = result
+            model_stats[model_id] = {
+                key: value for key, value in helper.pop_round_stats().items()
+                if key in ("step_norm", "max_relative_change", "condition_number", "converged")
+            }
+        self.round_model_ids = set()
+        self.reset_stats()
+        self.round_stats.update(
+            models=model_stats,
+            num_active_models=len(model_stats),
+            step_norm=max((stats["step_norm"] for stats in model_stats.values()
+                           if stats["step_norm"] is not None), default=None),
+            max_relative_change=max((stats["max_relative_change"] for stats in model_stats.values()
+                                     if stats["max_relative_change"] is not None), default=None),
+            condition_number=max((stats["condition_number"] for stats in model_stats.values()
+                                  if stats["condition_number"] is not None), default=None),
+        )
+
+        if self.selection is not None:
+            if all(model_result.get("done") for model_result in self.model_results.values()):
+                results = {tuple(self.model_columns[model_id]): model_result
+                           for model_id, model_result in self.model_results.items()}
+                return self._selection_step_result(self.selection.add_results(results))
+            return {"models": dict(self.model_results)}
+
+        result = {"models": dict(self.model_results)}
+        # Once all models converged, the clients are sent one final round to compute the AIC of the remaining ones
+        if all(model_result.get("signal") == "ABORT" for model_result in self.model_results.values()):
+            result["signal"] = "ABORT"
+        return result
+
+    def _selection_step_result(self, candidates):
+        """Send the candidate models of the next selection step to the clients, or the selected model once it is done"""
+        self.model_helpers = dict()
+        self.model_results = dict()
+        self.model_rounds = dict()
+        self.model_columns = dict()
+        if not candidates:
+            result = self.selection.get_result()
+            print(f"Model selection is done, selected columns: {result['exog_names']}")
+            result["signal"] = "ABORT"
+            return result
+        step = len(self.selection.steps) - 1
+        print(f"Model selection step {step}: fitting {len(candidates)} candidate model(s)")
+        for index, columns in enumerate(candidates):
+            model_id = f"step_{step}_{index}"
+            self.model_columns[model_id] = columns
+            self.model_rounds[model_id] = 0
+            self.model_results[model_id] = {"columns": columns, "model_round": 0}
+        return {"models": dict(self.model_results)}
+
     def get_history(self):
         return self.history
 
     def get_len(self):
         return len(self.get_history())
+
+    def record_client_stats(self, contributor_name, **stats):
+        self.round_stats["clients"].setdefault(contributor_name, {}).update(stats)
+
+    def pop_round_stats(self):
+        """Return the statistics of the round that was just aggregated, and start recording the next one."""
+        stats, self.round_stats = self.round_stats, {"clients": {}}
+        clients = stats["clients"].values()
+        stats.update(
+            num_clients=len(stats["clients"]),
+            payload_bytes=sum(client.get("payload_bytes", 0) for client in clients),
+            max_accept_seconds=max((client.get("accept_seconds", 0.) for client in clients), default=None),
+            add_seconds=sum(client.get("add_seconds", 0.) for client in clients),
+            target_accuracy=self.target_accuracy,
+        )
+        return stats
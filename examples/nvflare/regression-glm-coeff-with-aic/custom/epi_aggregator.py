@@ -15,7 +15,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any, Dict, Union
+import time
+from typing import Any, Dict, Optional, Union
 
 from nvflare.apis.dxo import DXO, DataKind, from_shareable
 from nvflare.apis.fl_constant import ReservedKey, ReturnCode
@@ -24,6 +25,7 @@ from nvflare.apis.shareable import Shareable
 from nvflare.app_common.abstract.aggregator import Aggregator
 from epi_aggregator_dxo import DXOAggregator
 from nvflare.app_common.app_constant import AppConstants
+from nvflare.app_common.app_event_type import AppEventType
 
 
 def _is_nested_aggregation_weights(aggregation_weights):
@@ -53,6 +55,9 @@ class EPIAggregator(Aggregator):
         expected_data_kind: Union[DataKind, Dict[str, DataKind]] = DataKind.WEIGHT_DIFF,
         weigh_by_local_iter: bool = True,
         target_accuracy: float = None,
+        stats_dir: Optional[str] = "glm_stats",
+        tb_log_dir: Optional[str] = None,
+        selection: Optional[dict] = None,
     ):
         """Perform accumulated weighted aggregation.
 
@@ -80,6 +85,14 @@ class EPIAggregator(Aggregator):
                 resulting weighted sum to be valid.
             target_accuracy (float, optional): Target accuracy for the model. Defaults to None.
                 If provided, the aggregator will stop accepting contributions when the accuracy reaches the target.
+            stats_dir (str, optional): Directory under the run dir to write the per-round aggregation statistics
+                (client latencies, payload sizes, server timings and convergence) to, as rounds.jsonl and rounds.csv.
+                Defaults to "glm_stats". Set to None to not write them.
+            tb_log_dir (str, optional): Directory to also write the per-round statistics to as TensorBoard logs
+                (requires tensorboardX). Defaults to None.
+            selection (dict, optional): Run a stepwise or all-subsets selection of the model's columns by AIC or BIC
+                once the full model is fitted, with the arguments of model_selection.ModelSelection, e.g.
+                {"direction": "backward", "criterion": "aic", "keep": ["Intercept"]}. Defaults to None.
         """
         super().__init__()
         self.logger.debug(f"exclude vars: {exclude_vars}")
@@ -89,6 +102,7 @@ class EPIAggregator(Aggregator):
         self._single_dxo_key = ""
         self._weigh_by_local_iter = weigh_by_local_iter
         self.target_accuracy = target_accuracy
+        self._round_start_time = None
 
         # Check expected data kind
         if isinstance(expected_data_kind, dict):
@@ -166,10 +180,26 @@ class EPIAggregator(Aggregator):
                         name_postfix=k,
                         weigh_by_local_iter=self._weigh_by_local_iter,
                         target_accuracy=self.target_accuracy,
+                        stats_dir=stats_dir,
+                        tb_log_dir=tb_log_dir,
+                        selection=selection,
                     )
                 }
             )
 
+    def get_optimizer_state(self) -> dict:
+        """The optimizer state of each expected DXO, which GLMModelPersistor checkpoints along with the model"""
+        return {key: dxo_aggregator.get_optimizer_state() for key, dxo_aggregator in self.dxo_aggregators.items()}
+
+    def set_optimizer_state(self, state: dict):
+        """Continue from an optimizer state returned by get_optimizer_state (when resuming a checkpointed job)"""
+        for key, dxo_state in state.items():
+            self.dxo_aggregators[key].set_optimizer_state(dxo_state)
+
+    def handle_event(self, event_type: str, fl_ctx: FLContext):
+        if event_type == AppEventType.ROUND_STARTED:
+            self._round_start_time = time.time()
+
     def accept(self, shareable: Shareable, fl_ctx: FLContext) -> bool:
         """Store shareable and update aggregator's internal state
 
@@ -181,6 +211,9 @@ class EPIAggregator(Aggregator):
             The first boolean indicates if this shareable is accepted.
             The second boolean indicates if aggregate can be called.
         """
+        start_time = time.perf_counter()
+        # Time since the round started, which is mostly the client compute and the network transfer
+        received_after_seconds = time.time() - self._round_start_time if self._round_start_time else None
         try:
             dxo = from_shareable(shareable)
         except Exception:
@@ -205,6 +238,7 @@ class EPIAggregator(Aggregator):
 
         # Accept expected DXO(s) in shareable
         n_accepted = 0
+        accepted_keys = []
         for key in self.expected_data_kind.keys():
             if key == self._single_dxo_key:  # expecting a single DXO
                 sub_dxo = dxo
@@ -221,8 +255,14 @@ class EPIAggregator(Aggregator):
                 return False
             else:
                 n_accepted += 1
+                accepted_keys.append(key)
 
         if n_accepted > 0:
+            accept_seconds = time.perf_counter() - start_time
+            for key in accepted_keys:
+                self.dxo_aggregators[key].record_client_stats(
+                    contributor_name, accept_seconds=accept_seconds, received_after_seconds=received_after_seconds
+                )
             return True
         else:
             self.log_warning(fl_ctx, f"Did not accept any DXOs from {contributor_name} in round {contribution_round}!")
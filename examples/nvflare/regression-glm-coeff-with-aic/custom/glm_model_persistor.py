@@ -23,6 +23,7 @@ from nvflare.apis.fl_constant import FLContextKey
 from nvflare.apis.fl_context import FLContext
 from nvflare.app_common.abstract.model import ModelLearnable, ModelLearnableKey, make_model_learnable
 from nvflare.app_common.abstract.model_persistor import ModelPersistor
+from nvflare.app_common.app_constant import AppConstants
 from nvflare.security.logging import secure_format_exception
 
 
@@ -37,12 +38,42 @@ def _get_run_dir(fl_ctx: FLContext):
     return run_dir
 
 
+def _load_pickled_dict(path):
+    return np.load(path, allow_pickle=True).item()
+
+
+def _warm_start_from_weights(weights):
+    """The coefficients and exog names of each model in the saved weights of a previous fit"""
+    if "models" in weights:
+        models = {model_id: _warm_start_from_weights(model_weights) for model_id, model_weights in weights["models"].items()}
+        models = {model_id: warm_start for model_id, warm_start in models.items() if warm_start}
+        return {"models": models} if models else None
+    if weights.get("beta") is None or not weights.get("exog_names"):
+        return None
+    return {"beta": weights["beta"], "exog_names": weights["exog_names"]}
+
+
 class GLMModelPersistor(ModelPersistor):
-    def __init__(self, model_dir="/output", model_name="model_parameters.npy"):
+    def __init__(self, model_dir="/output", model_name="model_parameters.npy", checkpoint_name="glm_checkpoint.npy",
+                 aggregator_id=AppConstants.DEFAULT_AGGREGATOR_ID, resume_from=None, warm_start_from=None):
+        """
+        Saves the model parameters, and a checkpoint of the optimizer state of the aggregator (the method, betas,
+        accuracy threshold, ...) along with the current round, in model_dir.
+
+        Args:
+            resume_from (str, optional): The checkpoint file of an interrupted job to continue from, with its
+                optimizer state and from the round after the checkpointed one. Defaults to None.
+            warm_start_from (str, optional): The model parameters (or checkpoint) file of a previous fit to start
+                the iterations from. The clients only use them for a model with the same exog names. Defaults to None.
+        """
         super().__init__()
 
         self.model_dir = model_dir
         self.model_name = model_name
+        self.checkpoint_name = checkpoint_name
+        self.aggregator_id = aggregator_id
+        self.resume_from = resume_from
+        self.warm_start_from = warm_start_from
 
         # This is default model that will be used if not local model is provided.
         self.default_data = np.array([], dtype=np.float32)
@@ -62,6 +93,10 @@ class GLMModelPersistor(ModelPersistor):
             data = self.default_data.copy()
 
         model_learnable = make_model_learnable(weights={"beta": data}, meta_props={})
+        if self.resume_from:
+            model_learnable = self._resume(model_learnable, os.path.join(run_dir, self.resume_from), fl_ctx)
+        elif self.warm_start_from:
+            self._warm_start(model_learnable, os.path.join(run_dir, self.warm_start_from), fl_ctx)
 
 
         self.log_info(fl_ctx, f"Loaded initial model: {model_learnable[ModelLearnableKey.WEIGHTS]}")
@@ -76,3 +111,45 @@ class GLMModelPersistor(ModelPersistor):
         model_path = os.path.join(model_root_dir, self.model_name)
         np.save(model_path, model_learnable[ModelLearnableKey.WEIGHTS])#["numpy_key"])
         self.log_info(fl_ctx, f"Saved numpy model to: {model_path}")
+
+        aggregator = fl_ctx.get_engine().get_component(self.aggregator_id)
+        if not self.checkpoint_name or not hasattr(aggregator, "get_optimizer_state"):
+            return
+        checkpoint = {
+            "weights": model_learnable[ModelLearnableKey.WEIGHTS],
+            "current_round": fl_ctx.get_prop(AppConstants.CURRENT_ROUND),
+            "optimizer_state": aggregator.get_optimizer_state(),
+        }
+        checkpoint_path = os.path.join(model_root_dir, self.checkpoint_name)
+        np.save(checkpoint_path, checkpoint)
+        self.log_info(fl_ctx, f"Saved optimizer checkpoint of round {checkpoint['current_round']} to: {checkpoint_path}")
+
+    def _resume(self, model_learnable: ModelLearnable, checkpoint_path, fl_ctx: FLContext) -> ModelLearnable:
+        """Restore the aggregator's optimizer state, and send the checkpointed model to the clients"""
+        try:
+            checkpoint = _load_pickled_dict(checkpoint_path)
+            aggregator = fl_ctx.get_engine().get_component(self.aggregator_id)
+            aggregator.set_optimizer_state(checkpoint["optimizer_state"])
+        except Exception as e:
+            self.log_error(fl_ctx, f"Unable to resume from {checkpoint_path}: {secure_format_exception(e)}.")
+            raise
+        self.log_info(fl_ctx, f"Resuming from the checkpoint of round {checkpoint['current_round']} in {checkpoint_path}")
+        # The controller continues from the round after the checkpointed one
+        return make_model_learnable(weights=checkpoint["weights"],
+                                    meta_props={AppConstants.CURRENT_ROUND: checkpoint["current_round"]})
+
+    def _warm_start(self, model_learnable: ModelLearnable, previous_path, fl_ctx: FLContext):
+        """Send the coefficients of a previous fit to the clients, to start the iterations from"""
+        try:
+            previous = _load_pickled_dict(previous_path)
+        except Exception as e:
+            self.log_warning(fl_ctx, f"Unable to load the previous fit from {previous_path}: "
+                                     f"{secure_format_exception(e)}. Not warm starting.")
+            return
+        # Either a checkpoint or the model parameters
+        warm_start = _warm_start_from_weights(previous.get("weights", previous))
+        if warm_start is None:
+            self.log_warning(fl_ctx, f"No coefficients with exog names found in {previous_path}. Not warm starting.")
+            return
+        model_learnable[ModelLearnableKey.WEIGHTS]["warm_start"] = warm_start
+        self.log_info(fl_ctx, f"Warm starting from the previous fit in {previous_path}")
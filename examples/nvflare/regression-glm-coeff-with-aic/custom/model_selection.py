@@ -0,0 +1,177 @@
+# Copyright (c) 2025, Rhino HealthTech, Inc.
+
+import itertools
+from math import comb
+
+import numpy as np
+
+SELECTION_DIRECTIONS = ("backward", "forward", "all_subsets")
+SELECTION_CRITERIA = ("aic", "bic")
+
+
+class ModelSelection:
+    """
+    Server-driven search over subsets of the columns of the full model, scored by AIC or BIC.
+
+    Each step proposes a batch of candidate column subsets, which the clients fit concurrently from their cached
+    design matrix (see GLMTrainer._fit_candidates). Once every candidate of the step has its criterion, the search
+    moves on:
+    - backward: start from the full model and drop the column whose removal improves the criterion the most,
+      until no removal improves it
+    - forward: start from the `keep` columns and add the column that improves the criterion the most,
+      until no addition improves it
+    - all_subsets: fit every subset of up to `max_subset_size` columns (on top of the `keep` columns),
+      `max_candidates_per_step` at a time, and select the best one
+    """
+
+    def __init__(self, direction="backward", criterion="aic", keep=("Intercept",), max_steps=None,
+                 max_subset_size=None, max_candidates_per_step=64, max_models=1024):
+        if direction not in SELECTION_DIRECTIONS:
+            print(f"Invalid selection direction {direction}, must be one of {SELECTION_DIRECTIONS}.")
+            raise ValueError(f"Invalid selection direction {direction}, must be one of {SELECTION_DIRECTIONS}.")
+        if criterion not in SELECTION_CRITERIA:
+            print(f"Invalid selection criterion {criterion}, must be one of {SELECTION_CRITERIA}.")
+            raise ValueError(f"Invalid selection criterion {criterion}, must be one of {SELECTION_CRITERIA}.")
+        if not isinstance(max_candidates_per_step, int) or max_candidates_per_step <= 0:
+            print("max_candidates_per_step must be a positive integer.")
+            raise ValueError("max_candidates_per_step must be a positive integer.")
+        self.direction = direction
+        self.criterion = criterion
+        self.keep = list(keep or [])
+        self.max_steps = max_steps
+        self.max_subset_size = max_subset_size
+        self.max_candidates_per_step = max_candidates_per_step
+        self.max_models = max_models
+
+        self.exog_names = None
+        self.current = None  # The selected columns so far (for stepwise search)
+        self.results = dict()  # frozenset of columns -> summary of the fitted model
+        self.steps = list()
+        self._pending_subsets = None  # Remaining subsets to fit (for all-subsets search)
+
+    def __getstate__(self):
+        # The remaining subsets are a generator, which can not be checkpointed as is
+        state = self.__dict__.copy()
+        if self._pending_subsets is not None:
+            pending = list(self._pending_subsets)
+            self._pending_subsets = iter(pending)
+            state["_pending_subsets"] = pending
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._pending_subsets is not None:
+            self._pending_subsets = iter(self._pending_subsets)
+
+    def _ordered(self, columns):
+        return [name for name in self.exog_names if name in columns]
+
+    def _score(self, columns):
+        result = self.results.get(frozenset(columns))
+        if result is None or result.get(self.criterion) is None:
+            return np.inf
+        return result[self.criterion]
+
+    def _record(self, columns, result):
+        self.results[frozenset(columns)] = {
+            "columns": self._ordered(columns),
+            "beta": result.get("beta"),
+            "fed_stderror": result.get("fed_stderror"),
+            "aic": result.get("aic"),
+            "bic": result.get("bic"),
+        }
+
+    def start(self, exog_names, full_result):
+        """Start the search from the result of the full model, and return the candidates of the first step."""
+        self.exog_names = list(exog_names)
+        missing = [name for name in self.keep if name not in self.exog_names]
+        if missing:
+            print(f"Columns to keep {missing} are not in the model, ignoring them.")
+        self.keep = self._ordered(self.keep)
+        self._record(self.exog_names, full_result)
+
+        optional = [name for name in self.exog_names if name not in self.keep]
+        if self.direction == "backward":
+            self.current = self.exog_names
+        elif self.direction == "forward":
+            self.current = self.keep
+        else:
+            max_size = len(optional) if self.max_subset_size is None else min(self.max_subset_size, len(optional))
+            num_models = sum(comb(len(optional), size) for size in range(max_size + 1))
+            if num_models > self.max_models:
+                print(f"All-subsets selection would fit {num_models} models, more than max_models={self.max_models}. "
+                      f"Lower max_subset_size or raise max_models.")
+                raise ValueError(f"All-subsets selection would fit {num_models} models, more than max_models={self.max_models}.")
+            self._pending_subsets = itertools.chain.from_iterable(
+                itertools.combinations(optional, size) for size in range(max_size + 1))
+        return self._next_candidates()
+
+    def add_results(self, results):
+        """Record the results of a step's candidates (keyed by their columns), and return the next step's candidates."""
+        for columns, result in results.items():
+            self._record(columns, result)
+        step_candidates = [self.results[frozenset(columns)] for columns in results]
+        self.steps[-1]["candidates"] = [
+            {"columns": result["columns"], "aic": result["aic"], "bic": result["bic"]} for result in step_candidates
+        ]
+
+        if self.direction != "all_subsets":
+            best = min(step_candidates, key=lambda result: self._score(result["columns"]))
+            if self._score(best["columns"]) < self._score(self.current):
+                self.current = best["columns"]
+                self.steps[-1]["selected"] = best["columns"]
+            else:
+                # No candidate improves on the current model, so the search is done
+                self.steps[-1]["selected"] = self.current
+                return []
+        return self._next_candidates()
+
+    def _unfitted(self, candidates):
+        # A model with no columns can not be fitted, and already fitted models are not fitted again
+        return [columns for columns in candidates if columns and frozenset(columns) not in self.results]
+
+    def _next_candidates(self):
+        if self.max_steps is not None and len(self.steps) >= self.max_steps:
+            return []
+        if self.direction == "backward":
+            candidates = [[name for name in self.current if name != removed]
+                          for removed in self.current if removed not in self.keep]
+        elif self.direction == "forward":
+            candidates = [self._ordered(self.current + [name]) for name in self.exog_names if name not in self.current]
+            if self.current and frozenset(self.current) not in self.results:
+                # The starting model also has to be scored
+                candidates.insert(0, self.current)
+        else:
+            candidates = list()
+            while len(candidates) < self.max_candidates_per_step:
+                subset = next(self._pending_subsets, None)
+                if subset is None:
+                    break
+                candidates.append(self._ordered(self.keep + list(subset)))
+                candidates = self._unfitted(candidates)
+        candidates = self._unfitted(candidates)
+        if candidates:
+            self.steps.append({"step": len(self.steps), "candidates": None, "selected": None})
+        return candidates
+
+    def get_result(self):
+        """The selected model, and a summary of the models fitted at each step"""
+        if self.direction == "all_subsets":
+            selected = min(self.results.values(), key=lambda result: self._score(result["columns"]))
+        else:
+            selected = self.results.get(frozenset(self.current))
+            if selected is None:
+                selected = min(self.results.values(), key=lambda result: self._score(result["columns"]))
+        return {
+            "beta": selected["beta"],
+            "fed_stderror": selected["fed_stderror"],
+            "aic": selected["aic"],
+            "bic": selected["bic"],
+            "exog_names": selected["columns"],
+            "selection": {
+                "direction": self.direction,
+                "criterion": self.criterion,
+                "selected_columns": selected["columns"],
+                "steps": self.steps,
+            },
+        }
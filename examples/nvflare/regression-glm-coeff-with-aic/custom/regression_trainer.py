@@ -33,7 +33,23 @@ from nvflare.app_common.abstract.model import ModelLearnable
 from nvflare.app_common.app_constant import AppConstants
 from nvflare.security.logging import secure_format_exception
 
-from coeff_optimizer import OPTIMIZERS
+from coeff_optimizer import OPTIMIZERS, CoeffOptimizer, chunked_gram
+
+# Number of rows per chunk to fit the candidate models of a model selection over, when irls_chunk_size is not set
+CANDIDATE_CHUNK_SIZE = 10_000
+
+
+def scan_csv(path, chunk_size):
+    """
+    Count the rows of a CSV file in chunks, and find its text columns - those that pandas reads as text in any chunk,
+    as it would when reading the whole file at once.
+    """
+    num_rows = 0
+    text_columns = set()
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        num_rows += len(chunk)
+        text_columns.update(column for column, dtype in chunk.dtypes.items() if pd.api.types.is_string_dtype(dtype))
+    return num_rows, text_columns
 
 
 class GLMTrainer(Executor):
@@ -52,7 +68,13 @@ class GLMTrainer(Executor):
         add_intercept=True,
         formula=None,
         cast_to_string_fields=None,
-        method=None
+        method=None,
+        design_dtype="float64",
+        irls_chunk_size=None,
+        design_cache_dir=None,
+        pack_symmetric=True,
+        packed_A_dtype="float64",
+        models=None
     ):
         # Init functions of components should be very minimal. Init
         # is called when json is read. A big init will cause json loading to halt
@@ -75,44 +97,238 @@ class GLMTrainer(Executor):
         self._cast_to_string_fields = cast_to_string_fields  # Fields to explicitly cast to string (e.g. categorical
                                                              # fields that have numeric values)
         self.glm_type = glm_type  # GLM family type (e.g. Binomial, Gaussian, Poisson, etc.)
-        self.family_class = getattr(sm.families, self.glm_type)
         self.method = method
         self.offset = offset
-        self.site_info = dict()
-        print(f"Initialized Federated Client. {x_values=}, {y_values=}, {formula=}, {glm_type=}, {add_intercept=}, {cast_to_string_fields=}")
-
-        if not self.formula and not (self.x_values and self.y_values):
-            print("Either formula or x_values and y_values must be provided.")
-            raise ValueError("Either formula or x_values and y_values must be provided.")
-
-        if self.offset and self.family_class != sm.families.Poisson:
-            print("Offset is only supported for Poisson distribution family.")
-            raise ValueError("Offset is only supported for Poisson distribution family.")
+        self.model_specs = models  # Specs of several models to fit in the same job (instead of the single model above)
+        self.design_dtype = design_dtype  # dtype of the cached design matrix ("float64", or "float32" to halve its memory)
+        self.irls_chunk_size = irls_chunk_size  # Number of rows per chunk to stream the IRLS sums over (None for all at once)
+        self.design_cache_dir = design_cache_dir  # Directory to memory-map the design matrix from (None to keep it in memory)
+        self._pack_symmetric = pack_symmetric  # Whether to send the symmetric matrices as their upper triangles only
+        self._packed_A_dtype = packed_A_dtype  # dtype to send the IRLS A matrix in when packed ("float64" or "float32")
+        print(f"Initialized Federated Client. {x_values=}, {y_values=}, {formula=}, {glm_type=}, {add_intercept=}, {cast_to_string_fields=}, {models=}")
+
+        if self.model_specs is not None and (not isinstance(self.model_specs, list) or not self.model_specs):
+            print("models must be a non-empty list of model specs.")
+            raise ValueError("models must be a non-empty list of model specs.")
+
+        if self.design_dtype not in ("float64", "float32"):
+            print("design_dtype must be either float64 or float32.")
+            raise ValueError("design_dtype must be either float64 or float32.")
+
+        if self._packed_A_dtype not in ("float64", "float32"):
+            print("packed_A_dtype must be either float64 or float32.")
+            raise ValueError("packed_A_dtype must be either float64 or float32.")
+
+        if self.irls_chunk_size is not None:
+            if not isinstance(self.irls_chunk_size, int) or self.irls_chunk_size <= 0:
+                print("irls_chunk_size must be a positive integer.")
+                raise ValueError("irls_chunk_size must be a positive integer.")
 
         # Load dataset
         datasets_path = '/input/datasets'
         dataset_uid = next(os.walk(datasets_path))[1][0]
-        dataset_path = f'{datasets_path}/{dataset_uid}/dataset.csv'
-        self.data = pd.read_csv(dataset_path)
+        self.dataset_path = f'{datasets_path}/{dataset_uid}/dataset.csv'
+        # With both a chunk size and a cache directory, the design matrices are built chunk by chunk straight into
+        # the cache, so the dataset is never loaded whole
+        self.stream_design = bool(self.irls_chunk_size and self.design_cache_dir)
+        if self.stream_design:
+            print(f"Reading the dataset in chunks of {self.irls_chunk_size} rows.")
+            self._num_rows, self._text_columns = scan_csv(self.dataset_path, self.irls_chunk_size)
+            self.data = None
+        else:
+            self.data = self._prepare_data(pd.read_csv(self.dataset_path))
+
+        # Build each model's design matrix once - it does not change between rounds. A single model (given by the
+        # top-level parameters) is stored under the model ID None, and is sent to the server as before.
+        self.models = dict()
+        self.candidates = dict()  # Candidate models of the server's model selection, by their columns
+        for index, spec in enumerate(self.model_specs or [{}]):
+            model_id = str(spec.get("model_id", f"model_{index}")) if self.model_specs else None
+            if model_id in self.models:
+                print(f"Duplicate model_id {model_id}.")
+                raise ValueError(f"Duplicate model_id {model_id}.")
+            self.models[model_id] = self._build_model(model_id, spec)
+        if self.design_cache_dir:
+            # The rounds only use the memory-mapped design, so the parsed dataset is not needed anymore
+            self.data = None
+            for model in self.models.values():
+                model["data_x"] = model["data_y"] = None
+
+    def _prepare_data(self, data, verbose=True):
         if self._cast_to_string_fields:
-            print(f"Casting fields {self._cast_to_string_fields} to string.")
+            if verbose:
+                print(f"Casting fields {self._cast_to_string_fields} to string.")
             for field in self._cast_to_string_fields:
-                self.data[field] = self.data[field].astype(str)
-        self.data_x = None
-        self.data_y = None
-        if self.x_values and self.y_values:
-            # One-hot encode categorical variables (drop first level)
-            print("Encoding categorical variables with one-hot encoding...")
-            self.data_x = pd.get_dummies(self.data[self.x_values], drop_first=True)
-
-            # Add intercept column if needed
+                data[field] = data[field].astype(str)
+        return data
+
+    def _read_chunks(self):
+        """
+        Iterate over the dataset in chunks of irls_chunk_size rows, prepared as _prepare_data does for the whole dataset.
+        The text columns are read as text in every chunk, so that their type does not depend on the chunk.
+        """
+        text_dtypes = {column: str for column in self._text_columns}
+        for chunk in pd.read_csv(self.dataset_path, chunksize=self.irls_chunk_size, dtype=text_dtypes):
+            yield self._prepare_data(chunk, verbose=False)
+
+    def _get_columns_design(self, x_values, y_values, offset):
+        """
+        Returns a function that builds the (endog, exog, offset) of a chunk of the data for x_values and y_values,
+        as _build_model does with the whole dataset. A chunk may not have every level of a categorical variable, so
+        the levels are first collected from all the chunks, and every chunk is one-hot encoded with all of them.
+        """
+        levels = dict()
+        for chunk in self._read_chunks():
+            for column, dtype in chunk[x_values].dtypes.items():
+                if pd.api.types.is_string_dtype(dtype):
+                    levels.setdefault(column, set()).update(chunk[column].dropna())
+        # get_dummies orders the levels of a column by value, and drops the first one
+        categories = {column: sorted(column_levels) for column, column_levels in levels.items()}
+
+        def design_chunk(chunk):
+            data_x = chunk[x_values].copy()
+            for column, column_categories in categories.items():
+                data_x[column] = pd.Categorical(data_x[column], categories=column_categories)
+            data_x = pd.get_dummies(data_x, drop_first=True)
             if self._add_intercept:
-                print("Adding intercept column to data.")
-                self.data_x = self.data_x.copy()
-                self.data_x["Intercept"] = 1
-
-            # Extract and cast target variable
-            self.data_y = self.data[self.y_values].astype(int)
+                data_x["Intercept"] = 1
+            chunk_offset = np.log(chunk[offset] + 1e-10) if offset else None
+            return chunk[y_values].astype(int), data_x, chunk_offset
+
+        return design_chunk
+
+    def _build_model(self, model_id, spec):
+        """
+        Validate a model spec, falling back to the top-level parameters for anything it does not set, and build its
+        design matrix. Returns what is kept for the model between rounds.
+        """
+        prefix = f"Model {model_id}: " if model_id is not None else ""
+        if any(key in spec for key in ("formula", "x_values", "y_values")):
+            formula, x_values, y_values = spec.get("formula"), spec.get("x_values"), spec.get("y_values")
+        else:
+            formula, x_values, y_values = self.formula, self.x_values, self.y_values
+        offset = spec.get("offset", self.offset)
+        method = spec.get("method", self.method)
+        family_class = getattr(sm.families, spec.get("glm_type", self.glm_type))
+
+        if not formula and not (x_values and y_values):
+            print(f"{prefix}Either formula or x_values and y_values must be provided.")
+            raise ValueError(f"{prefix}Either formula or x_values and y_values must be provided.")
+
+        if offset and family_class != sm.families.Poisson:
+            print(f"{prefix}Offset is only supported for Poisson distribution family.")
+            raise ValueError(f"{prefix}Offset is only supported for Poisson distribution family.")
+
+        if method not in OPTIMIZERS:
+            print(f"{prefix}No optimizer found for method: {method}.")
+            raise ValueError(f"{prefix}No optimizer found for method: {method}.")
+
+        site_info = dict()
+        if self.irls_chunk_size is not None:
+            if method != "IRLS":
+                print(f"{prefix}irls_chunk_size is only supported for the IRLS method.")
+                raise ValueError(f"{prefix}irls_chunk_size is only supported for the IRLS method.")
+            site_info["chunk_size"] = self.irls_chunk_size
+
+        mmap_dir = self.design_cache_dir
+        if mmap_dir and model_id is not None:
+            mmap_dir = os.path.join(mmap_dir, model_id)
+
+        data_x = None
+        data_y = None
+        if self.stream_design:
+            if formula:
+                design_chunk = CoeffOptimizer.get_formula_design(formula, offset, self._read_chunks)
+            else:
+                print(f"{prefix}Collecting the levels of the categorical variables for the one-hot encoding...")
+                design_chunk = self._get_columns_design(x_values, y_values, offset)
+            print(f"{prefix}Building the {self.design_dtype} design matrix in {mmap_dir}, chunk by chunk.")
+            site_info["site_glm"], site_info["exog_names"] = CoeffOptimizer.build_streaming_site_glm(
+                self._read_chunks, design_chunk, self._num_rows, family_class, mmap_dir,
+                dtype=np.dtype(self.design_dtype))
+        else:
+            if x_values and y_values:
+                # One-hot encode categorical variables (drop first level)
+                print(f"{prefix}Encoding categorical variables with one-hot encoding...")
+                data_x = pd.get_dummies(self.data[x_values], drop_first=True)
+
+                # Add intercept column if needed
+                if self._add_intercept:
+                    print(f"{prefix}Adding intercept column to data.")
+                    data_x = data_x.copy()
+                    data_x["Intercept"] = 1
+
+                # Extract and cast target variable
+                data_y = self.data[y_values].astype(int)
+
+            print(f"{prefix}Building the {self.design_dtype} design matrix.")
+            site_info["site_glm"], site_info["exog_names"] = CoeffOptimizer.build_site_glm(
+                formula, offset, family_class, self.data, data_y, data_x,
+                dtype=np.dtype(self.design_dtype), mmap_dir=mmap_dir)
+        return {"formula": formula, "offset": offset, "family_class": family_class, "method": method,
+                "data_x": data_x, "data_y": data_y, "site_info": site_info}
+
+    def _fit_model(self, model, current_round, np_data):
+        optimizer = OPTIMIZERS[model["method"]]()
+        optimizer.get_local_coeffs(current_round, np_data, model["formula"], model["offset"], model["family_class"], self.log_warning, self.data, model["data_y"], model["data_x"], model["site_info"])
+        if self._pack_symmetric:
+            optimizer.pack_symmetric_fields(np_data, {"A": np.dtype(self._packed_A_dtype)})
+        if current_round == 0:
+            # The server checks the column names match across sites, and selects from them in the model selection
+            np_data["exog_names"] = model["site_info"]["exog_names"]
+        # The number of observations is needed for the BIC
+        np_data["nobs"] = int(model["site_info"]["site_glm"].nobs)
+
+    def _fit_models(self, current_round, np_data):
+        """
+        Fit one round of every model that has not finished yet. The models are sent in a dict keyed by model ID,
+        and the finished ones (marked done by the server) are left out, so they drop out of the job early.
+        """
+        incoming_models = np_data.get("models", {})
+        warm_starts = (np_data.get("warm_start") or {}).get("models", {})
+        outgoing_models = dict()
+        for model_id, model in self.models.items():
+            model_data = dict(incoming_models.get(model_id, {}))
+            if model_data.get("done"):
+                continue
+            if model_id in warm_starts:
+                model_data["warm_start"] = warm_starts[model_id]
+            self._fit_model(model, model_data.get("model_round", current_round), model_data)
+            outgoing_models[model_id] = model_data
+        return {"models": outgoing_models}
+
+    def _fit_candidates(self, np_data):
+        """
+        Fit one round of each candidate model sent by the server's model selection. The candidates are subsets of the
+        columns of the configured model, so they are fitted over its cached design matrix rather than the dataset -
+        chunk by chunk, taking the candidate's columns out of each chunk of rows, so that no candidate copies the design
+        matrix. Each one starts from its own round 0 (model_round).
+        """
+        base_model = self.models[None]
+        base_site_info = base_model["site_info"]
+        chunk_size = base_site_info.get("chunk_size") or CANDIDATE_CHUNK_SIZE
+        if "exog_gram" not in base_site_info:
+            # X^T X of the full design, whose rows and columns of a candidate's columns give the rank of the candidate
+            base_site_info["exog_gram"] = chunked_gram(base_site_info["site_glm"].exog, chunk_size)
+        candidates = dict()
+        outgoing_models = dict()
+        for model_id, model_data in np_data["models"].items():
+            if model_data.get("done"):
+                continue
+            columns = tuple(model_data["columns"])
+            candidate = self.candidates.get(columns)
+            if candidate is None:
+                site_info = {"chunk_size": chunk_size}
+                site_info["site_glm"], site_info["exog_names"] = CoeffOptimizer.build_subset_glm(
+                    base_site_info["site_glm"], base_site_info["exog_names"], columns, base_site_info["exog_gram"])
+                candidate = dict(base_model, site_info=site_info)
+            candidates[columns] = candidate
+            model_data = dict(model_data)
+            self._fit_model(candidate, model_data["model_round"], model_data)
+            outgoing_models[model_id] = model_data
+        # Only the candidates of the current selection step are kept
+        self.candidates = candidates
+        return {"models": outgoing_models}
 
     def handle_event(self, event_type: str, fl_ctx: FLContext):
         pass
@@ -149,8 +365,12 @@ class GLMTrainer(Executor):
             return make_reply(ReturnCode.TASK_ABORTED)
 
         try:
-            optimizer = OPTIMIZERS[self.method]()
-            optimizer.get_local_coeffs(current_round, np_data, self.formula, self.offset, self.family_class, self.log_warning, self.data, self.data_y, self.data_x, self.site_info)
+            if self.model_specs:
+                np_data = self._fit_models(current_round, np_data)
+            elif "models" in np_data:
+                np_data = self._fit_candidates(np_data)
+            else:
+                self._fit_model(self.models[None], current_round, np_data)
 
         except KeyError:
             self.log_error(fl_ctx, f"No optimizer found for method: {self.method}.")
@@ -15,7 +15,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any, Optional
+import math
+import time
+from typing import Any, Callable, Optional
 
 from nvflare.apis.client import Client
 from nvflare.apis.fl_constant import ReturnCode
@@ -25,7 +27,7 @@ from nvflare.apis.shareable import Shareable
 from nvflare.apis.signal import Signal
 from nvflare.app_common.abstract.aggregator import Aggregator
 from nvflare.app_common.abstract.learnable_persistor import LearnablePersistor
-from nvflare.app_common.abstract.model import ModelLearnable
+from nvflare.app_common.abstract.model import ModelLearnable, ModelLearnableKey
 from nvflare.app_common.abstract.shareable_generator import ShareableGenerator
 from nvflare.app_common.app_constant import AppConstants
 from nvflare.app_common.app_event_type import AppEventType
@@ -60,6 +62,10 @@ class ScatterAndGather(Controller):
         task_check_period: float = 0.5,
         persist_every_n_rounds: int = 1,
         snapshot_every_n_rounds: int = 1,
+        convergence_callback: Optional[Callable[[Shareable, FLContext], bool]] = None,
+        adaptive_wait: bool = False,
+        straggler_wait_factor: float = 2.0,
+        min_adaptive_wait: int = 1,
     ):
         """The controller for ScatterAndGather Workflow.
 
@@ -90,6 +96,17 @@ class ScatterAndGather(Controller):
                 If n is 0 then no persist.
             snapshot_every_n_rounds (int, optional): persist the server state every n rounds. Defaults to 1.
                 If n is 0 then no persist.
+            convergence_callback (Callable, optional): called with the aggregation result and the FLContext right
+                after aggregation; training ends as soon as it returns True, without starting another round.
+                Defaults to `is_converged`, which checks for the 'ABORT' signal of the aggregator.
+            adaptive_wait (bool, optional): whether to adapt the time to wait for the remaining clients, once
+                min_clients have reported, to how late the slowest client was in the previous round (see
+                `_get_wait_time_after_min_received`). wait_time_after_min_received is then the upper bound.
+                A client that reports after the adapted wait is left out of that round's aggregation, so only use
+                it when the aggregation does not need every client (the GLM sums do). Defaults to False.
+            straggler_wait_factor (float, optional): the safety factor applied to the observed lag of the slowest
+                client with adaptive_wait. Defaults to 2.0.
+            min_adaptive_wait (int, optional): the lower bound of the adapted wait time, in seconds. Defaults to 1.
 
         Raises:
             TypeError: when any of input arguments does not have correct type
@@ -109,6 +126,14 @@ class ScatterAndGather(Controller):
         _check_non_neg_int(train_timeout, "train_timeout")
         _check_non_neg_int(persist_every_n_rounds, "persist_every_n_rounds")
         _check_non_neg_int(snapshot_every_n_rounds, "snapshot_every_n_rounds")
+        _check_non_neg_int(min_adaptive_wait, "min_adaptive_wait")
+
+        if convergence_callback is not None and not callable(convergence_callback):
+            raise TypeError("convergence_callback must be callable but got {}".format(type(convergence_callback)))
+        if not isinstance(straggler_wait_factor, (int, float)):
+            raise TypeError(f"straggler_wait_factor must be an int or float but got {type(straggler_wait_factor)}")
+        elif straggler_wait_factor <= 0:
+            raise ValueError("straggler_wait_factor must be greater than 0.")
 
         if not isinstance(aggregator_id, str):
             raise TypeError("aggregator_id must be a string but got {}".format(type(aggregator_id)))
@@ -135,7 +160,6 @@ class ScatterAndGather(Controller):
         # config data
         self._min_clients = min_clients
         self._num_rounds = num_rounds
-        self._last_round = False
         self._wait_time_after_min_received = wait_time_after_min_received
         self._start_round = start_round
         self._train_timeout = train_timeout
@@ -143,11 +167,18 @@ class ScatterAndGather(Controller):
         self._snapshot_every_n_rounds = snapshot_every_n_rounds
         self.ignore_result_error = ignore_result_error
         self.allow_empty_global_weights = allow_empty_global_weights
+        self._convergence_callback = convergence_callback or self.is_converged
+        self._adaptive_wait = adaptive_wait
+        self._straggler_wait_factor = straggler_wait_factor
+        self._min_adaptive_wait = min_adaptive_wait
 
         # workflow phases: init, train, validate
         self._phase = AppConstants.PHASE_INIT
         self._global_weights = None
         self._current_round = None
+        self._converged = False
+        self._round_arrivals = dict()  # Client name -> seconds from the start of the round to its result
+        self._straggler_lag = None
 
 
     def start_controller(self, fl_ctx: FLContext) -> None:
@@ -203,6 +234,12 @@ class ScatterAndGather(Controller):
                     )
                     return
 
+        # Continue from the round after the checkpoint the persistor resumed from, if any
+        resumed_round = (self._global_weights.get(ModelLearnableKey.META) or {}).get(AppConstants.CURRENT_ROUND)
+        if resumed_round is not None and self._current_round is None:
+            self._current_round = resumed_round + 1
+            self.log_info(fl_ctx, f"Resuming training at round {self._current_round}.")
+
         fl_ctx.set_prop(AppConstants.GLOBAL_MODEL, self._global_weights, private=True, sticky=True)
         self.fire_event(AppEventType.INITIAL_MODEL_LOADED, fl_ctx)
 
@@ -235,22 +272,6 @@ class ScatterAndGather(Controller):
                 data_shareable.set_header(AppConstants.NUM_ROUNDS, self._num_rounds)
                 data_shareable.add_cookie(AppConstants.CONTRIBUTION_ROUND, self._current_round)
 
-                # Finish training if got 'ABORT' from server
-                incoming_dxo = from_shareable(data_shareable)
-                np_data = incoming_dxo.data
-                try:
-                    if 'signal' in np_data:
-                        if self._last_round:
-                            self.log_error(fl_ctx, "Reached accuracy threshold. Training is DONE")
-                            break
-
-                        if np_data['signal'] == 'ABORT':
-                            # Perform one final round to compute AIC before aborting
-                            self._last_round = True
-
-                except:
-                    pass
-
                 train_task = Task(
                     name=self.train_task_name,
                     data=data_shareable,
@@ -263,10 +284,11 @@ class ScatterAndGather(Controller):
                 self.broadcast_and_wait(
                     task=train_task,
                     min_responses=self._min_clients,
-                    wait_time_after_min_received=self._wait_time_after_min_received,
+                    wait_time_after_min_received=self._get_wait_time_after_min_received(),
                     fl_ctx=fl_ctx,
                     abort_signal=abort_signal,
                 )
+                self._update_straggler_lag(train_task, fl_ctx)
 
                 if self._check_abort_signal(fl_ctx, abort_signal):
                     return
@@ -290,9 +312,14 @@ class ScatterAndGather(Controller):
                 if self._check_abort_signal(fl_ctx, abort_signal):
                     return
 
+                # Check for convergence right away, so that no round is started once training is done
+                self._converged = bool(self._convergence_callback(aggr_result, fl_ctx))
+
                 if (
-                    self._persist_every_n_rounds != 0 and (self._current_round + 1) % self._persist_every_n_rounds == 0
-                ) or self._current_round == self._start_round + self._num_rounds - 1:
+                    (self._persist_every_n_rounds != 0 and (self._current_round + 1) % self._persist_every_n_rounds == 0)
+                    or self._current_round == self._start_round + self._num_rounds - 1
+                    or self._converged
+                ):
                     self.log_info(fl_ctx, "Start persist model on server.")
                     self.fire_event(AppEventType.BEFORE_LEARNABLE_PERSIST, fl_ctx)
                     self.persistor.save(self._global_weights, fl_ctx)
@@ -301,6 +328,9 @@ class ScatterAndGather(Controller):
 
                 self.fire_event(AppEventType.ROUND_DONE, fl_ctx)
                 self.log_info(fl_ctx, f"Round {self._current_round} finished.")
+                if self._converged:
+                    self.log_info(fl_ctx, "Reached accuracy threshold. Training is DONE")
+                    break
                 self._current_round += 1
 
                 # need to persist snapshot after round increased because the global weights should be set to
@@ -310,7 +340,7 @@ class ScatterAndGather(Controller):
 
             self._phase = AppConstants.PHASE_FINISHED
             self.log_info(fl_ctx, "Finished ScatterAndGather Training.")
-            if self._current_round == self._start_round + self._num_rounds:
+            if not self._converged and self._current_round == self._start_round + self._num_rounds:
                 self.log_warning(fl_ctx, f"Reached max rounds - Regression did not reach the target accuracy within {self._num_rounds} iterations. Please interpret results with caution.")
         except Exception as e:
             error_msg = f"Exception in ScatterAndGather control_flow: {secure_format_exception(e)}"
@@ -333,6 +363,53 @@ class ScatterAndGather(Controller):
                     info={"phase": self._phase, "current_round": self._current_round, "num_rounds": self._num_rounds},
                 )
 
+    def is_converged(self, aggr_result: Shareable, fl_ctx: FLContext) -> bool:
+        """
+        The default convergence callback: training is done once the aggregator signals 'ABORT' with the AIC of
+        the model(s), which the clients compute in one final round after the model(s) converged.
+        It only looks at the aggregation result, so it also holds when resuming a checkpointed job.
+        """
+        try:
+            data = from_shareable(aggr_result).data
+        except Exception:
+            return False
+        if data.get("signal") != "ABORT":
+            return False
+        if "models" in data:
+            return all("aic" in model_result for model_result in data["models"].values())
+        return "aic" in data
+
+    def _get_wait_time_after_min_received(self) -> int:
+        """
+        The time to wait for the remaining clients once min_clients have reported. The round still ends as soon
+        as all clients have reported.
+
+        With adaptive_wait, this is how long the slowest client took after the min_clients-th one in the previous
+        round, times straggler_wait_factor, bounded by min_adaptive_wait and wait_time_after_min_received.
+        Until all clients have reported in a round, the full wait_time_after_min_received is used.
+        """
+        if not self._adaptive_wait or self._straggler_lag is None:
+            return self._wait_time_after_min_received
+        wait_time = max(self._min_adaptive_wait, math.ceil(self._straggler_wait_factor * self._straggler_lag))
+        return min(self._wait_time_after_min_received, wait_time)
+
+    def _update_straggler_lag(self, train_task: Task, fl_ctx: FLContext):
+        expected = train_task.targets or [client.name for client in self._engine.get_clients()]
+        missing = [name for name in expected if name not in self._round_arrivals]
+        arrivals = sorted(self._round_arrivals.values())
+        self._round_arrivals = dict()
+        if missing:
+            self.log_warning(
+                fl_ctx,
+                f"Round {self._current_round} ended without the results of {', '.join(missing)}, "
+                f"which are left out of its aggregation.",
+            )
+        if not arrivals or missing or len(arrivals) < self._min_clients:
+            # Some client did not report in time, so there is no estimate of how late it is
+            self._straggler_lag = None
+        else:
+            self._straggler_lag = arrivals[-1] - arrivals[self._min_clients - 1]
+
     def _prepare_train_task_data(self, client_task: ClientTask, fl_ctx: FLContext) -> None:
         fl_ctx.set_prop(AppConstants.TRAIN_SHAREABLE, client_task.task.data, private=True, sticky=False)
         self.fire_event(AppEventType.BEFORE_TRAIN_TASK, fl_ctx)
@@ -340,6 +417,8 @@ class ScatterAndGather(Controller):
     def _process_train_result(self, client_task: ClientTask, fl_ctx: FLContext) -> None:
         result = client_task.result
         client_name = client_task.client.name
+        if client_task.task.schedule_time is not None:
+            self._round_arrivals[client_name] = time.time() - client_task.task.schedule_time
 
         self._accept_train_result(client_name=client_name, result=result, fl_ctx=fl_ctx)
 
@@ -0,0 +1,106 @@
+# Copyright (c) 2025, Rhino HealthTech, Inc.
+
+import csv
+import json
+import os
+
+import numpy as np
+
+from nvflare.apis.fl_constant import FLContextKey
+from nvflare.apis.fl_context import FLContext
+
+try:
+    from tensorboardX import SummaryWriter
+except ImportError:
+    SummaryWriter = None
+
+# Per-round values written to the CSV file and to TensorBoard (the JSONL file also has the per-client values)
+ROUND_FIELDS = [
+    "round",
+    "num_clients",
+    "payload_bytes",
+    "max_accept_seconds",
+    "add_seconds",
+    "get_result_seconds",
+    "step_norm",
+    "max_relative_change",
+    "target_accuracy",
+    "condition_number",
+    "converged",
+]
+
+
+def payload_nbytes(data):
+    """
+    In-memory size of the arrays and numbers in a (nested) DXO data dict, counting 8 bytes per number. This is an
+    estimate of the payload of a client, not the serialized size of the message it sent.
+    """
+    if isinstance(data, dict):
+        return sum(payload_nbytes(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return sum(payload_nbytes(value) for value in data)
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, (int, float, np.generic)):
+        return 8
+    if isinstance(data, str):
+        return len(data)
+    return 0
+
+
+def summarize_step(prev_beta, next_beta):
+    """
+    Norm of the iteration step, and the largest change of a coefficient relative to its previous value.
+    """
+    if prev_beta is None or next_beta is None:
+        return None, None
+    prev_beta = np.asarray(prev_beta, dtype=np.float64)
+    step = np.asarray(next_beta, dtype=np.float64) - prev_beta
+    relative_change = np.abs(step) / np.maximum(np.abs(prev_beta), np.finfo(np.float64).tiny)
+    return float(np.linalg.norm(step)), float(relative_change.max())
+
+
+class AggregationStatsWriter:
+    """
+    Appends the per-round aggregation statistics to <run dir>/<stats_dir>/rounds.jsonl and rounds.csv,
+    and to TensorBoard under tb_log_dir if it is set (requires tensorboardX).
+    """
+
+    def __init__(self, stats_dir="glm_stats", tb_log_dir=None):
+        self.stats_dir = stats_dir
+        self.tb_log_dir = tb_log_dir
+        self._output_dir = None
+        self._tb_writer = None
+
+    def _open(self, fl_ctx: FLContext):
+        if self._output_dir is not None:
+            return
+        job_id = fl_ctx.get_prop(FLContextKey.CURRENT_RUN)
+        run_dir = fl_ctx.get_engine().get_workspace().get_run_dir(job_id)
+        self._output_dir = os.path.join(run_dir, self.stats_dir)
+        os.makedirs(self._output_dir, exist_ok=True)
+        if self.tb_log_dir:
+            if SummaryWriter is None:
+                print("tensorboardX is not installed, not writing the aggregation statistics to TensorBoard")
+            else:
+                self._tb_writer = SummaryWriter(self.tb_log_dir)
+
+    def write(self, fl_ctx: FLContext, stats: dict):
+        self._open(fl_ctx)
+        with open(os.path.join(self._output_dir, "rounds.jsonl"), "a") as jsonl_file:
+            jsonl_file.write(json.dumps(stats) + "\n")
+
+        csv_path = os.path.join(self._output_dir, "rounds.csv")
+        write_header = not os.path.exists(csv_path)
+        with open(csv_path, "a", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=ROUND_FIELDS, extrasaction="ignore")
+            if write_header:
+                writer.writeheader()
+            writer.writerow(stats)
+
+        if self._tb_writer is not None:
+            for field in ROUND_FIELDS[1:]:
+                value = stats.get(field)
+                if isinstance(value, (int, float)) and np.isfinite(value):
+                    self._tb_writer.add_scalar(f"glm/{field}", value, stats["round"])
+            self._tb_writer.flush()
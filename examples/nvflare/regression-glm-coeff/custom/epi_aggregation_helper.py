@@ -18,8 +18,10 @@
 import numpy as np
 import re
 import threading
+import time
 from typing import Optional
 
+from aggregation_stats import summarize_step
 from coeff_optimizer import OPTIMIZERS
 
 
@@ -53,13 +55,47 @@ class EPIAggregationHelper(object):
         self.method = None
         self.optimizer = None
         self.exog_names = None
+        self.prev_beta = None
+        self.round_stats = {"clients": {}}
+        self.model_helpers = dict()  # One helper per model ID when the clients fit several models
+        self.model_results = dict()
+        self.round_model_ids = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_state(self):
+        """The optimizer state (the method, betas, accuracy threshold, ...) to checkpoint between jobs"""
+        return self.__getstate__()
+
+    def set_state(self, state):
+        """Continue from an optimizer state returned by get_state"""
+        self.__setstate__(state)
 
     def reset_stats(self):
         self.total = dict()
         self.counts = dict()
         self.history = list()
 
+    def get_model_helper(self, model_id):
+        if model_id not in self.model_helpers:
+            self.model_helpers[model_id] = EPIAggregationHelper(
+                exclude_vars=self.exclude_vars.pattern if self.exclude_vars else None,
+                weigh_by_local_iter=self.weigh_by_local_iter,
+                target_accuracy=self.target_accuracy,
+            )
+        return self.model_helpers[model_id]
+
     def verify_exog_names(self, data):
+        if "models" in data:
+            return all(self.get_model_helper(model_id).verify_exog_names(model_data)
+                       for model_id, model_data in data["models"].items())
         current_exog_names = data.get("exog_names")
         if current_exog_names is None:
             return True
@@ -74,6 +110,10 @@ class EPIAggregationHelper(object):
             return True
 
     def set_optimization_method(self, data):
+        if "models" in data:
+            for model_id, model_data in data["models"].items():
+                self.get_model_helper(model_id).set_optimization_method(model_data)
+            return
         if not self.method:
             try:
                 # The method is initialized by the client - set server config accordingly
@@ -86,8 +126,18 @@ class EPIAggregationHelper(object):
     def add(self, data, weight, contributor_name, contribution_round):
         """Compute sum of weights."""
         self.contribution_round = contribution_round
-        with self.lock:
-            self.optimizer.add(data, self.add_results, contribution_round)
+        start_time = time.perf_counter()
+        if "models" in data:
+            # Each model is aggregated independently, by its own helper
+            for model_id, model_data in data["models"].items():
+                self.model_helpers[model_id].add(model_data, weight, contributor_name, contribution_round)
+                self.round_model_ids.add(model_id)
+        else:
+            # Clients send the symmetric matrices as packed upper triangles
+            data = self.optimizer.unpack_symmetric_fields(data)
+            with self.lock:
+                self.optimizer.add(data, self.add_results, contribution_round)
+        self.record_client_stats(contributor_name, add_seconds=time.perf_counter() - start_time)
 
         self.history.append(
             {
@@ -98,6 +148,28 @@ class EPIAggregationHelper(object):
         )
 
     def get_result(self):
+        start_time = time.perf_counter()
+        if self.model_helpers:
+            result = self._get_models_result()
+        else:
+            result = self._get_result()
+            step_norm, max_relative_change = summarize_step(self.prev_beta, result.get("beta"))
+            self.prev_beta = result.get("beta")
+            self.round_stats.update(
+                step_norm=step_norm,
+                max_relative_change=max_relative_change,
+                condition_number=result.get("condition_number"),
+            )
+            if self.exog_names is not None and "exog_names" not in result:
+                # Saved with the model, to warm start later fits of the same model (see GLMModelPersistor)
+                result["exog_names"] = self.exog_names
+        self.round_stats.update(
+            get_result_seconds=time.perf_counter() - start_time,
+            converged=result.get("signal") == "ABORT",
+        )
+        return result
+
+    def _get_result(self):
         """Aggregate from all sites"""
         with self.lock:
             accuracy_threshold, result = self.optimizer.get_result(self.add_results, self.contribution_round,
@@ -107,8 +179,56 @@ class EPIAggregationHelper(object):
             self.reset_stats()
             return result
 
+    def _get_models_result(self):
+        """Aggregate each model that was sent this round, keeping the last result of the models that are done"""
+        model_stats = dict()
+        for model_id in sorted(self.round_model_ids):
+            helper = self.model_helpers[model_id]
+            result = helper.get_result()
+            # A model is done once it converged
+            result["done"] = result.get("signal") == "ABORT"
+            self.model_results[model_id] = result
+            model_stats[model_id] = {
+                key: value for key, value in helper.pop_round_stats().items()
+                if key in ("step_norm", "max_relative_change", "condition_number", "converged")
+            }
+        self.round_model_ids = set()
+        self.reset_stats()
+        self.round_stats.update(
+            models=model_stats,
+            num_active_models=len(model_stats),
+            step_norm=max((stats["step_norm"] for stats in model_stats.values()
+                           if stats["step_norm"] is not None), default=None),
+            max_relative_change=max((stats["max_relative_change"] for stats in model_stats.values()
+                                     if stats["max_relative_change"] is not None), default=None),
+            condition_number=max((stats["condition_number"] for stats in model_stats.values()
+                                  if stats["condition_number"] is not None), default=None),
+        )
+
+        result = {"models": dict(self.model_results)}
+        # Stop once all models are done
+        if all(model_result.get("done") for model_result in self.model_results.values()):
+            result["signal"] = "ABORT"
+        return result
+
     def get_history(self):
         return self.history
 
     def get_len(self):
-        return len(self.get_history())
\ No newline at end of file
+        return len(self.get_history())
+
+    def record_client_stats(self, contributor_name, **stats):
+        self.round_stats["clients"].setdefault(contributor_name, {}).update(stats)
+
+    def pop_round_stats(self):
+        """Return the statistics of the round that was just aggregated, and start recording the next one."""
+        stats, self.round_stats = self.round_stats, {"clients": {}}
+        clients = stats["clients"].values()
+        stats.update(
+            num_clients=len(stats["clients"]),
+            payload_bytes=sum(client.get("payload_bytes", 0) for client in clients),
+            max_accept_seconds=max((client.get("accept_seconds", 0.) for client in clients), default=None),
+            add_seconds=sum(client.get("add_seconds", 0.) for client in clients),
+            target_accuracy=self.target_accuracy,
+        )
+        return stats
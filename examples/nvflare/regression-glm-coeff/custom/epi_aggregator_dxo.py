@@ -16,11 +16,13 @@
 # limitations under the License.
 
 import logging
+import os
 from typing import Any, Dict, Optional
 
 from nvflare.apis.dxo import DXO, DataKind, MetaKey
 from nvflare.apis.fl_component import FLComponent
 from nvflare.apis.fl_context import FLContext
+from aggregation_stats import AggregationStatsWriter, payload_nbytes
 from epi_aggregation_helper import EPIAggregationHelper
 from nvflare.app_common.app_constant import AppConstants
 
@@ -34,6 +36,8 @@ class DXOAggregator(FLComponent):
         expected_data_kind: DataKind = DataKind.WEIGHT_DIFF,
         name_postfix: str = "",
         weigh_by_local_iter: bool = True,
+        stats_dir: Optional[str] = "glm_stats",
+        tb_log_dir: Optional[str] = None,
     ):
         """Perform accumulated weighted aggregation for one kind of corresponding DXO from contributors.
 
@@ -49,6 +53,10 @@ class DXOAggregator(FLComponent):
                 the number of computations on encrypted ciphertext.
                 The aggregated sum will still be divided by the provided weights and `aggregation_weights` for the
                 resulting weighted sum to be valid.
+            stats_dir (str, optional): Directory under the run dir to write the per-round aggregation statistics to.
+                Defaults to "glm_stats". Set to None to not write them.
+            tb_log_dir (str, optional): Directory to also write the per-round statistics to as TensorBoard logs.
+                Defaults to None (no TensorBoard logs).
         """
         super().__init__()
         self.expected_data_kind = expected_data_kind
@@ -60,6 +68,13 @@ class DXOAggregator(FLComponent):
             target_accuracy=self.target_accuracy,
         )
 
+        self.stats_writer = None
+        if stats_dir:
+            self.stats_writer = AggregationStatsWriter(
+                stats_dir=os.path.join(stats_dir, name_postfix) if name_postfix else stats_dir,
+                tb_log_dir=os.path.join(tb_log_dir, name_postfix) if tb_log_dir and name_postfix else tb_log_dir,
+            )
+
         self.warning_count = {}
         self.warning_limit = 10
         self.processed_algorithm = None
@@ -68,6 +83,12 @@ class DXOAggregator(FLComponent):
             self._name += name_postfix
             self.logger = logging.getLogger(self._name)
 
+    def get_optimizer_state(self):
+        return self.aggregation_helper.get_state()
+
+    def set_optimizer_state(self, state):
+        self.aggregation_helper.set_state(state)
+
     def reset_aggregation_helper(self):
         if self.aggregation_helper:
             self.aggregation_helper.reset_stats()
@@ -167,6 +188,7 @@ class DXOAggregator(FLComponent):
         self.aggregation_helper.set_optimization_method(data)
         # aggregate
         self.aggregation_helper.add(data, aggregation_weight * float_n_iter, contributor_name, contribution_round)
+        self.aggregation_helper.record_client_stats(contributor_name, payload_bytes=payload_nbytes(data))
         self.log_debug(fl_ctx, "End accept")
         return True
 
@@ -183,10 +205,31 @@ class DXOAggregator(FLComponent):
         self.log_info(fl_ctx, f"aggregating {self.aggregation_helper.get_len()} update(s) at round {current_round}")
         self.log_debug(fl_ctx, f"complete history {self.aggregation_helper.get_len()}")
         aggregated_dict = self.aggregation_helper.get_result()
+        self.write_round_stats(fl_ctx, current_round)
         self.log_debug(fl_ctx, "End aggregation")
         dxo = DXO(data_kind=self.expected_data_kind, data=aggregated_dict)
         if self.processed_algorithm is not None:
             dxo.set_meta_prop(MetaKey.PROCESSED_ALGORITHM, self.processed_algorithm)
             self.processed_algorithm = None
 
-        return dxo
\ No newline at end of file
+        return dxo
+
+    def record_client_stats(self, contributor_name, **stats):
+        self.aggregation_helper.record_client_stats(contributor_name, **stats)
+
+    def write_round_stats(self, fl_ctx: FLContext, current_round):
+        stats = self.aggregation_helper.pop_round_stats()
+        stats["round"] = current_round
+        self.log_info(
+            fl_ctx,
+            f"round {current_round}: about {stats['payload_bytes']} payload bytes from {stats['num_clients']} client(s), "
+            f"add took {stats['add_seconds']:.3f}s and get_result {stats['get_result_seconds']:.3f}s, "
+            f"step norm {stats['step_norm']}, max relative change {stats['max_relative_change']}, "
+            f"condition number {stats['condition_number']}",
+        )
+        if self.stats_writer is None:
+            return
+        try:
+            self.stats_writer.write(fl_ctx, stats)
+        except Exception as e:
+            self.log_warning(fl_ctx, f"Could not write the aggregation statistics: {e}")
@@ -33,7 +33,20 @@ from nvflare.app_common.abstract.model import ModelLearnable
 from nvflare.app_common.app_constant import AppConstants
 from nvflare.security.logging import secure_format_exception
 
-from coeff_optimizer import OPTIMIZERS
+from coeff_optimizer import OPTIMIZERS, CoeffOptimizer
+
+
+def scan_csv(path, chunk_size):
+    """
+    Count the rows of a CSV file in chunks, and find its text columns - those that pandas reads as text in any chunk,
+    as it would when reading the whole file at once.
+    """
+    num_rows = 0
+    text_columns = set()
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        num_rows += len(chunk)
+        text_columns.update(column for column, dtype in chunk.dtypes.items() if pd.api.types.is_string_dtype(dtype))
+    return num_rows, text_columns
 
 
 class GLMTrainer(Executor):
@@ -52,7 +65,13 @@ class GLMTrainer(Executor):
         add_intercept=True,
         formula=None,
         cast_to_string_fields=None,
-        method=None
+        method=None,
+        design_dtype="float64",
+        irls_chunk_size=None,
+        design_cache_dir=None,
+        pack_symmetric=True,
+        packed_A_dtype="float64",
+        models=None
     ):
         # Init functions of components should be very minimal. Init
         # is called when json is read. A big init will cause json loading to halt
@@ -75,41 +94,185 @@ class GLMTrainer(Executor):
         self._cast_to_string_fields = cast_to_string_fields  # Fields to explicitly cast to string (e.g. categorical
                                                              # fields that have numeric values)
         self.glm_type = glm_type  # GLM family type (e.g. Binomial, Gaussian, Poisson, etc.)
-        self.family_class = getattr(sm.families, self.glm_type)
         self.method = method
         self.offset = offset
-        self.site_info = dict()
-        print(f"Initialized Federated Client. {x_values=}, {y_values=}, {formula=}, {glm_type=}, {add_intercept=}, {cast_to_string_fields=}")
-
-        if not self.formula and not (self.x_values and self.y_values):
-            print("Either formula or x_values and y_values must be provided.")
-            raise ValueError("Either formula or x_values and y_values must be provided.")
-
-        if self.offset and self.family_class != sm.families.Poisson:
-            print("Offset is only supported for Poisson distribution family.")
-            raise ValueError("Offset is only supported for Poisson distribution family.")
+        self.model_specs = models  # Specs of several models to fit in the same job (instead of the single model above)
+        self.design_dtype = design_dtype  # dtype of the cached design matrix ("float64", or "float32" to halve its memory)
+        self.irls_chunk_size = irls_chunk_size  # Number of rows per chunk to stream the IRLS sums over (None for all at once)
+        self.design_cache_dir = design_cache_dir  # Directory to memory-map the design matrix from (None to keep it in memory)
+        self._pack_symmetric = pack_symmetric  # Whether to send the symmetric matrices as their upper triangles only
+        self._packed_A_dtype = packed_A_dtype  # dtype to send the IRLS A matrix in when packed ("float64" or "float32")
+        print(f"Initialized Federated Client. {x_values=}, {y_values=}, {formula=}, {glm_type=}, {add_intercept=}, {cast_to_string_fields=}, {models=}")
+
+        if self.model_specs is not None and (not isinstance(self.model_specs, list) or not self.model_specs):
+            print("models must be a non-empty list of model specs.")
+            raise ValueError("models must be a non-empty list of model specs.")
+
+        if self.design_dtype not in ("float64", "float32"):
+            print("design_dtype must be either float64 or float32.")
+            raise ValueError("design_dtype must be either float64 or float32.")
+
+        if self._packed_A_dtype not in ("float64", "float32"):
+            print("packed_A_dtype must be either float64 or float32.")
+            raise ValueError("packed_A_dtype must be either float64 or float32.")
+
+        if self.irls_chunk_size is not None:
+            if not isinstance(self.irls_chunk_size, int) or self.irls_chunk_size <= 0:
+                print("irls_chunk_size must be a positive integer.")
+                raise ValueError("irls_chunk_size must be a positive integer.")
 
         # Load dataset
         datasets_path = '/input/datasets'
         dataset_uid = next(os.walk(datasets_path))[1][0]
-        dataset_path = f'{datasets_path}/{dataset_uid}/dataset.csv'
-        self.data = pd.read_csv(dataset_path)
+        self.dataset_path = f'{datasets_path}/{dataset_uid}/dataset.csv'
+        # With both a chunk size and a cache directory, the design matrices are built chunk by chunk straight into
+        # the cache, so the dataset is never loaded whole
+        self.stream_design = bool(self.irls_chunk_size and self.design_cache_dir)
+        if self.stream_design:
+            print(f"Reading the dataset in chunks of {self.irls_chunk_size} rows.")
+            self._num_rows, self._text_columns = scan_csv(self.dataset_path, self.irls_chunk_size)
+            self.data = None
+        else:
+            self.data = self._prepare_data(pd.read_csv(self.dataset_path))
+
+        # Build each model's design matrix once - it does not change between rounds. A single model (given by the
+        # top-level parameters) is stored under the model ID None, and is sent to the server as before.
+        self.models = dict()
+        for index, spec in enumerate(self.model_specs or [{}]):
+            model_id = str(spec.get("model_id", f"model_{index}")) if self.model_specs else None
+            if model_id in self.models:
+                print(f"Duplicate model_id {model_id}.")
+                raise ValueError(f"Duplicate model_id {model_id}.")
+            self.models[model_id] = self._build_model(model_id, spec)
+        if self.design_cache_dir:
+            # The rounds only use the memory-mapped design, so the parsed dataset is not needed anymore
+            self.data = None
+            for model in self.models.values():
+                model["data_x"] = model["data_y"] = None
+
+    def _prepare_data(self, data, verbose=True):
         if self._cast_to_string_fields:
-            print(f"Casting fields {self._cast_to_string_fields} to string.")
+            if verbose:
+                print(f"Casting fields {self._cast_to_string_fields} to string.")
             for field in self._cast_to_string_fields:
-                self.data[field] = self.data[field].astype(str)
-        self.data_x = None
-        self.data_y = None
-        if self.x_values and self.y_values:
-            self.data_x = self.data[self.x_values]
-            self.data_y = self.data[self.y_values]
+                data[field] = data[field].astype(str)
 
         # Add Intercept
         if self._add_intercept:
-            print("Adding intercept column to data.")
-            self.data["Intercept"] = 1
-            if self.data_x is not None:
-                self.data_x["Intercept"] = 1
+            if verbose:
+                print("Adding intercept column to data.")
+            data["Intercept"] = 1
+        return data
+
+    def _read_chunks(self):
+        """
+        Iterate over the dataset in chunks of irls_chunk_size rows, prepared as _prepare_data does for the whole dataset.
+        The text columns are read as text in every chunk, so that their type does not depend on the chunk.
+        """
+        text_dtypes = {column: str for column in self._text_columns}
+        for chunk in pd.read_csv(self.dataset_path, chunksize=self.irls_chunk_size, dtype=text_dtypes):
+            yield self._prepare_data(chunk, verbose=False)
+
+    def _get_columns_design(self, x_values, y_values, offset):
+        """
+        Returns a function that builds the (endog, exog, offset) of a chunk of the data for x_values and y_values,
+        as _build_model does with the whole dataset.
+        """
+        x_columns = list(x_values)
+        if self._add_intercept and "Intercept" not in x_columns:
+            x_columns.append("Intercept")
+
+        def design_chunk(chunk):
+            chunk_offset = np.log(chunk[offset] + 1e-10) if offset else None
+            return chunk[y_values], chunk[x_columns], chunk_offset
+
+        return design_chunk
+
+    def _build_model(self, model_id, spec):
+        """
+        Validate a model spec, falling back to the top-level parameters for anything it does not set, and build its
+        design matrix. Returns what is kept for the model between rounds.
+        """
+        prefix = f"Model {model_id}: " if model_id is not None else ""
+        if any(key in spec for key in ("formula", "x_values", "y_values")):
+            formula, x_values, y_values = spec.get("formula"), spec.get("x_values"), spec.get("y_values")
+        else:
+            formula, x_values, y_values = self.formula, self.x_values, self.y_values
+        offset = spec.get("offset", self.offset)
+        method = spec.get("method", self.method)
+        family_class = getattr(sm.families, spec.get("glm_type", self.glm_type))
+
+        if not formula and not (x_values and y_values):
+            print(f"{prefix}Either formula or x_values and y_values must be provided.")
+            raise ValueError(f"{prefix}Either formula or x_values and y_values must be provided.")
+
+        if offset and family_class != sm.families.Poisson:
+            print(f"{prefix}Offset is only supported for Poisson distribution family.")
+            raise ValueError(f"{prefix}Offset is only supported for Poisson distribution family.")
+
+        if method not in OPTIMIZERS:
+            print(f"{prefix}No optimizer found for method: {method}.")
+            raise ValueError(f"{prefix}No optimizer found for method: {method}.")
+
+        site_info = dict()
+        if self.irls_chunk_size is not None:
+            if method != "IRLS":
+                print(f"{prefix}irls_chunk_size is only supported for the IRLS method.")
+                raise ValueError(f"{prefix}irls_chunk_size is only supported for the IRLS method.")
+            site_info["chunk_size"] = self.irls_chunk_size
+
+        mmap_dir = self.design_cache_dir
+        if mmap_dir and model_id is not None:
+            mmap_dir = os.path.join(mmap_dir, model_id)
+
+        data_x = None
+        data_y = None
+        if self.stream_design:
+            if formula:
+                design_chunk = CoeffOptimizer.get_formula_design(formula, offset, self._read_chunks)
+            else:
+                design_chunk = self._get_columns_design(x_values, y_values, offset)
+            print(f"{prefix}Building the {self.design_dtype} design matrix in {mmap_dir}, chunk by chunk.")
+            site_info["site_glm"], site_info["exog_names"] = CoeffOptimizer.build_streaming_site_glm(
+                self._read_chunks, design_chunk, self._num_rows, family_class, mmap_dir,
+                dtype=np.dtype(self.design_dtype))
+        else:
+            if x_values and y_values:
+                data_x = self.data[x_values]
+                data_y = self.data[y_values]
+                if self._add_intercept:
+                    data_x = data_x.assign(Intercept=1)
+
+            print(f"{prefix}Building the {self.design_dtype} design matrix.")
+            site_info["site_glm"], site_info["exog_names"] = CoeffOptimizer.build_site_glm(
+                formula, offset, family_class, self.data, data_y, data_x,
+                dtype=np.dtype(self.design_dtype), mmap_dir=mmap_dir)
+        return {"formula": formula, "offset": offset, "family_class": family_class, "method": method,
+                "data_x": data_x, "data_y": data_y, "site_info": site_info}
+
+    def _fit_model(self, model, current_round, np_data):
+        optimizer = OPTIMIZERS[model["method"]]()
+        optimizer.get_local_coeffs(current_round, np_data, model["formula"], model["offset"], model["family_class"], self.log_warning, self.data, model["data_y"], model["data_x"], model["site_info"])
+        if self._pack_symmetric:
+            optimizer.pack_symmetric_fields(np_data, {"A": np.dtype(self._packed_A_dtype)})
+
+    def _fit_models(self, current_round, np_data):
+        """
+        Fit one round of every model that has not finished yet. The models are sent in a dict keyed by model ID,
+        and the finished ones (marked done by the server) are left out, so they drop out of the job early.
+        """
+        incoming_models = np_data.get("models", {})
+        warm_starts = (np_data.get("warm_start") or {}).get("models", {})
+        outgoing_models = dict()
+        for model_id, model in self.models.items():
+            model_data = dict(incoming_models.get(model_id, {}))
+            if model_data.get("done"):
+                continue
+            if model_id in warm_starts:
+                model_data["warm_start"] = warm_starts[model_id]
+            self._fit_model(model, current_round, model_data)
+            outgoing_models[model_id] = model_data
+        return {"models": outgoing_models}
 
     def handle_event(self, event_type: str, fl_ctx: FLContext):
         pass
@@ -146,8 +309,10 @@ class GLMTrainer(Executor):
             return make_reply(ReturnCode.TASK_ABORTED)
 
         try:
-            optimizer = OPTIMIZERS[self.method]()
-            optimizer.get_local_coeffs(current_round, np_data, self.formula, self.offset, self.family_class, self.log_warning, self.data, self.data_y, self.data_x, self.site_info)
+            if self.model_specs:
+                np_data = self._fit_models(current_round, np_data)
+            else:
+                self._fit_model(self.models[None], current_round, np_data)
 
         except KeyError:
             self.log_error(fl_ctx, f"No optimizer found for method: {self.method}.")
@@ -17,9 +17,7 @@
 
 import copy
 from typing import Optional, Tuple
-import pandas as pd
 import numpy as np
-import os
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import train_test_split
@@ -27,6 +25,8 @@ from sklearn.model_selection import train_test_split
 from nvflare.apis.fl_context import FLContext
 from nvflare.app_common.abstract.learner_spec import Learner
 
+from tabular_data import CSVChunkStream, dataset_csv_path, feature_matrix, load_columns
+
 
 class LinearLearner(Learner):
     def __init__(
@@ -37,6 +37,12 @@ class LinearLearner(Learner):
         features_columns: list = [],
         label_column: str = None,
         max_iter : int = 1,
+        dtype: str = "float32",
+        cache_data: bool = True,
+        cache_dir: str = None,
+        streaming: bool = False,
+        batch_size: int = 10000,
+        local_steps: int = None,
     ):
         super().__init__()
         self.data_path = data_path
@@ -45,6 +51,13 @@ class LinearLearner(Learner):
         self.features_columns = features_columns
         self.label_column = label_column
         self.max_iter = max_iter
+        self.dtype = dtype
+        self.cache_data = cache_data
+        self.cache_dir = cache_dir
+        self.streaming = streaming
+        self.batch_size = batch_size
+        self.local_steps = local_steps
+        self.stream = None
         self.n_samples = None
         self.local_model = None
         self.n_features = None
@@ -54,24 +67,46 @@ class LinearLearner(Learner):
         self.y_valid = None
 
     def load_data(self):
-        # Get data
-        dataset_uid = next(os.walk(self.data_path))[1][0]
-        if self.features_columns:
-            self.features_columns.append(self.label_column)
-            df_train = pd.read_csv(f'{self.data_path}/{dataset_uid}/dataset.csv', usecols=self.features_columns)
-        else:
-            df_train = pd.read_csv(f'{self.data_path}/{dataset_uid}/dataset.csv')
+        # Get data, reading only the needed columns (cached across jobs, see tabular_data.py)
+        data = load_columns(
+            dataset_csv_path(self.data_path),
+            columns=[*self.features_columns, self.label_column] if self.features_columns else None,
+            dtype=self.dtype,
+            use_cache=self.cache_data,
+            cache_dir=self.cache_dir,
+        )
+        features_columns = self.features_columns or [column for column in data if column != self.label_column]
+        x_train = feature_matrix(data, features_columns)
+        y_train = np.array(data[self.label_column])
         x_valid, y_valid = None, None
-        if self.test_size > 0:
-            df_train, df_valid = train_test_split(df_train, test_size=self.test_size, random_state=self.random_state)
-            x_valid = df_valid.drop(self.label_column, axis=1).values
-            y_valid = df_valid[self.label_column].values
-
-        x_train = df_train.drop(self.label_column, axis=1).values
-        y_train = df_train[self.label_column].values
+        if self.test_size:
+            x_train, x_valid, y_train, y_valid = train_test_split(
+                x_train, y_train, test_size=self.test_size, random_state=self.random_state)
         return x_train, y_train, x_valid, y_valid
 
+    def open_stream(self):
+        # Stream row chunks from the CSV file instead of loading it, so that it does not have to fit in memory
+        if self.test_size:
+            print("test_size is not supported in streaming mode.")
+            raise ValueError("test_size is not supported in streaming mode.")
+        return CSVChunkStream(
+            dataset_csv_path(self.data_path),
+            columns=[*self.features_columns, self.label_column] if self.features_columns else None,
+            dtype=self.dtype,
+            chunksize=self.batch_size,
+        )
+
+    def chunk_data(self, chunk):
+        features_columns = [column for column in chunk if column != self.label_column]
+        return np.column_stack([chunk[column] for column in features_columns]), chunk[self.label_column]
+
     def initialize(self, fl_ctx: FLContext):
+        if self.streaming:
+            self.log_info(fl_ctx, f"Streaming data from {self.data_path} in chunks of {self.batch_size} rows")
+            self.stream = self.open_stream()
+            self.n_features = len(self.stream.columns) - 1
+            # the number of samples is set each round, to the number of rows trained on
+            return
         self.log_info(fl_ctx, f"Loading data from {self.data_path}")
         self.X_train, self.y_train, self.X_valid, self.y_valid = self.load_data()
         # train data size, to be used for setting
@@ -105,10 +140,24 @@ class LinearLearner(Learner):
             self.local_model.coef_ = np.zeros((1, self.n_features))
             if fit_intercept:
                 self.local_model.intercept_ = np.zeros((1,))
-        # Training starting from global model
-        # Note that the parameter update using global model has been performed
-        # during global model evaluation
-        self.local_model.fit(self.X_train, self.y_train)
+        if self.streaming:
+            if curr_round > 0:
+                self.set_parameters(global_param)
+            # Training starting from global model, with one SGD pass over each of the next local_steps chunks (or
+            # the chunks up to the end of the current pass over the data), so that the round time does not depend
+            # on the size of the data. The number of rows is reported as the number of steps, to weight the model.
+            n_rows = 0
+            for chunk in self.stream.read(self.local_steps):
+                x, y = self.chunk_data(chunk)
+                self.local_model.partial_fit(x.astype(self.local_model.coef_.dtype), y, classes=self.local_model.classes_)
+                n_rows += len(y)
+            self.n_samples = n_rows
+            self.log_info(fl_ctx, f"Round {curr_round} trained on {n_rows} rows, {self.stream.passes} passes over the data so far")
+        else:
+            # Training starting from global model
+            # Note that the parameter update using global model has been performed
+            # during global model evaluation
+            self.local_model.fit(self.X_train, self.y_train)
         if self.local_model.fit_intercept:
             params = {
                 "coef": self.local_model.coef_,
@@ -125,7 +174,19 @@ class LinearLearner(Learner):
 
         return copy.deepcopy(params), self.local_model
 
+    def validate(self, curr_round: int, global_param: Optional[dict], fl_ctx: FLContext) -> Tuple[dict, dict]:
+        # set the global model for the evaluation
+        self.set_parameters(global_param)
+        metrics = {}
+        if self.X_valid is not None:
+            metrics["accuracy"] = self.local_model.score(self.X_valid, self.y_valid)
+        elif self.X_train is not None:
+            metrics["accuracy"] = self.local_model.score(self.X_train, self.y_train)
+        self.log_info(fl_ctx, f"Round {curr_round} global model {metrics}")
+        return metrics, self.local_model
 
     def finalize(self, fl_ctx: FLContext):
         # freeing resources in finalize
+        if self.stream is not None:
+            self.stream.close()
         self.log_info(fl_ctx, "Freed training resources")
@@ -0,0 +1,179 @@
+# Copyright (c) 2025, Rhino HealthTech, Inc.
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR_NAME = ".column_cache"
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def dataset_csv_path(data_path):
+    dataset_uid = next(os.walk(data_path))[1][0]
+    return f"{data_path}/{dataset_uid}/dataset.csv"
+
+
+def file_hash(path):
+    """Hash of the content of the file, which keys its cache"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _column_file_prefix(cache_dir, column, dtype):
+    column_hash = hashlib.blake2b(column.encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f"{column_hash}.{dtype}")
+
+
+def _save_array(path, array):
+    # Written to a temporary file first, so that concurrent jobs never memory-map a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, array, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def _load_cached(prefix):
+    if os.path.exists(f"{prefix}.npy"):
+        return np.load(f"{prefix}.npy", mmap_mode="r")
+    if os.path.exists(f"{prefix}.codes.npy") and os.path.exists(f"{prefix}.categories.npy"):
+        codes = np.load(f"{prefix}.codes.npy", mmap_mode="r")
+        categories = np.load(f"{prefix}.categories.npy")
+        return pd.Categorical.from_codes(codes, categories)
+    return None
+
+
+def _save_cached(prefix, values):
+    if isinstance(values, pd.Categorical):
+        _save_array(f"{prefix}.codes.npy", values.codes)
+        _save_array(f"{prefix}.categories.npy", np.asarray(values.categories, dtype=str))
+    else:
+        _save_array(f"{prefix}.npy", values)
+
+
+def _parse_column(series, dtype):
+    # Numeric columns get the compact dtype, the other ones are categorical
+    try:
+        return pd.to_numeric(series).to_numpy(dtype=dtype)
+    except (ValueError, TypeError):
+        values = pd.Categorical(series.astype(str))
+        codes_dtype = np.int16 if len(values.categories) < np.iinfo(np.int16).max else np.int32
+        return pd.Categorical.from_codes(values.codes.astype(codes_dtype), values.categories)
+
+
+def load_columns(csv_path, columns=None, dtype="float32", use_cache=True, cache_dir=None):
+    """
+    Load the given columns (or all of them) of a CSV file, as a dict of column name -> values, in the order of the
+    columns. Numeric columns are arrays of dtype, the other ones are pd.Categorical.
+
+    The parsed columns are cached as .npy files (in cache_dir, or next to the CSV file), keyed by the hash of the
+    file's content, so later loads of the same file memory-map them instead of parsing the CSV again. Only the missing
+    columns are parsed, and if the cache can not be written (e.g. a read-only dataset), the columns are parsed every time.
+    """
+    dtype = np.dtype(dtype).name
+    header = list(pd.read_csv(csv_path, nrows=0).columns)
+    columns = header if columns is None else list(dict.fromkeys(columns))
+    absent = [column for column in columns if column not in header]
+    if absent:
+        print(f"Columns {absent} are not in {csv_path}.")
+        raise ValueError(f"Columns {absent} are not in {csv_path}.")
+
+    prefixes = {}
+    if use_cache:
+        cache_dir = os.path.join(cache_dir or os.path.dirname(os.path.abspath(csv_path)), CACHE_DIR_NAME,
+                                 file_hash(csv_path))
+        prefixes = {column: _column_file_prefix(cache_dir, column, dtype) for column in columns}
+
+    data = {}
+    for column, prefix in prefixes.items():
+        values = _load_cached(prefix)
+        if values is not None:
+            data[column] = values
+    missing = [column for column in columns if column not in data]
+    if missing:
+        print(f"Parsing columns {missing} of {csv_path}")
+        df = pd.read_csv(csv_path, usecols=missing)
+        for column in missing:
+            data[column] = _parse_column(df.pop(column), dtype)
+        if use_cache:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                for column in missing:
+                    _save_cached(prefixes[column], data[column])
+            except OSError as e:
+                print(f"Could not write the column cache in {cache_dir}, parsing the CSV file every time: {e}")
+    return {column: data[column] for column in columns}
+
+
+def feature_matrix(data, feature_columns):
+    """Stack the given numeric columns into a (samples, features) array"""
+    categorical = [column for column in feature_columns if isinstance(data[column], pd.Categorical)]
+    if categorical:
+        print(f"Feature columns {categorical} are not numeric.")
+        raise ValueError(f"Feature columns {categorical} are not numeric.")
+    return np.column_stack([data[column] for column in feature_columns])
+
+
+class CSVChunkStream:
+    """
+    Row chunks of the given (or all) numeric columns of a CSV file, read lazily so that only one chunk is in memory at a time.
+    Each read continues from where the previous one stopped, and restarts from the first row after the last one.
+    """
+
+    def __init__(self, csv_path, columns=None, dtype="float32", chunksize=10000):
+        header = list(pd.read_csv(csv_path, nrows=0).columns)
+        columns = header if columns is None else list(dict.fromkeys(columns))
+        absent = [column for column in columns if column not in header]
+        if absent:
+            print(f"Columns {absent} are not in {csv_path}.")
+            raise ValueError(f"Columns {absent} are not in {csv_path}.")
+        if pd.read_csv(csv_path, usecols=columns[:1], nrows=1).empty:
+            print(f"{csv_path} has no rows.")
+            raise ValueError(f"{csv_path} has no rows.")
+        self.csv_path = csv_path
+        self.columns = columns
+        self.dtype = dtype
+        self.chunksize = chunksize
+        self.passes = 0  # Number of complete passes over the file
+        self._reader = None
+
+    def _open(self):
+        return pd.read_csv(self.csv_path, usecols=self.columns, dtype={column: self.dtype for column in self.columns},
+                           chunksize=self.chunksize)
+
+    def _next_chunk(self):
+        if self._reader is None:
+            self._reader = self._open()
+        try:
+            return next(self._reader)
+        except ValueError as e:
+            print(f"Streaming requires numeric columns: {e}")
+            raise ValueError(f"Streaming requires numeric columns: {e}")
+        except StopIteration:
+            self._reader.close()
+            self._reader = None
+            self.passes += 1
+            return None
+
+    def read(self, max_chunks=None):
+        """
+        Yield up to max_chunks chunks, as dicts of column name -> array, wrapping around the end of the file.
+        Without max_chunks, yield the chunks up to the end of the current pass.
+        """
+        n_chunks = 0
+        while max_chunks is None or n_chunks < max_chunks:
+            chunk = self._next_chunk()
+            if chunk is None:
+                if max_chunks is None:
+                    return
+                continue
+            n_chunks += 1
+            yield {column: chunk[column].to_numpy() for column in self.columns}
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
@@ -17,9 +17,7 @@
 
 import copy
 from typing import Optional, Tuple
-import pandas as pd
 import numpy as np
-import os
 # from sklearn.linear_model import SGDClassifier
 from sklearn.linear_model import PoissonRegressor
 from sklearn.metrics import roc_auc_score
@@ -28,6 +26,9 @@ from sklearn.model_selection import train_test_split
 from nvflare.apis.fl_context import FLContext
 from nvflare.app_common.abstract.learner_spec import Learner
 
+from poisson_newton import MAX_LINEAR_PREDICTOR, PoissonNewton, mean_half_poisson_deviance
+from tabular_data import dataset_csv_path, feature_matrix, load_columns
+
 
 class PoissonLearner(Learner):
     def __init__(
@@ -38,6 +39,11 @@ class PoissonLearner(Learner):
         features_columns: list = [],
         label_column: str = None,
         max_iter: int = 1,
+        offset_column: str = None,
+        exposure_column: str = None,
+        dtype: str = "float32",
+        cache_data: bool = True,
+        cache_dir: str = None,
     ):
         super().__init__()
         self.data_path = data_path
@@ -46,35 +52,57 @@ class PoissonLearner(Learner):
         self.features_columns = features_columns
         self.label_column = label_column
         self.max_iter = max_iter
+        self.offset_column = offset_column
+        self.exposure_column = exposure_column
+        self.dtype = dtype
+        self.cache_data = cache_data
+        self.cache_dir = cache_dir
         self.n_samples = None
         self.local_model = None
+        self.newton = None
         self.n_features = None
         self.X_train = None
         self.y_train = None
         self.X_valid = None
         self.y_valid = None
+        self.offset_train = None
+        self.offset_valid = None
 
     def load_data(self):
-        # Get data
-        dataset_uid = next(os.walk(self.data_path))[1][0]
-        if self.features_columns:
-            self.features_columns.append(self.label_column)
-            df_train = pd.read_csv(f'{self.data_path}/{dataset_uid}/dataset.csv', usecols=self.features_columns)
-        else:
-            df_train = pd.read_csv(f'{self.data_path}/{dataset_uid}/dataset.csv')
-        x_valid, y_valid = None, None
-        if self.test_size > 0:
-            df_train, df_valid = train_test_split(df_train, test_size=self.test_size, random_state=self.random_state)
-            x_valid = df_valid.drop(self.label_column, axis=1).values
-            y_valid = df_valid[self.label_column].values
-
-        x_train = df_train.drop(self.label_column, axis=1).values
-        y_train = df_train[self.label_column].values
-        return x_train, y_train, x_valid, y_valid
+        # Get data, reading only the needed columns (cached across jobs, see tabular_data.py)
+        offset_columns = [column for column in (self.offset_column, self.exposure_column) if column]
+        data = load_columns(
+            dataset_csv_path(self.data_path),
+            columns=[*self.features_columns, self.label_column, *offset_columns] if self.features_columns else None,
+            dtype=self.dtype,
+            use_cache=self.cache_data,
+            cache_dir=self.cache_dir,
+        )
+        features_columns = self.features_columns or [
+            column for column in data if column != self.label_column and column not in offset_columns
+        ]
+        x_train = feature_matrix(data, features_columns)
+        y_train = np.array(data[self.label_column])
+        # The offset of the linear predictor: the given offset, or the log of the exposure
+        offset_train = None
+        if self.offset_column:
+            offset_train = np.array(data[self.offset_column], dtype=np.float64)
+        elif self.exposure_column:
+            offset_train = np.log(np.array(data[self.exposure_column], dtype=np.float64))
+        x_valid, y_valid, offset_valid = None, None, None
+        if self.test_size:
+            if offset_train is None:
+                x_train, x_valid, y_train, y_valid = train_test_split(
+                    x_train, y_train, test_size=self.test_size, random_state=self.random_state)
+            else:
+                x_train, x_valid, y_train, y_valid, offset_train, offset_valid = train_test_split(
+                    x_train, y_train, offset_train, test_size=self.test_size, random_state=self.random_state)
+        return x_train, y_train, x_valid, y_valid, offset_train, offset_valid
 
     def initialize(self, fl_ctx: FLContext):
         self.log_info(fl_ctx, f"Loading data from {self.data_path}")
-        self.X_train, self.y_train, self.X_valid, self.y_valid = self.load_data()
+        (self.X_train, self.y_train, self.X_valid, self.y_valid,
+         self.offset_train, self.offset_valid) = self.load_data()
         # train data size, to be used for setting
         self.n_samples = self.X_train.shape[0]
         self.n_features = self.X_train.shape[1]
@@ -90,22 +118,49 @@ class PoissonLearner(Learner):
             # initialize model with global_param
             # and set to all zero
             # fit_intercept = bool(global_param["fit_intercept"])
+            solver = global_param["solver"]
+            if solver == "newton":
+                # Exact fit of the model over the data of all sites by federated Newton (see poisson_newton.py)
+                self.newton = PoissonNewton(
+                    self.X_train,
+                    self.y_train,
+                    offset=self.offset_train,
+                    alpha=global_param["alpha"],
+                    fit_intercept=bool(global_param["fit_intercept"]),
+                    tol=global_param["tol"],
+                )
+                # The sklearn model only holds the global coefficients, it is never fitted locally
+                solver = "lbfgs"
+            elif self.offset_train is not None:
+                print(f"An offset or exposure column requires the newton solver, got {solver}.")
+                raise ValueError(f"An offset or exposure column requires the newton solver, got {solver}.")
             self.local_model = PoissonRegressor(
                 alpha=global_param["alpha"],
                 fit_intercept=global_param["fit_intercept"],
-                solver=global_param["solver"],
+                solver=solver,
                 tol=global_param["tol"],
                 max_iter=self.max_iter,
-                warm_start=False,
+                warm_start=True,
             )
             n_classes = global_param["n_classes"]
             self.local_model.classes_ = np.array(list(range(n_classes)))
-            self.local_model.coef_ = np.zeros((1, self.n_features))
-            if global_param["fit_intercept"]:
-                self.local_model.intercept_ = np.zeros((1,))
-        # Training starting from global model
-        # Note that the parameter update using global model has been performed
-        # during global model evaluation
+            self.local_model.coef_ = np.zeros(self.n_features)
+            self.local_model.intercept_ = 0.
+            if "coef" in global_param:
+                # Warm start from the coefficients of a previous model
+                if self.newton is not None:
+                    self.newton.set_start(global_param)
+                else:
+                    self.set_parameters(global_param)
+
+        if self.newton is not None:
+            params = self.newton.train(curr_round, global_param)
+            self.set_parameters(params)
+            return copy.deepcopy(params), self.local_model
+
+        if curr_round > 0:
+            # Training starting from global model
+            self.set_parameters(global_param)
         self.local_model.fit(self.X_train, self.y_train)
         if self.local_model.fit_intercept:
             params = {
@@ -123,6 +178,24 @@ class PoissonLearner(Learner):
 
         return copy.deepcopy(params), self.local_model
 
+    def validate(self, curr_round: int, global_param: Optional[dict], fl_ctx: FLContext) -> Tuple[dict, dict]:
+        # set the global model for the evaluation
+        self.set_parameters(global_param)
+        if self.X_valid is not None:
+            x, y, offset = self.X_valid, self.y_valid, self.offset_valid
+        else:
+            x, y, offset = self.X_train, self.y_train, self.offset_train
+        eta = x.dot(np.ravel(self.local_model.coef_)) + np.ravel(self.local_model.intercept_)
+        if offset is not None:
+            eta = eta + offset
+        mu = np.exp(np.minimum(eta, MAX_LINEAR_PREDICTOR))
+        metrics = {"deviance": 2 * mean_half_poisson_deviance(y, mu)}
+        if "deviance" in global_param:
+            # Mean Poisson deviance of the global model on the training data of all sites
+            metrics["global_deviance"] = 2 * float(global_param["deviance"])
+        self.log_info(fl_ctx, f"Round {curr_round} global model {metrics}")
+        return metrics, self.local_model
+
     def finalize(self, fl_ctx: FLContext):
         # freeing resources in finalize
         self.log_info(fl_ctx, "Freed training resources")
@@ -0,0 +1,132 @@
+# Copyright (c) 2025, Rhino HealthTech, Inc.
+
+import numpy as np
+from scipy.special import xlogy
+
+# Bound on the linear predictor, so that exp() does not overflow on a bad step
+MAX_LINEAR_PREDICTOR = 700.
+
+
+def mean_half_poisson_deviance(y, mu):
+    return float(np.mean(xlogy(y, y / mu) - y + mu))
+
+
+class PoissonNewton:
+    """
+    The local part of a federated Newton fit of a Poisson regression, with the objective of sklearn's
+    PoissonRegressor over the data of all sites: the mean half Poisson deviance plus alpha / 2 * ||coef||^2.
+    The linear predictor is X @ coef + intercept + offset, where the offset is e.g. the log of the exposure.
+
+    Each round, every site sends the mean deviance, gradient and Hessian (X^T W X / n) of its data at the current
+    coefficients. The aggregator averages them weighted by the number of samples, which gives the exact global ones,
+    and every site then takes the same Newton step from the global gradient and Hessian. If a step increases the
+    global objective, it is halved instead, so the fit converges from any starting point. Without a warm start, the
+    first Newton step starts from the intercept-only fit, log(mean(y) / mean(exp(offset))) over all sites.
+
+    All sites see the same averages, so they all stop at the same round once the Newton decrement is within tol.
+    After that they keep sending the converged model.
+    """
+
+    def __init__(self, X, y, offset=None, alpha=1.0, fit_intercept=True, tol=1e-8, max_halvings=30):
+        X = np.asarray(X, dtype=np.float64)
+        self.n_features = X.shape[1]
+        self.fit_intercept = fit_intercept
+        if fit_intercept:
+            X = np.hstack([X, np.ones((X.shape[0], 1))])
+        self.X = np.ascontiguousarray(X)
+        self.y = np.asarray(y, dtype=np.float64).ravel()
+        self.offset = np.zeros(len(self.y)) if offset is None else np.asarray(offset, dtype=np.float64).ravel()
+        self.alpha = alpha
+        self.tol = tol
+        self.max_halvings = max_halvings
+        n_params = self.X.shape[1]
+        # The intercept is not penalized
+        self.penalty = np.where(np.arange(n_params) < self.n_features, alpha, 0.)
+
+        self.beta = np.zeros(n_params)  # The coefficients evaluated this round
+        self.accepted_beta = None  # The last coefficients that decreased the global objective
+        self.accepted_objective = None
+        self.step = None
+        self.halvings = 0
+        self.warm_started = False
+        self.converged = False
+        self.last_params = None
+
+    def set_start(self, params):
+        """Warm start from the coefficients of a previous (e.g. global) model"""
+        coef = np.asarray(params["coef"], dtype=np.float64).ravel()
+        if coef.shape != (self.n_features,):
+            print(f"Warm start coefficients have shape {coef.shape}, expected ({self.n_features},). Starting from zero.")
+            return
+        self.beta[:self.n_features] = coef
+        if self.fit_intercept and "intercept" in params:
+            self.beta[self.n_features:] = np.asarray(params["intercept"], dtype=np.float64).ravel()
+        self.warm_started = True
+
+    def _unpack(self, params):
+        coef = np.asarray(params["coef"], dtype=np.float64).ravel()
+        if self.fit_intercept:
+            return np.append(coef, np.asarray(params["intercept"], dtype=np.float64).ravel())
+        return coef
+
+    def _local_statistics(self):
+        eta = np.minimum(self.X.dot(self.beta) + self.offset, MAX_LINEAR_PREDICTOR)
+        mu = np.exp(eta)
+        n_samples = len(self.y)
+        return {
+            "deviance": np.asarray(mean_half_poisson_deviance(self.y, mu)),
+            "gradient": self.X.T.dot(mu - self.y) / n_samples,
+            "hessian": (self.X.T * mu).dot(self.X) / n_samples,
+            "mean_label": np.asarray(np.mean(self.y)),
+            "mean_exposure": np.asarray(np.mean(np.exp(self.offset))),
+        }
+
+    def _newton_step(self, global_param):
+        beta = self.beta
+        objective = float(global_param["deviance"]) + 0.5 * float(np.sum(self.penalty * beta ** 2))
+        if self.accepted_objective is not None and not objective <= self.accepted_objective:
+            if self.halvings >= self.max_halvings:
+                print("Poisson Newton step can not decrease the objective any more, stopping.")
+                self.beta = self.accepted_beta
+                return True
+            self.halvings += 1
+            self.step = self.step / 2
+            self.beta = self.accepted_beta + self.step
+            return False
+
+        self.accepted_beta, self.accepted_objective, self.halvings = beta, objective, 0
+        gradient = np.asarray(global_param["gradient"], dtype=np.float64).ravel() + self.penalty * beta
+        hessian = np.asarray(global_param["hessian"], dtype=np.float64) + np.diag(self.penalty)
+        try:
+            self.step = np.linalg.solve(hessian, -gradient)
+        except np.linalg.LinAlgError:
+            self.step = np.linalg.lstsq(hessian, -gradient, rcond=None)[0]
+        # Half the Newton decrement estimates how far the objective is from its minimum
+        if -0.5 * float(gradient.dot(self.step)) <= self.tol * max(1., abs(objective)):
+            print(f"Poisson Newton converged, objective {objective}")
+            self.beta = beta + self.step
+            return True
+        self.beta = beta + self.step
+        return False
+
+    def train(self, curr_round, global_param):
+        """One Newton round. Returns the parameters to send to the server."""
+        if self.converged:
+            return self.last_params
+        if curr_round == 1 and self.fit_intercept and not self.warm_started and float(global_param["mean_label"]) > 0:
+            self.beta = np.zeros_like(self.beta)
+            self.beta[self.n_features] = np.log(float(global_param["mean_label"]) / float(global_param["mean_exposure"]))
+        elif curr_round > 0:
+            self.beta = self._unpack(global_param)
+            if self._newton_step(global_param):
+                self.converged = True
+                self.last_params["coef"] = self.beta[:self.n_features]
+                if self.fit_intercept:
+                    self.last_params["intercept"] = self.beta[self.n_features:]
+                return self.last_params
+
+        params = {"coef": self.beta[:self.n_features], **self._local_statistics()}
+        if self.fit_intercept:
+            params["intercept"] = self.beta[self.n_features:]
+        self.last_params = params
+        return params
@@ -0,0 +1,149 @@
+# Copyright (c) 2025, Rhino HealthTech, Inc.
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+
+def pinball_loss(residual, quantile):
+    """Mean check (pinball) loss of the residuals y - X @ beta"""
+    return float(np.mean(np.maximum(quantile * residual, (quantile - 1) * residual)))
+
+
+def soft_threshold(value, threshold):
+    return np.sign(value) * np.maximum(np.abs(value) - threshold, 0.)
+
+
+class QuantileADMM:
+    """
+    The local part of a consensus ADMM fit of a federated quantile regression, with the objective of sklearn's
+    QuantileRegressor over the data of all sites: the mean pinball loss plus alpha * ||coef||_1.
+
+    Each round, every site:
+    - computes the consensus z from the average of beta + u over the sites (weighted by the number of samples, as
+      done by the aggregator), by soft-thresholding it with alpha / rho (the intercept is not penalized)
+    - updates its scaled dual u with beta - z
+    - solves its proximal subproblem, min_beta mean_pinball_loss(y - X @ beta) + rho / 2 * ||beta - z + u||^2,
+      with local_iters iterations of an inner ADMM on the residuals r = y - X @ beta. Each inner iteration is a
+      solve with a Cholesky factorization computed once, and two products with X, and the inner ADMM is
+      warm-started from the previous round.
+    - rescales rho when the global primal and dual residuals are out of balance, so the starting rho matters little
+    - sends z (as the model coefficients), beta + u, and the exact mean pinball loss at z and ||beta - z||^2 on its
+      data, which the aggregator averages to the exact global objective and primal residual
+
+    All sites see the same averages, so they all stop at the same round once the global objective, the primal
+    residual and the change of z are within tol. After that they keep sending the converged model without any
+    further solves.
+    """
+
+    def __init__(self, X, y, quantile=0.5, alpha=1.0, fit_intercept=True, rho=1.0, local_iters=20, tol=1e-4,
+                 sigma=None):
+        X = np.asarray(X, dtype=np.float64)
+        self.n_features = X.shape[1]
+        self.fit_intercept = fit_intercept
+        if fit_intercept:
+            X = np.hstack([X, np.ones((X.shape[0], 1))])
+        self.X = np.ascontiguousarray(X)
+        self.y = np.asarray(y, dtype=np.float64).ravel()
+        self.quantile = quantile
+        self.alpha = alpha
+        self.rho = rho
+        self.local_iters = local_iters
+        self.tol = tol
+        n_samples, n_params = self.X.shape
+        self.penalized = np.arange(n_params) < self.n_features
+        # Penalty of the inner ADMM, in units of 1 / residual
+        self.sigma = sigma or 1. / max(float(np.std(self.y)), 1e-12)
+        self.gram = self.X.T.dot(self.X) / n_samples
+        self.chol = cho_factor(rho * np.eye(n_params) + self.sigma * self.gram)
+
+        self.beta = np.zeros(n_params)
+        self.u = np.zeros(n_params)
+        self.residual = self.y.copy()
+        self.residual_dual = np.zeros(n_samples)
+        self.prev_objective = None
+        self.converged = False
+        self.last_params = None
+
+    def consensus(self, average):
+        return np.where(self.penalized, soft_threshold(average, self.alpha / self.rho), average)
+
+    def objective(self, z, mean_loss):
+        return mean_loss + self.alpha * float(np.abs(z[self.penalized]).sum())
+
+    def _solve_local(self, target):
+        """A few iterations of the inner ADMM for min_beta mean_pinball_loss(y - X @ beta) + rho / 2 * ||beta - target||^2"""
+        X, y = self.X, self.y
+        n_samples = len(y)
+        # The pinball loss is piecewise linear with slopes quantile and quantile - 1, so its prox is a shrinkage
+        lower, upper = -(1 - self.quantile) / self.sigma, self.quantile / self.sigma
+        for _ in range(self.local_iters):
+            rhs = self.rho * target + self.sigma / n_samples * X.T.dot(y - self.residual + self.residual_dual)
+            self.beta = cho_solve(self.chol, rhs)
+            value = y - X.dot(self.beta) + self.residual_dual
+            self.residual = value - np.clip(value, lower, upper)
+            self.residual_dual = value - self.residual
+
+    def _balance_residuals(self, primal_residual, dual_residual):
+        """
+        Scale rho so that the primal and dual residuals stay within a factor of 10 of each other (Boyd et al.,
+        Distributed Optimization and Statistical Learning via ADMM, section 3.4.1). The residuals are global, so all
+        sites make the same change.
+        """
+        if primal_residual > 10 * dual_residual:
+            factor = 2.
+        elif dual_residual > 10 * primal_residual:
+            factor = 0.5
+        else:
+            return
+        self.rho *= factor
+        self.u /= factor
+        self.chol = cho_factor(self.rho * np.eye(len(self.beta)) + self.sigma * self.gram)
+
+    def _unpack(self, params):
+        coef = np.asarray(params["coef"], dtype=np.float64).ravel()
+        if self.fit_intercept:
+            return np.append(coef, np.asarray(params["intercept"], dtype=np.float64).ravel())
+        return coef
+
+    def _has_converged(self, global_param, z_prev, z):
+        objective = self.objective(z_prev, float(global_param["objective"]))
+        prev_objective, self.prev_objective = self.prev_objective, objective
+        if prev_objective is None:
+            return False
+        scale = max(1., float(np.linalg.norm(z_prev)))
+        return (
+            abs(objective - prev_objective) <= self.tol * max(1., abs(objective))
+            and np.sqrt(float(global_param["primal_residual"])) <= self.tol * scale
+            and float(np.linalg.norm(z - z_prev)) <= self.tol * scale
+        )
+
+    def train(self, curr_round, global_param):
+        """One ADMM round. Returns the parameters to send to the server."""
+        if self.converged:
+            return self.last_params
+        if curr_round == 0:
+            z = np.zeros_like(self.beta)
+            primal_residual = 0.
+        else:
+            z_prev = self._unpack(global_param)
+            z = self.consensus(np.asarray(global_param["admm_consensus"], dtype=np.float64))
+            if self._has_converged(global_param, z_prev, z):
+                print(f"ADMM converged at round {curr_round}, objective {self.prev_objective}")
+                self.converged = True
+                return self.last_params
+            primal_residual = float(np.sum((self.beta - z) ** 2))
+            self.u += self.beta - z
+            self._balance_residuals(np.sqrt(float(global_param["primal_residual"])),
+                                    self.rho * float(np.linalg.norm(z - z_prev)))
+        self._solve_local(z - self.u)
+
+        params = {
+            "coef": z[:self.n_features],
+            "admm_consensus": self.beta + self.u,
+            "objective": np.asarray(pinball_loss(self.y - self.X.dot(z), self.quantile)),
+            "primal_residual": np.asarray(primal_residual),
+        }
+        if self.fit_intercept:
+            params["intercept"] = z[self.n_features:]
+        self.last_params = params
+        return params
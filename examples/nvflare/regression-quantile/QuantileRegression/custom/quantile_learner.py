@@ -18,15 +18,16 @@
 
 import copy
 from typing import Optional, Tuple
-import pandas as pd
 import numpy as np
-import os
 from sklearn.linear_model import QuantileRegressor
 from sklearn.model_selection import train_test_split
 
 from nvflare.apis.fl_context import FLContext
 from nvflare.app_common.abstract.learner_spec import Learner
 
+from quantile_admm import QuantileADMM, pinball_loss
+from tabular_data import dataset_csv_path, feature_matrix, load_columns
+
 
 class QuantileLearner(Learner):
     def __init__(
@@ -37,6 +38,9 @@ class QuantileLearner(Learner):
         feature_columns: list = None,
         label_column: str = None,
         max_iter: int = 1,
+        dtype: str = "float32",
+        cache_data: bool = True,
+        cache_dir: str = None,
     ):
         super().__init__()
         self.data_path = data_path
@@ -45,8 +49,12 @@ class QuantileLearner(Learner):
         self.feature_columns = feature_columns
         self.label_column = label_column
         self.max_iter = max_iter
+        self.dtype = dtype
+        self.cache_data = cache_data
+        self.cache_dir = cache_dir
         self.n_samples = None
         self.local_model = None
+        self.admm = None
         self.n_features = None
         self.X_train = None
         self.y_train = None
@@ -54,21 +62,21 @@ class QuantileLearner(Learner):
         self.y_valid = None
 
     def load_data(self):
-        # Get data
-        dataset_uid = next(os.walk(self.data_path))[1][0]
-        if self.feature_columns:
-            self.feature_columns.append(self.label_column)
-            df_train = pd.read_csv(f'{self.data_path}/{dataset_uid}/dataset.csv', usecols=self.feature_columns)
-        else:
-            df_train = pd.read_csv(f'{self.data_path}/{dataset_uid}/dataset.csv')
+        # Get data, reading only the needed columns (cached across jobs, see tabular_data.py)
+        data = load_columns(
+            dataset_csv_path(self.data_path),
+            columns=[*self.feature_columns, self.label_column] if self.feature_columns else None,
+            dtype=self.dtype,
+            use_cache=self.cache_data,
+            cache_dir=self.cache_dir,
+        )
+        feature_columns = self.feature_columns or [column for column in data if column != self.label_column]
+        x_train = feature_matrix(data, feature_columns)
+        y_train = np.array(data[self.label_column])
         x_valid, y_valid = None, None
-        if self.test_size > 0:
-            df_train, df_valid = train_test_split(df_train, test_size=self.test_size, random_state=self.random_state)
-            x_valid = df_valid.drop(self.label_column, axis=1).values
-            y_valid = df_valid[self.label_column].values
-
-        x_train = df_train.drop(self.label_column, axis=1).values
-        y_train = df_train[self.label_column].values
+        if self.test_size:
+            x_train, x_valid, y_train, y_valid = train_test_split(
+                x_train, y_train, test_size=self.test_size, random_state=self.random_state)
         return x_train, y_train, x_valid, y_valid
 
     def initialize(self, fl_ctx: FLContext):
@@ -88,11 +96,26 @@ class QuantileLearner(Learner):
         if curr_round == 0:
             # initialize model with global_param
             # and set to all zero
+            solver = global_param["solver"]
+            if solver == "admm":
+                # Exact fit of the model over the data of all sites by consensus ADMM (see quantile_admm.py)
+                self.admm = QuantileADMM(
+                    self.X_train,
+                    self.y_train,
+                    quantile=global_param["quantile"],
+                    alpha=global_param["alpha"],
+                    fit_intercept=bool(global_param["fit_intercept"]),
+                    rho=global_param.get("rho", 1.0),
+                    local_iters=int(global_param.get("local_iters", 20)),
+                    tol=global_param.get("tol", 1e-4),
+                )
+                # The sklearn model only holds the consensus coefficients, it is never fitted locally
+                solver = "highs"
             self.local_model = QuantileRegressor(
                 quantile=global_param["quantile"],
                 alpha=global_param["alpha"],
                 fit_intercept=bool(global_param["fit_intercept"]),
-                solver=global_param["solver"],
+                solver=solver,
                 solver_options=global_param.get("solver_options"),
             )
             n_classes = global_param["n_classes"]
@@ -100,6 +123,13 @@ class QuantileLearner(Learner):
             self.local_model.coef_ = np.zeros((1, self.n_features))
             if global_param["fit_intercept"]:
                 self.local_model.intercept_ = np.zeros((1,))
+            else:
+                self.local_model.intercept_ = 0.
+
+        if self.admm is not None:
+            params = self.admm.train(curr_round, global_param)
+            self.set_parameters(params)
+            return copy.deepcopy(params), self.local_model
 
         # Training starting from global model
         # Note that the parameter update using global model has been performed
@@ -115,6 +145,20 @@ class QuantileLearner(Learner):
 
         return copy.deepcopy(params), self.local_model
 
+    def validate(self, curr_round: int, global_param: Optional[dict], fl_ctx: FLContext) -> Tuple[dict, dict]:
+        # set the global model for the evaluation
+        self.set_parameters(global_param)
+        if self.X_valid is not None:
+            x, y = self.X_valid, self.y_valid
+        else:
+            x, y = self.X_train, self.y_train
+        metrics = {"pinball_loss": pinball_loss(y - self.local_model.predict(x), self.local_model.quantile)}
+        if "objective" in global_param:
+            # Mean pinball loss of the global model on the training data of all sites
+            metrics["global_pinball_loss"] = float(global_param["objective"])
+        self.log_info(fl_ctx, f"Round {curr_round} global model {metrics}")
+        return metrics, self.local_model
+
     def finalize(self, fl_ctx: FLContext):
         # freeing resources in finalize
         self.log_info(fl_ctx, "Freed training resources")
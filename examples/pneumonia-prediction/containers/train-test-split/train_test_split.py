@@ -1,15 +1,107 @@
+import json
+
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
+DEFAULT_TEST_SIZE = 0.33
+DEFAULT_CHUNKSIZE = 100_000
+# pandas infers dtypes separately for each chunk (e.g. an integer ID is read as 123.0 in a chunk with a missing ID),
+# so the streaming split reads the values as text, which also copies them to the outputs unchanged
+STREAMING_READ_OPTIONS = {'dtype': str, 'keep_default_na': False}
+
+
+def read_params():
+	try:
+		with open('/input/run_params.json') as params_file:
+			return json.load(params_file)
+	except FileNotFoundError:
+		return {}
+
+
+def hash_to_unit(values, seed):
+	# hash_pandas_object is stable across runs and machines for a given hash_key, so the split is reproducible
+	hashes = pd.util.hash_pandas_object(values, index=False, hash_key=f'{seed:016d}'[-16:])
+	return hashes.to_numpy() / np.float64(2 ** 64)
+
+
+def count_labels(input_path, stratify_column, chunksize):
+	counts = {}
+	for chunk in pd.read_csv(input_path, usecols=[stratify_column], chunksize=chunksize, **STREAMING_READ_OPTIONS):
+		for label, count in chunk[stratify_column].value_counts().items():
+			counts[label] = counts.get(label, 0) + count
+	return counts
+
+
+class StratifiedSelector:
+	"""
+	Picks exactly round(test_size * n) test rows out of the n rows of each label in a single streaming pass
+	(selection sampling), using the label counts from a first pass and the seeded row hashes as random draws.
+	"""
+
+	def __init__(self, label_counts, test_size):
+		self.rows_left = dict(label_counts)
+		self.test_left = {label: int(round(test_size * count)) for label, count in label_counts.items()}
+
+	def __call__(self, labels, draws):
+		is_test = np.zeros(len(labels), dtype=bool)
+		for i, (label, draw) in enumerate(zip(labels, draws)):
+			if draw * self.rows_left[label] < self.test_left[label]:
+				is_test[i] = True
+				self.test_left[label] -= 1
+			self.rows_left[label] -= 1
+		return is_test
+
+
+def streaming_split(input_path, train_path, test_path, params):
+	"""
+	Split input_path into train and test sets in one pass over CSV chunks, assigning each row from a seeded
+	hash of params['id_column'], so rows sharing an ID always land on the same side.
+	With params['stratify_column'], a first pass counts the labels so that each label gets the exact test fraction
+	(rows sharing an ID may then be split, since the assignment also depends on the row order).
+	"""
+	id_column = params['id_column']
+	test_size = float(params.get('test_size', DEFAULT_TEST_SIZE))
+	seed = int(params.get('seed', 0))
+	chunksize = int(params.get('chunksize', DEFAULT_CHUNKSIZE))
+	stratify_column = params.get('stratify_column')
+	selector = None
+	if stratify_column:
+		selector = StratifiedSelector(count_labels(input_path, stratify_column, chunksize), test_size)
+
+	with open(train_path, 'w', newline='') as train_file, open(test_path, 'w', newline='') as test_file:
+		header = pd.read_csv(input_path, nrows=0)
+		header.to_csv(train_file, index=False)
+		header.to_csv(test_file, index=False)
+		for chunk in pd.read_csv(input_path, chunksize=chunksize, **STREAMING_READ_OPTIONS):
+			draws = hash_to_unit(chunk[id_column], seed)
+			if selector is None:
+				is_test = draws < test_size
+			else:
+				is_test = selector(chunk[stratify_column], draws)
+			chunk[~is_test].to_csv(train_file, header=False, index=False)
+			chunk[is_test].to_csv(test_file, header=False, index=False)
+
 
 if __name__ == '__main__':
-	# Read cohort from /input
-	df_cohort = pd.read_csv('/input/0/cohort_data.csv')
+	params = read_params()
 
-	# Split to train and test sets
-	df_train, df_test = train_test_split(df_cohort, test_size=0.33)
+	if 'id_column' in params:
+		# Stream the input without loading it into memory
+		streaming_split('/input/0/cohort_data.csv', '/output/0/cohort_data.csv', '/output/1/cohort_data.csv', params)
+	else:
+		# Read cohort from /input
+		df_cohort = pd.read_csv('/input/0/cohort_data.csv')
 
-	# Write cohorts to /output
-	df_train.to_csv('/output/0/cohort_data.csv', index=False)
-	df_test.to_csv('/output/1/cohort_data.csv', index=False)
+		# Split to train and test sets
+		stratify_column = params.get('stratify_column')
+		df_train, df_test = train_test_split(
+			df_cohort,
+			test_size=float(params.get('test_size', DEFAULT_TEST_SIZE)),
+			random_state=params.get('seed'),
+			stratify=df_cohort[stratify_column] if stratify_column else None,
+		)
 
+		# Write cohorts to /output
+		df_train.to_csv('/output/0/cohort_data.csv', index=False)
+		df_test.to_csv('/output/1/cohort_data.csv', index=False)
@@ -5,10 +5,10 @@ import numpy as np
 from PIL import Image
 from sklearn.impute import SimpleImputer
 import glob
+from multiprocessing import Pool
 
 
-def convert_dcm_image_to_jpg(name):
-	dcm = pydicom.dcmread(name)
+def convert_dcm_image_to_jpg(dcm):
 	img = dcm.pixel_array.astype(float)
 	rescaled_image = (np.maximum(img, 0) / img.max()) * 255  # float pixels
 	final_image = np.uint8(rescaled_image)  # integers pixels
@@ -16,23 +16,39 @@ def convert_dcm_image_to_jpg(name):
 	return final_image
 
 
-def dataset_dcm_to_jpg(dataset_df):
-	input_dir = '/input/dicom_data/'
+def init_worker(labels):
+	global uid_to_label
+	uid_to_label = labels
+
+
+def convert_dcm_file(dcm_file):
 	output_dir = '/output/file_data/'
+	# read each file once, for both the pixels and the SeriesInstanceUID
+	ds = pydicom.dcmread(dcm_file)
+	image = convert_dcm_image_to_jpg(ds)
+	jpg_file_name = dcm_file.split('/')[-1].split('.dcm')[0] + '.jpg'
+	ground_truth = uid_to_label[ds.SeriesInstanceUID]
+	class_folder = output_dir + ground_truth
+	os.makedirs(class_folder, exist_ok=True)
+	image.save('/'.join([class_folder, jpg_file_name]))
+	return ds.SeriesInstanceUID, '/'.join([ground_truth, jpg_file_name])
+
+
+def dataset_dcm_to_jpg(dataset_df, num_workers=None):
+	input_dir = '/input/dicom_data/'
 	dcm_list = glob.glob(input_dir + '/*/*.dcm')
 
+	# map each SeriesUID to its first row once instead of scanning the whole frame per file
+	first_rows = dataset_df.drop_duplicates('SeriesUID')
+	uid_to_idx = dict(zip(first_rows.SeriesUID, first_rows.index))
+	labels = {uid: '1' if pneumonia else '0' for uid, pneumonia in zip(first_rows.SeriesUID, first_rows.Pneumonia)}
+
 	dataset_df['JPG file'] = 'Nan'
-	for dcm_file in dcm_list:
-		image = convert_dcm_image_to_jpg(dcm_file)
-		jpg_file_name = dcm_file.split('/')[-1].split('.dcm')[0] + '.jpg'
-		ds = pydicom.dcmread(dcm_file)
-		idx = dataset_df['Pneumonia'][dataset_df.SeriesUID == ds.SeriesInstanceUID].index[0]
-		ground_truth = '1' if dataset_df.loc[idx, 'Pneumonia'] else '0'
-		class_folder = output_dir + ground_truth
-		if not os.path.exists(class_folder):
-			os.makedirs(class_folder)
-		image.save('/'.join([class_folder, jpg_file_name]))
-		dataset_df.loc[idx, 'JPG file'] = '/'.join([ground_truth, jpg_file_name])
+	with Pool(num_workers, initializer=init_worker, initargs=(labels,)) as pool:
+		results = pool.map(convert_dcm_file, dcm_list, chunksize=8)
+	if results:
+		uids, jpg_files = zip(*results)
+		dataset_df.loc[[uid_to_idx[uid] for uid in uids], 'JPG file'] = list(jpg_files)
 
 	return dataset_df
 